@@ -0,0 +1,187 @@
+"""
+Timing comparisons between alternative implementations of the same op.
+These are not collected by pytest; run this file directly.
+"""
+from __future__ import absolute_import, division, print_function
+import time
+import shutil
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from tnn.cell import harbor, component_conv, factored_fc
+from tnn.convrnn import ConvLSTMCell
+from tnn import main, parallel, data as tnn_data
+
+BATCH_SIZE = 64
+NSTEPS = 50
+
+
+def timeit(targets, nsteps=NSTEPS, feed_dict=None):
+    """
+    Returns the mean time in seconds per sess.run of targets
+    """
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(targets, feed_dict=feed_dict)  # warm up
+        start = time.time()
+        for _ in range(nsteps):
+            sess.run(targets, feed_dict=feed_dict)
+    return (time.time() - start) / nsteps
+
+
+def benchmark_fused_gate_norm(ntimes=10, shape=(28, 28), out_depth=64):
+    """
+    ConvLSTMCell with layer norm unrolled for ntimes, with per-gate layer_norm
+    calls versus the fused gate normalization
+    """
+    data = np.random.standard_normal([BATCH_SIZE] + list(shape) + [out_depth]).astype(np.float32)
+    for fused_norm in [False, True]:
+        tf.reset_default_graph()
+        inputs = tf.constant(data)
+        cell = ConvLSTMCell(shape, [3, 3], out_depth, layer_norm=True, fused_norm=fused_norm)
+        with tf.variable_scope('lstm'):
+            state = cell.zero_state(BATCH_SIZE, tf.float32)
+        outputs = []
+        for t in range(ntimes):
+            with tf.variable_scope('lstm', reuse=t > 0):
+                output, state = cell(inputs, state)
+            outputs.append(output)
+        loss = tf.add_n([tf.reduce_mean(o) for o in outputs])
+        train_op = tf.train.GradientDescentOptimizer(.01).minimize(loss)
+        print('fused_norm={}: {:.4f} s/step'.format(fused_norm, timeit(train_op)))
+
+
+def benchmark_component_conv(ntimes=10, shape=(28, 28), depths=(64, 64, 128, 256), n_zero=2):
+    """
+    component_conv on a concat harbor versus accumulate=True on a list harbor, for a node with
+    one feedforward and several skip/feedback inputs, n_zero of which are zero stand-ins
+    """
+    harbor_shape = [BATCH_SIZE] + list(shape) + [sum(depths)]
+    data = [np.random.standard_normal([BATCH_SIZE] + list(shape) + [d]).astype(np.float32) for d in depths]
+    for accumulate in [False, True]:
+        tf.reset_default_graph()
+        inputs = [tf.constant(d, name='conv{}'.format(i)) for i, d in enumerate(data)]
+        for i in range(1, n_zero + 1):
+            inputs[-i] = tf.zeros(inputs[-i].shape, name='conv{}/standin'.format(len(inputs) - i))
+        outputs = []
+        for t in range(ntimes):
+            with tf.variable_scope('conv', reuse=t > 0):
+                channel_op = 'list' if accumulate else 'concat'
+                output = harbor(inputs, harbor_shape, 'harbor', channel_op=channel_op)
+                outputs.append(component_conv(output, inputs, out_depth=64, input_name='conv0', accumulate=accumulate))
+        print('accumulate={}: {:.4f} s/step'.format(accumulate, timeit(outputs)))
+
+
+def benchmark_factored_fc(sizes=((28, 28, 256, 1000), (14, 14, 512, 1000), (7, 7, 512, 100))):
+    """
+    factored_fc forward and backward pass with each contraction order, for (H, W, D, N)
+    readout sizes typical of neural fits
+    """
+    for H, W, D, N in sizes:
+        data = np.random.standard_normal([BATCH_SIZE, H, W, D]).astype(np.float32)
+        for contraction in ['feature_first', 'spatial_first', 'einsum', 'auto']:
+            tf.reset_default_graph()
+            output = factored_fc(tf.constant(data), N, contraction=contraction)
+            train_op = tf.train.GradientDescentOptimizer(.01).minimize(tf.reduce_mean(tf.square(output)))
+            print('H={} W={} D={} N={} contraction={}: {:.4f} s/step'.format(
+                H, W, D, N, contraction, timeit(train_op)))
+
+
+def benchmark_parallel_extraction(n_images=4096, n_workers=(1, 2, 4, 8), json_file='json/mnist_conv.json'):
+    """
+    Feature extraction over n_images MNIST-sized images with one session using all cores
+    versus the same cores split among n_workers processes
+    """
+    data = np.random.standard_normal([n_images, 28, 28, 1]).astype(np.float32)
+    out_dir = tempfile.mkdtemp()
+    try:
+        for n in n_workers:
+            start = time.time()
+            parallel.extract(json_file, data, '{}/workers{}'.format(out_dir, n), 'conv1', n_workers=n,
+                             batch_size=BATCH_SIZE, graph_dir=out_dir + '/graph')
+            print('n_workers={}: {:.1f} images/s'.format(n, n_images / (time.time() - start)))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def benchmark_input_pipeline(n_images=4096, nsteps=NSTEPS, json_file='json/mnist_conv.json'):
+    """
+    Training steps per second of mnist_conv fed through feed_dict placeholders versus a
+    tf.data pipeline with parallel augmentation, prefetch and a staging area
+    """
+    images = np.random.standard_normal([n_images, 28, 28, 1]).astype(np.float32)
+    labels = np.random.randint(10, size=n_images).astype(np.int32)
+
+    def augment(image, label):
+        return tf.image.random_flip_left_right(image), label
+
+    def train_op(inp, lbl):
+        G = main.graph_from_json(json_file)
+        main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+        main.unroll(G, input_seq={'conv1': inp})
+        loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(
+            logits=G.node['fc2']['outputs'][-1], labels=lbl))
+        return tf.train.GradientDescentOptimizer(.01).minimize(loss)
+
+    for kind in ['feed_dict', 'tf.data']:
+        tf.reset_default_graph()
+        if kind == 'feed_dict':
+            inp = tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])
+            lbl = tf.placeholder(tf.int32, [BATCH_SIZE])
+            targets = train_op(inp, lbl)
+
+            def feed(step):
+                # batch assembly and augmentation in Python, as in the tutorials
+                i = (step * BATCH_SIZE) % (n_images - BATCH_SIZE + 1)
+                flip = np.random.rand(BATCH_SIZE, 1, 1, 1) < .5
+                batch = images[i:i + BATCH_SIZE]
+                return {inp: np.where(flip, batch[:, :, ::-1], batch), lbl: labels[i:i + BATCH_SIZE]}
+        else:
+            dataset = tnn_data.make_dataset((images, labels), BATCH_SIZE, map_fn=augment)
+            batch = dataset.make_one_shot_iterator().get_next()
+            (inp, lbl), stage_op = tnn_data.stage(batch)
+            targets = [train_op(inp, lbl), stage_op]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            if kind == 'feed_dict':
+                sess.run(targets, feed_dict=feed(0))
+            else:
+                sess.run(stage_op)
+                sess.run(targets)
+            start = time.time()
+            for step in range(nsteps):
+                if kind == 'feed_dict':
+                    sess.run(targets, feed_dict=feed(step))
+                else:
+                    sess.run(targets)
+        print('{}: {:.1f} steps/s'.format(kind, nsteps / (time.time() - start)))
+
+
+
+def benchmark_hoisting(ntimes=10, json_file='json/alexnet.json'):
+    """
+    Forward FLOPs and time per step of a static image unrolled with and without hoisting
+    the computation on inputs that do not change between steps
+    """
+    for hoist in [False, True]:
+        tf.reset_default_graph()
+        images = tf.constant(np.random.standard_normal([BATCH_SIZE, 224, 224, 3]).astype(np.float32))
+        G = main.graph_from_json(json_file)
+        main.set_hoist(G, hoist)
+        main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+        main.unroll(G, input_seq={'conv1': images}, ntimes=ntimes)
+        report = main.hoisting_report(G)
+        outputs = [attr['outputs'][-1] for _, attr in G.nodes(data=True)]
+        print('hoist={}: {:.2f} GFLOPs, {:.1%} saved, {:.4f} s/step'.format(
+            hoist, report['flops'] / 1e9, report['saving'], timeit(outputs)))
+
+if __name__ == '__main__':
+    benchmark_fused_gate_norm()
+    benchmark_component_conv()
+    benchmark_factored_fc()
+    benchmark_parallel_extraction()
+    benchmark_input_pipeline()
+    benchmark_hoisting()
@@ -0,0 +1,55 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import main, step, anytime
+
+BATCH_SIZE = 4
+NTIMES = 5
+SEED = 0
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+json_path = os.path.join(os.path.split(this_dir)[0], 'json', 'mnist_conv.json')
+
+
+def test_anytime_predict():
+    images = np.random.RandomState(SEED).standard_normal([2 * BATCH_SIZE + 1, 28, 28, 1]).astype(np.float32)
+    G = main.graph_from_json(json_path)
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    tnn_step = step.build_step(G, {'conv1': tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])})
+    padded = np.concatenate([images, np.zeros([3 * BATCH_SIZE - len(images), 28, 28, 1], np.float32)])
+    inp = tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])
+    main.unroll(G, input_seq={'conv1': inp}, ntimes=NTIMES)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        unrolled = np.concatenate([sess.run(G.node['fc2']['outputs'], feed_dict={inp: padded[i:i + BATCH_SIZE]})
+                                   for i in range(0, len(padded), BATCH_SIZE)], axis=1)[:, :len(images)]
+
+        # without exit criteria every sample runs for max_steps
+        result = anytime.anytime_predict(sess, tnn_step, images, 'fc2', max_steps=NTIMES)
+        assert (result['exit_steps'] == NTIMES).all()
+        assert np.allclose(result['logits'], unrolled[-1], atol=1e-5)
+
+        # every sample exits at min_steps; refilled slots start from scratch
+        result = anytime.anytime_predict(sess, tnn_step, images, 'fc2', max_steps=NTIMES, threshold=0., min_steps=3)
+        assert (result['exit_steps'] == 3).all()
+        assert np.allclose(result['logits'], unrolled[2], atol=1e-5)
+
+        # per-sample exit step matches the first step meeting the criterion
+        tol = .05
+        result = anytime.anytime_predict(sess, tnn_step, images, 'fc2', max_steps=NTIMES, tol=tol)
+        probs = anytime.softmax(unrolled)
+        change = np.abs(probs[1:] - probs[:-1]).max(axis=-1)
+        for i in range(len(images)):
+            below = np.where(change[:, i] < tol)[0]
+            expected = below[0] + 2 if len(below) > 0 else NTIMES
+            assert result['exit_steps'][i] == expected
+            assert np.allclose(result['logits'][i], unrolled[expected - 1, i], atol=1e-5)
+
+
+if __name__ == '__main__':
+    test_anytime_predict()
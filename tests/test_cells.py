@@ -0,0 +1,336 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tnn.cell import harbor, harbor_split, component_conv, get_constant, laplacian_regularizer, factored_fc, \
+    spatial_fc, spatial_fc_heads
+from tnn.convrnn import ConvLSTMCell, ConvUGRNNCell, ConvIntersectionRNNCell
+from tnn.reciprocalgaternn import ReciprocalGateCell
+
+BATCH_SIZE = 8
+SEED = 0
+
+
+def _recip_cell(**kwargs):
+    return ReciprocalGateCell(shape=[8, 8],
+                              out_depth=16,
+                              cell_depth=16,
+                              tau_filter_size=[3, 3],
+                              gate_filter_size=[3, 3],
+                              ff_filter_size=[3, 3],
+                              in_out_filter_size=[3, 3],
+                              input_to_cell=True,
+                              input_to_out=True,
+                              tau_nonlinearity=tf.nn.sigmoid,
+                              gate_nonlinearity=tf.nn.sigmoid,
+                              kernel_initializer='xavier',
+                              kernel_initializer_kwargs={'seed': SEED},
+                              **kwargs)
+
+
+def test_recip_fused_convs():
+    rng = np.random.RandomState(SEED)
+    inputs = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    state = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 32]).astype(np.float32))
+
+    with tf.variable_scope('recip'):
+        unfused_out, unfused_state = _recip_cell(fuse_convs=False)(inputs, state, None, None)
+    n_vars = len(tf.global_variables())
+    # the fused cell must find all of its variables under the unfused names
+    with tf.variable_scope('recip', reuse=True):
+        fused_out, fused_state = _recip_cell(fuse_convs=True)(inputs, state, None, None)
+    assert len(tf.global_variables()) == n_vars
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        res = sess.run([unfused_out, unfused_state, fused_out, fused_state])
+    assert np.allclose(res[0], res[2], atol=1e-5)
+    assert np.allclose(res[1], res[3], atol=1e-5)
+
+
+def test_recip_variational_dropout():
+    rng = np.random.RandomState(SEED)
+    inputs = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    state = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 32]).astype(np.float32))
+
+    global_step = tf.train.get_or_create_global_step()
+    cell = _recip_cell(recurrent_keep_prob=0.5,
+                       total_training_steps=1,
+                       variational_dropout=True,
+                       is_training=True)
+    with tf.variable_scope('recip'):
+        out_0, _ = cell(inputs, state, None, None)
+    n_cached = len(cell._dropout_cache[None])
+    with tf.variable_scope('recip', reuse=True):
+        out_1, _ = cell(inputs, state, None, None)
+    # the second timestep reuses the masks of the first one
+    assert len(cell._dropout_cache[None]) == n_cached
+
+    # masks made inside a tf.cond are not reused outside of it
+    cell.reset_dropout_masks()
+    with tf.variable_scope('recip', reuse=True):
+        out_cond = tf.cond(tf.constant(True), lambda: cell(inputs, state, None, None)[0], lambda: inputs * 0.)
+        out_2, _ = cell(inputs, state, None, None)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.assign(global_step, 10))
+        res = sess.run([out_0, out_1, out_cond, out_2])
+    assert np.allclose(res[0], res[1])
+    assert res[2].shape == res[3].shape
+
+
+def test_recip_tuple_state():
+    rng = np.random.RandomState(SEED)
+    inputs = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    cell_state = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    out_state = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+
+    with tf.variable_scope('recip'):
+        concat_out, concat_state = _recip_cell()(inputs, tf.concat([cell_state, out_state], axis=3), None, None)
+    with tf.variable_scope('recip', reuse=True):
+        tuple_out, tuple_state = _recip_cell(state_is_tuple=True)(inputs, {'cell': cell_state, 'out': out_state}, None, None)
+    assert sorted(tuple_state.keys()) == ['cell', 'out']
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        res = sess.run([concat_out, concat_state, tuple_out, tuple_state])
+    assert np.allclose(res[0], res[2], atol=1e-5)
+    assert np.allclose(res[1], np.concatenate([res[3]['cell'], res[3]['out']], axis=3), atol=1e-5)
+
+
+def test_harbor_split():
+    rng = np.random.RandomState(SEED)
+    ff = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    fb = [tf.constant(rng.standard_normal([BATCH_SIZE, 4, 4, 8]).astype(np.float32)),
+          tf.constant(rng.standard_normal([BATCH_SIZE, 2, 2, 4]).astype(np.float32))]
+    inputs = [fb[0], ff, fb[1]]
+    shape = [BATCH_SIZE, 8, 8, 28]
+
+    concat = harbor(inputs, shape, 'harbor', ff_inpnm=ff.name, channel_op='concat')
+    ff_out, fb_out = harbor_split(inputs, 1, shape, 'harbor', channel_op='concat')
+
+    with tf.Session() as sess:
+        concat, ff_out, fb_out = sess.run([concat, ff_out, fb_out])
+    assert np.allclose(concat, np.concatenate([ff_out, fb_out], axis=3))
+
+
+def test_harbor_split_sp_transform():
+    rng = np.random.RandomState(SEED)
+    ff = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32), name='conv2/out')
+    fb = tf.constant(rng.standard_normal([BATCH_SIZE, 4, 4, 8]).astype(np.float32), name='conv3/out')
+    inputs = [ff, fb]
+    shape = [BATCH_SIZE, 8, 8, 24]
+
+    with tf.variable_scope('harbor_sp'):
+        concat = harbor(inputs, shape, 'harbor', ff_inpnm=ff.name, spatial_op='sp_transform', channel_op='concat')
+    with tf.variable_scope('harbor_sp', reuse=True):
+        ff_out, fb_out = harbor_split(inputs, 0, shape, 'harbor', reuse=True, spatial_op='sp_transform',
+                                      channel_op='concat')
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        concat, ff_out, fb_out = sess.run([concat, ff_out, fb_out])
+    assert np.allclose(concat, np.concatenate([ff_out, fb_out], axis=3), atol=1e-5)
+
+
+def test_harbor_fc_broadcast():
+    rng = np.random.RandomState(SEED)
+    conv_data = rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32)
+    fc_data = rng.standard_normal([BATCH_SIZE, 16]).astype(np.float32)
+    inputs = [tf.constant(conv_data), tf.constant(fc_data)]
+    shape = [BATCH_SIZE, 8, 8, 16]
+    fc_tiled = np.tile(fc_data[:, None, None, :], [1, 8, 8, 1])
+    expected = {'add': conv_data + fc_tiled,
+                'multiply': conv_data * fc_tiled,
+                'concat': np.concatenate([conv_data, fc_tiled], axis=3)}
+
+    outputs = {op: harbor(inputs, shape, 'harbor', channel_op=op) for op in expected}
+    with tf.Session() as sess:
+        outputs = sess.run(outputs)
+    for op in expected:
+        assert np.allclose(outputs[op], expected[op])
+
+
+def test_component_conv_accumulate():
+    rng = np.random.RandomState(SEED)
+    ff = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32), name='conv1')
+    skip = tf.constant(rng.standard_normal([BATCH_SIZE, 16, 16, 8]).astype(np.float32), name='split')
+    standin = tf.zeros([BATCH_SIZE, 4, 4, 4], name='conv3/standin')
+    inputs = [ff, skip, standin]
+    shape = [BATCH_SIZE, 8, 8, 28]
+
+    with tf.variable_scope('conv'):
+        concat = component_conv(harbor(inputs, shape, 'harbor', channel_op='concat'), inputs,
+                                out_depth=16, input_name='conv1', bias=.1)
+    n_vars = len(tf.global_variables())
+    with tf.variable_scope('conv', reuse=True):
+        accumulated = component_conv(harbor(inputs, shape, 'harbor', channel_op='list'), inputs,
+                                     out_depth=16, input_name='conv1', bias=.1, accumulate=True)
+    assert len(tf.global_variables()) == n_vars
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        concat, accumulated = sess.run([concat, accumulated])
+    assert np.allclose(concat, accumulated, atol=1e-4)
+
+
+def test_component_conv_accumulate_fc_broadcast():
+    rng = np.random.RandomState(SEED)
+    ff = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32), name='conv1')
+    fb = tf.constant(rng.standard_normal([BATCH_SIZE, 16]).astype(np.float32), name='fc2')
+    inputs = [ff, fb]
+    # as many channels as the fc input, so that the harbor only reshapes it
+    shape = [BATCH_SIZE, 8, 8, 16]
+
+    outputs = {}
+    for padding, strides in [('SAME', [1, 1, 1, 1]), ('SAME', [1, 2, 2, 1]), ('VALID', [1, 1, 1, 1])]:
+        with tf.variable_scope('conv_{}_{}'.format(padding, strides[1])):
+            concat = component_conv(harbor(inputs, shape, 'harbor'), inputs, out_depth=8, input_name='conv1',
+                                    strides=strides, padding=padding)
+        with tf.variable_scope('conv_{}_{}'.format(padding, strides[1]), reuse=True):
+            # the fc input reaches component_conv as [B, 1, 1, 16]
+            harbor_outputs = harbor(inputs, shape, 'harbor', channel_op='list')
+            assert harbor_outputs[1].shape.as_list() == [BATCH_SIZE, 1, 1, 16]
+            accumulated = component_conv(harbor_outputs, inputs, out_depth=8, input_name='conv1',
+                                         strides=strides, padding=padding, accumulate=True)
+        outputs[(padding, strides[1])] = (concat, accumulated)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        outputs = sess.run(outputs)
+    for concat, accumulated in outputs.values():
+        assert concat.shape == accumulated.shape
+        assert np.allclose(concat, accumulated, atol=1e-4)
+
+
+def test_component_conv_accumulate_fc_standin():
+    rng = np.random.RandomState(SEED)
+    ff = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32), name='conv1')
+    shape = [BATCH_SIZE, 8, 8, 16]
+    # the fc of the harbor turns the zero stand-in of an fc feedback input into a nonzero input
+    standin = tf.zeros([BATCH_SIZE, 10], name='fc2/standin')
+    # the same zeros, but not known to be zero when the graph is built
+    opaque = tf.placeholder_with_default(np.zeros([BATCH_SIZE, 10], dtype=np.float32), [BATCH_SIZE, 10],
+                                         name='fc2/opaque')
+
+    outputs = []
+    for reuse, fb in [(None, standin), (True, opaque)]:
+        with tf.variable_scope('conv', reuse=reuse):
+            inputs = [ff, fb]
+            outputs.append(component_conv(harbor(inputs, shape, 'harbor', channel_op='list', reuse=reuse), inputs,
+                                          out_depth=16, input_name='conv1', accumulate=True))
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        skipped, computed = sess.run(outputs)
+    assert np.allclose(skipped, computed, atol=1e-5)
+
+
+def test_constant_pool():
+    data = np.random.RandomState(SEED).standard_normal([5, 5, 3, 4]).astype(np.float32)
+    regularizer = laplacian_regularizer(1.)
+    losses = [regularizer(tf.constant(data)) for _ in range(2)]
+    # both losses use the same pooled kernel
+    kernels = [op for op in tf.get_default_graph().get_operations() if op.name.startswith('tnn_constants/laplacian')]
+    assert len(kernels) == 1
+    assert get_constant('laplacian', [3, 3, 3, 1], tf.float32, None) is kernels[0].outputs[0]
+
+    # reference: the same Laplacian kernel applied to every input channel
+    L = np.array([[0.5, 1, 0.5], [1, -6, 1], [0.5, 1, 0.5]], dtype=np.float32)
+    w = np.transpose(data, (3, 0, 1, 2))
+    conv = sum(L[i, j] * w[:, i:i+3, j:j+3, :] for i in range(3) for j in range(3))
+    with tf.Session() as sess:
+        assert np.allclose(sess.run(losses), np.sum(np.square(conv)), rtol=1e-4)
+
+
+def test_factored_fc_contractions():
+    inp = tf.constant(np.random.RandomState(SEED).standard_normal([BATCH_SIZE, 7, 7, 32]).astype(np.float32))
+    outputs = {}
+    for i, contraction in enumerate(['feature_first', 'spatial_first', 'einsum', 'auto']):
+        with tf.variable_scope('readout', reuse=i > 0):
+            outputs[contraction] = factored_fc(inp, 10, kernel_init='xavier', kernel_init_kwargs={'seed': SEED},
+                                               contraction=contraction)
+    assert len(tf.global_variables()) == 3
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        outputs = sess.run(outputs)
+    for contraction in outputs:
+        assert outputs[contraction].shape == (BATCH_SIZE, 10)
+        assert np.allclose(outputs[contraction], outputs['feature_first'], atol=1e-4)
+
+
+def test_spatial_fc_heads():
+    inp = tf.constant(np.random.RandomState(SEED).standard_normal([BATCH_SIZE, 7, 7, 32]).astype(np.float32))
+    init_kwargs = {'kernel_init': 'xavier', 'kernel_init_kwargs': {'seed': SEED}, 'bias': .1}
+    separate = []
+    for scope, out_depth in [('head0', 10), ('head1', 3)]:
+        with tf.variable_scope(scope):
+            separate.append(spatial_fc(inp, out_depth, **init_kwargs))
+    # the full extent conv that spatial_fc used to compute
+    with tf.variable_scope('head0', reuse=True):
+        conv = tf.nn.conv2d(inp, tf.get_variable('weights'), strides=[1, 1, 1, 1], padding='VALID')
+        conv = tf.nn.bias_add(conv, tf.get_variable('bias'))
+    n_vars = len(tf.global_variables())
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+        heads = spatial_fc_heads(inp, [('head0', 10), ('head1', 3)], **init_kwargs)
+    assert len(tf.global_variables()) == n_vars
+    assert heads[0].shape.as_list() == [BATCH_SIZE, 1, 1, 10]
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        separate, conv, heads = sess.run([separate, conv, heads])
+    assert np.allclose(separate[0], conv, atol=1e-4)
+    for head, sep in zip(heads, separate):
+        assert np.allclose(head, sep, atol=1e-4)
+
+
+def test_fused_gate_norm():
+    rng = np.random.RandomState(SEED)
+    inputs = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    state = tf.constant(rng.standard_normal([BATCH_SIZE, 8, 8, 16]).astype(np.float32))
+    init = tf.contrib.layers.xavier_initializer(seed=SEED)
+
+    for cell_class in [ConvLSTMCell, ConvUGRNNCell, ConvIntersectionRNNCell]:
+        if cell_class is ConvLSTMCell:
+            cell_state = tf.concat([state, state], axis=3)
+        else:
+            cell_state = state
+        outs = []
+        for i, fused_norm in enumerate([False, True]):
+            cell = cell_class([8, 8], [3, 3], 16,
+                              layer_norm=True,
+                              norm_shift=.1,
+                              kernel_initializer=init,
+                              bias_initializer=init,
+                              fused_norm=fused_norm)
+            with tf.variable_scope(cell_class.__name__, reuse=i > 0):
+                outs.append(cell(inputs, cell_state))
+            if i == 0:
+                n_vars = len(tf.global_variables())
+        # both paths share the same gamma and beta variables
+        assert len(tf.global_variables()) == n_vars
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            unfused, fused = sess.run(outs)
+        assert np.allclose(unfused[0], fused[0], atol=1e-5)
+        assert np.allclose(unfused[1], fused[1], atol=1e-5)
+
+
+if __name__ == '__main__':
+    test_recip_fused_convs()
+    test_recip_variational_dropout()
+    test_recip_tuple_state()
+    test_harbor_split()
+    test_harbor_split_sp_transform()
+    test_harbor_fc_broadcast()
+    test_component_conv_accumulate()
+    test_component_conv_accumulate_fc_broadcast()
+    test_component_conv_accumulate_fc_standin()
+    test_constant_pool()
+    test_factored_fc_contractions()
+    test_spatial_fc_heads()
+    test_fused_gate_norm()
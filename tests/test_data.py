@@ -0,0 +1,52 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import data
+
+BATCH_SIZE = 4
+NTIMES = 3
+SEED = 0
+
+
+def test_input_seq():
+    rng = np.random.RandomState(SEED)
+    arrays = {'images': rng.standard_normal([5 * BATCH_SIZE, 4, 4, 3]).astype(np.float32),
+              'frames': rng.standard_normal([5 * BATCH_SIZE, NTIMES, 4, 4, 3]).astype(np.float32),
+              'labels': np.arange(5 * BATCH_SIZE)}
+
+    def augment(example):
+        example = dict(example)
+        example['images'] = example['images'] + 1
+        return example
+
+    dataset = data.make_dataset(arrays, BATCH_SIZE, map_fn=augment, repeat=False)
+    input_seq, batch, stage_op = data.build_input_seq(dataset, {'conv1': 'images', 'conv0': 'frames'},
+                                                      sequences=['frames'])
+    assert len(input_seq['conv0']) == NTIMES
+    assert input_seq['conv1'].shape.as_list() == [BATCH_SIZE, 4, 4, 3]
+
+    with tf.Session() as sess:
+        sess.run(stage_op)
+        for step in range(4):
+            images, frames, labels, _ = sess.run([input_seq['conv1'], input_seq['conv0'], batch['labels'], stage_op])
+            idx = slice(step * BATCH_SIZE, (step + 1) * BATCH_SIZE)
+            assert np.array_equal(labels, arrays['labels'][idx])
+            assert np.allclose(images, arrays['images'][idx] + 1)
+            for t in range(NTIMES):
+                assert np.allclose(frames[t], arrays['frames'][idx, t])
+
+
+def test_sliding_windows():
+    video = np.arange(10 * 2 * 3).reshape([10, 2, 3])
+    clips = data.sliding_windows(video, 4, stride=3)
+    assert clips.shape == (3, 4, 2, 3)
+    assert np.shares_memory(clips, video)
+    for i in range(3):
+        assert np.array_equal(clips[i], video[3 * i:3 * i + 4])
+
+
+if __name__ == '__main__':
+    test_input_seq()
+    test_sliding_windows()
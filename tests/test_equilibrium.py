@@ -0,0 +1,77 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import main, equilibrium
+from tnn.cell import component_conv
+
+BATCH_SIZE = 4
+MEM = .5
+NTIMES = 40
+SEED = 0
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+json_path = os.path.join(os.path.split(this_dir)[0], 'json', 'mnist_conv.json')
+
+
+def _build(images, solver):
+    """
+    Equilibrium of a network with leaky memory and a long unroll sharing its variables
+    """
+    tf.reset_default_graph()
+    G = main.graph_from_json(json_path)
+    for node, attr in G.nodes(data=True):
+        attr['kwargs']['memory'][1]['memory_decay'] = MEM
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    result = equilibrium.equilibrium(G, {'conv1': images}, solver=solver, max_iter=60, tol=1e-6)
+    main.unroll(G, input_seq={'conv1': images}, ntimes=NTIMES)
+    return G, result
+
+
+def test_equilibrium():
+    images = tf.constant(np.random.RandomState(SEED).standard_normal([BATCH_SIZE, 28, 28, 1]).astype(np.float32))
+    for solver in ['picard', 'anderson']:
+        G, result = _build(images, solver)
+        variables = tf.trainable_variables()
+        implicit_grads = tf.gradients(tf.reduce_sum(result['outputs']['fc2']), variables)
+        unrolled_grads = tf.gradients(tf.reduce_sum(G.node['fc2']['outputs'][-1]), variables)
+        assert all(g is not None for g in implicit_grads)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            fixed_point, unrolled, n_iter, residuals = sess.run([result['outputs']['fc2'],
+                                                                G.node['fc2']['outputs'][-1],
+                                                                result['n_iter'],
+                                                                result['node_residuals']])
+            assert n_iter < 60
+            assert all(res < 1e-4 for res in residuals.values())
+            assert np.allclose(fixed_point, unrolled, rtol=1e-3, atol=1e-4)
+
+            # the implicit gradients match backpropagation through the long unroll
+            for implicit, unrolled in zip(*sess.run([implicit_grads, unrolled_grads])):
+                assert np.allclose(implicit, unrolled, rtol=1e-2, atol=1e-4)
+
+
+
+def test_equilibrium_time_sep():
+    tf.reset_default_graph()
+    G = main.graph_from_json(json_path)
+    # a pre-memory conv with separate variables per time step
+    G.node['conv1']['kwargs']['pre_memory'] = [(component_conv, {'out_depth': 32, 'input_name': 'conv1',
+                                                                  'time_sep': True})]
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    images = tf.zeros([BATCH_SIZE, 28, 28, 1])
+    try:
+        equilibrium.equilibrium(G, {'conv1': images})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('equilibrium accepted time_sep ops')
+
+
+if __name__ == '__main__':
+    test_equilibrium()
+    test_equilibrium_time_sep()
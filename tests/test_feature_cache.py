@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+import networkx as nx
+import tensorflow as tf
+
+from tnn import feature_cache
+
+BATCH_SIZE = 8
+N_BATCHES = 4
+NTIMES = 3
+SEED = 0
+
+
+def _graph_and_batches():
+    rng = np.random.RandomState(SEED)
+    inp = tf.placeholder(tf.float32, [None, 4, 4, 3])
+    G = nx.DiGraph()
+    G.add_edge('conv1', 'fc2')
+    G.node['conv1']['outputs'] = [inp * (t + 1) for t in range(NTIMES)]
+    G.node['fc2']['outputs'] = [tf.reduce_mean(inp, axis=[1, 2]) + t for t in range(NTIMES)]
+    data = rng.standard_normal([BATCH_SIZE * N_BATCHES, 4, 4, 3]).astype(np.float32)
+    batches = [{inp: data[i:i + BATCH_SIZE]} for i in range(0, len(data), BATCH_SIZE)]
+    return G, data, batches
+
+
+def test_feature_cache():
+    G, data, batches = _graph_and_batches()
+    selection = [('conv1', 1), ('fc2', 2)]
+    cache_dir = tempfile.mkdtemp()
+    try:
+        key = feature_cache.cache_key(json_file={'nodes': []}, ntimes=NTIMES)
+        with tf.Session() as sess:
+            reader = feature_cache.build_feature_cache(sess, G, selection, batches, len(data), cache_dir, key)
+        assert reader.names == ['conv1_t1', 'fc2_t2']
+        assert np.allclose(reader.features('conv1', 1), data * 2)
+        assert np.allclose(reader.features('fc2', 2), data.mean(axis=(1, 2)) + 2, atol=1e-6)
+
+        # contiguous batches are views of the memory map
+        batch = next(reader.batches(BATCH_SIZE))
+        assert np.may_share_memory(batch['conv1_t1'], reader.features('conv1_t1'))
+        shuffled = np.concatenate([b['conv1_t1'] for b in reader.batches(BATCH_SIZE, shuffle=True)])
+        assert np.allclose(np.sort(shuffled.ravel()), np.sort(data.ravel() * 2))
+
+        # a complete cache is not rebuilt
+        reader = feature_cache.build_feature_cache(None, G, selection, [], len(data), cache_dir, key)
+        assert np.allclose(reader.features('conv1', 1), data * 2)
+        assert feature_cache.cache_key(json_file={'nodes': []}, ntimes=NTIMES + 1) != key
+
+        # a complete cache built with other settings is not returned
+        for kwargs in [{'selection': [('conv1', 0)]}, {'dtype': 'float16'}, {'pca_components': 2}]:
+            build_kwargs = {'selection': selection}
+            build_kwargs.update(kwargs)
+            try:
+                feature_cache.build_feature_cache(None, G, batches=[], n_samples=len(data), cache_dir=cache_dir,
+                                                  key=key, **build_kwargs)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('mismatched cache returned for {}'.format(kwargs))
+
+        # float16 storage and PCA compression with all components is lossless up to precision
+        n_components = len(data)
+        key = feature_cache.cache_key(json_file={'nodes': []}, ntimes=NTIMES, dtype='float16', pca=n_components)
+        with tf.Session() as sess:
+            reader = feature_cache.build_feature_cache(sess, G, [('conv1', 0)], batches, len(data), cache_dir,
+                                                       key, dtype='float16', pca_components=n_components,
+                                                       pca_fit_samples=len(data))
+        features = reader.features('conv1', 0)
+        assert features.dtype == np.float16 and features.shape == (len(data), n_components)
+        assert np.allclose(reader.reconstruct('conv1_t0', features), data.reshape([len(data), -1]), atol=2e-2)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    test_feature_cache()
@@ -0,0 +1,36 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from tnn import parallel
+
+BATCH_SIZE = 8
+SEED = 0
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+json_path = os.path.join(os.path.split(this_dir)[0], 'json', 'mnist_conv.json')
+
+
+def test_extract():
+    data = np.random.RandomState(SEED).standard_normal([3 * BATCH_SIZE + 3, 28, 28, 1]).astype(np.float32)
+    out_dir = tempfile.mkdtemp()
+    try:
+        # the graph and its initial weights are cached once and shared by both runs
+        kwargs = dict(input_node='conv1', selection=['fc2'], batch_size=BATCH_SIZE,
+                      graph_dir=out_dir + '/graph')
+        single = parallel.extract(json_path, data, out_dir + '/single', n_workers=1, **kwargs)
+        sharded = parallel.extract(json_path, data, out_dir + '/sharded', n_workers=3, **kwargs)
+        assert single.names == sharded.names
+        for name in single.names:
+            assert single.features(name).shape[0] == len(data)
+            assert np.allclose(single.features(name), sharded.features(name), atol=1e-5)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    test_extract()
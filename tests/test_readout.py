@@ -0,0 +1,50 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import networkx as nx
+import tensorflow as tf
+
+from tnn import readout
+from tnn.cell import spatial_fc
+
+BATCH_SIZE = 8
+NTIMES = 3
+SEED = 0
+
+
+def test_build_readouts():
+    rng = np.random.RandomState(SEED)
+    G = nx.DiGraph()
+    G.add_edge('conv1', 'fc2')
+    G.node['conv1']['outputs'] = [tf.constant(rng.standard_normal([BATCH_SIZE, 7, 7, 16]).astype(np.float32))
+                                  for t in range(NTIMES)]
+    G.node['fc2']['outputs'] = [tf.constant(rng.standard_normal([BATCH_SIZE, 32]).astype(np.float32))
+                                for t in range(NTIMES)]
+
+    specs = [('conv1', 1, 10), ('conv1', 2, 5), ('conv1', 2, 3, 'conv1_t2_small'), ('fc2', 2, 4)]
+    targets = {'conv1_t1': tf.zeros([BATCH_SIZE, 10])}
+    readouts = readout.build_readouts(G, specs, targets=targets, kernel_init_kwargs={'seed': SEED})
+    assert list(readouts['outputs'].keys()) == ['conv1_t1', 'conv1_t2', 'conv1_t2_small', 'fc2_t2']
+    assert list(readouts['losses'].keys()) == ['conv1_t1']
+
+    # reference: each head built on its own
+    n_vars = len(tf.global_variables())
+    reference = {}
+    with tf.variable_scope('readout', reuse=True):
+        for spec in specs:
+            node, t, n_targets, name = readout._parse_spec(spec)
+            with tf.variable_scope(name):
+                reference[name] = spatial_fc(readout.get_features(G, node, t), n_targets, flatten=True)
+    assert len(tf.global_variables()) == n_vars
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        outputs, reference, loss = sess.run([readouts['outputs'], reference, readouts['loss']])
+    for name in reference:
+        assert outputs[name].shape == reference[name].shape
+        assert np.allclose(outputs[name], reference[name], atol=1e-4)
+    assert np.allclose(loss, np.mean(np.square(outputs['conv1_t1'])), rtol=1e-4)
+
+
+if __name__ == '__main__':
+    test_build_readouts()
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, division, print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+import networkx as nx
+import tensorflow as tf
+
+from tnn import recorder
+
+BATCH_SIZE = 8
+N_BATCHES = 4
+NTIMES = 3
+SEED = 0
+
+
+def _graph_and_batches():
+    rng = np.random.RandomState(SEED)
+    inp = tf.placeholder(tf.float32, [None, 4, 4, 3])
+    G = nx.DiGraph()
+    G.add_edge('conv1', 'fc2')
+    G.node['conv1']['outputs'] = [inp * (t + 1) for t in range(NTIMES)]
+    G.node['fc2']['outputs'] = [tf.reduce_mean(inp, axis=[1, 2]) + t for t in range(NTIMES)]
+    data = rng.standard_normal([BATCH_SIZE * N_BATCHES, 4, 4, 3]).astype(np.float32)
+    batches = [{inp: data[i:i + BATCH_SIZE]} for i in range(0, len(data), BATCH_SIZE)]
+    return G, data, batches
+
+
+def _interrupted(batches, n):
+    for i, batch in enumerate(batches):
+        if i == n:
+            raise KeyboardInterrupt
+        yield batch
+
+
+def test_record():
+    G, data, batches = _graph_and_batches()
+    path = tempfile.mkdtemp()
+    try:
+        with tf.Session() as sess:
+            acts = recorder.record(sess, G, batches, len(data), BATCH_SIZE, path, pool='avg')
+        assert sorted(acts.keys()) == ['conv1_t0', 'conv1_t1', 'conv1_t2', 'fc2_t0', 'fc2_t1', 'fc2_t2']
+        pooled = data.reshape([len(data), 2, 2, 2, 2, 3]).mean(axis=(2, 4))
+        for t in range(NTIMES):
+            assert acts['conv1_t%d' % t].shape == (len(data), 2, 2, 3)
+            assert np.allclose(acts['conv1_t%d' % t], pooled * (t + 1), atol=1e-5)
+            assert np.allclose(acts['fc2_t%d' % t], data.mean(axis=(1, 2)) + t, atol=1e-5)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_record_resume():
+    G, data, batches = _graph_and_batches()
+    path = tempfile.mkdtemp()
+    selection = [('conv1', 2), 'fc2']
+    try:
+        with tf.Session() as sess:
+            try:
+                recorder.record(sess, G, _interrupted(batches, 2), len(data), BATCH_SIZE, path, selection=selection)
+            except KeyboardInterrupt:
+                pass
+            assert np.allclose(recorder.load(path)['conv1_t2'][:2 * BATCH_SIZE], data[:2 * BATCH_SIZE] * 3)
+
+            # the recorded batches are not run again
+            zeros = [dict((k, np.zeros_like(v)) for k, v in batch.items()) for batch in batches]
+            acts = recorder.record(sess, G, zeros[:2] + batches[2:], len(data), BATCH_SIZE, path,
+                                   selection=selection)
+        assert np.allclose(acts['conv1_t2'], data * 3)
+        assert np.allclose(acts['fc2_t1'], data.mean(axis=(1, 2)) + 1, atol=1e-5)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_record_hdf5():
+    if recorder.h5py is None:
+        return
+    G, data, batches = _graph_and_batches()
+    path = tempfile.mkdtemp()
+    try:
+        with tf.Session() as sess:
+            acts = recorder.record(sess, G, batches, len(data), BATCH_SIZE, path, selection=['conv1'],
+                                   fmt='hdf5', pool='global', chunk_size=BATCH_SIZE)
+        with acts:
+            assert sorted(acts.keys()) == ['conv1_t0', 'conv1_t1', 'conv1_t2']
+            assert np.allclose(acts['conv1_t1'][:], data.mean(axis=(1, 2)) * 2, atol=1e-5)
+        assert acts.h5_file is None
+
+        # the file can be opened again once closed
+        with recorder.load(path) as acts:
+            assert np.allclose(acts['conv1_t2'][:], data.mean(axis=(1, 2)) * 3, atol=1e-5)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    test_record()
+    test_record_resume()
+    test_record_hdf5()
@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from tnn import ridge
+
+SEED = 0
+
+
+def _data(rng, n_samples, feature_shape=(3, 3, 4), n_targets=5, noise=.1):
+    X = rng.standard_normal([n_samples] + list(feature_shape))
+    W = rng.standard_normal([int(np.prod(feature_shape)), n_targets])
+    y = X.reshape([n_samples, -1]).dot(W) + 2. + noise * rng.standard_normal([n_samples, n_targets])
+    return X, y
+
+
+def test_ridge_solver():
+    rng = np.random.RandomState(SEED)
+    X, y = _data(rng, 200)
+    alpha = 3.
+
+    # chunked accumulation
+    solver = ridge.RidgeSolver().fit((X[i:i+64], y[i:i+64]) for i in range(0, len(X), 64))
+    weights, bias = solver.solve(alpha)
+
+    # reference: direct solution on centered data
+    Xf = X.reshape([len(X), -1])
+    Xc = Xf - Xf.mean(axis=0)
+    yc = y - y.mean(axis=0)
+    ref_weights = np.linalg.solve(Xc.T.dot(Xc) + alpha * np.eye(Xf.shape[1]), Xc.T.dot(yc))
+    ref_bias = y.mean(axis=0) - Xf.mean(axis=0).dot(ref_weights)
+    assert np.allclose(weights, ref_weights)
+    assert np.allclose(bias, ref_bias)
+
+    kernel, kernel_bias = ridge.spatial_fc_variables(weights, bias, solver.feature_shape)
+    assert kernel.shape == (3, 3, 4, 5)
+    assert np.allclose(np.tensordot(X, kernel, axes=3) + kernel_bias, Xf.dot(weights) + bias, atol=1e-4)
+
+
+def test_ridge_sweep():
+    rng = np.random.RandomState(SEED)
+    X, y = _data(rng, 100, noise=1.)
+    X_val, y_val = _data(rng, 50, noise=1.)
+    alphas = [1e-3, 1., 1e3]
+    solver = ridge.RidgeSolver().fit([(X, y)])
+    errors, best_alpha = solver.sweep(alphas, [(X_val[:20], y_val[:20]), (X_val[20:], y_val[20:])])
+
+    for i, alpha in enumerate(alphas):
+        weights, bias = solver.solve(alpha)
+        pred = X_val.reshape([len(X_val), -1]).dot(weights) + bias
+        assert np.allclose(errors[i], np.mean(np.square(pred - y_val), axis=0))
+    assert best_alpha == alphas[np.argmin(errors.mean(axis=1))]
+
+
+if __name__ == '__main__':
+    test_ridge_solver()
+    test_ridge_sweep()
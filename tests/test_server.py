@@ -0,0 +1,73 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import main, step
+
+BATCH_SIZE = 4
+NTIMES = 4
+SEED = 0
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+json_path = os.path.join(os.path.split(this_dir)[0], 'json', 'mnist_conv.json')
+
+
+def _build(frames):
+    """
+    The same network, unrolled on frames and as a step sharing its variables
+    """
+    tf.reset_default_graph()
+    G = main.graph_from_json(json_path)
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    inp = tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])
+    tnn_step = step.build_step(G, {'conv1': inp})
+    main.unroll(G, input_seq={'conv1': [tf.constant(f) for f in frames]}, ntimes=NTIMES)
+    return G, tnn_step
+
+
+def test_server():
+    if sys.version_info[0] < 3:
+        return
+    import asyncio
+    from tnn.server import InferenceServer
+
+    frames = np.random.RandomState(SEED).standard_normal([NTIMES, BATCH_SIZE, 28, 28, 1]).astype(np.float32)
+    G, tnn_step = _build(frames)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        unrolled = sess.run(G.node['fc2']['outputs'])
+        server = InferenceServer(sess, tnn_step, ['fc2'], max_latency=.01)
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(server.start(port=0))
+        # one stream per sample, one frame per request
+        outputs = [[] for _ in range(BATCH_SIZE)]
+        for t in range(NTIMES):
+            results = loop.run_until_complete(asyncio.gather(*[server.predict(frames[t, i], stream=i)
+                                                               for i in range(BATCH_SIZE)]))
+            for i, result in enumerate(results):
+                outputs[i].append(result['fc2'])
+
+        # a request of the wrong shape is rejected before it is queued
+        try:
+            loop.run_until_complete(server.predict(frames[0, 0, :14]))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('predict accepted an input of the wrong shape')
+        loop.run_until_complete(server.stop())
+    for i in range(BATCH_SIZE):
+        for t in range(NTIMES):
+            assert np.allclose(outputs[i][t], unrolled[t][i], atol=1e-5)
+    metrics = server.metrics()
+    assert metrics['n_requests'] == NTIMES * BATCH_SIZE
+    assert metrics['n_streams'] == BATCH_SIZE
+    assert metrics['p99_latency'] >= metrics['p50_latency']
+
+
+if __name__ == '__main__':
+    test_server()
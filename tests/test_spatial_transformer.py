@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import spatial_transformer
+
+BATCH_SIZE = 4
+NUM_TRANSFORMS = 3
+SEED = 0
+
+
+def test_batch_transformer():
+    rng = np.random.RandomState(SEED)
+    ims = rng.standard_normal([BATCH_SIZE, 16, 12, 5]).astype(np.float32)
+    identity = np.array([1., 0, 0, 0, 1., 0], dtype=np.float32)
+    thetas = identity + .2 * rng.standard_normal([BATCH_SIZE, NUM_TRANSFORMS, 6]).astype(np.float32)
+    out_size = (8, 10)
+
+    U = tf.constant(ims)
+    batched = spatial_transformer.batch_transformer(U, tf.constant(thetas), out_size)
+    assert batched.shape.as_list() == [BATCH_SIZE * NUM_TRANSFORMS, 8, 10, 5]
+
+    # reference: replicate every input once per transform
+    indices = np.repeat(np.arange(BATCH_SIZE), NUM_TRANSFORMS)
+    repeated = tf.gather(U, indices)
+    reference = spatial_transformer.transformer(repeated,
+                                                tf.constant(thetas.reshape([-1, 6])),
+                                                out_size)
+
+    with tf.Session() as sess:
+        batched_res, reference_res = sess.run([batched, reference])
+    assert np.allclose(batched_res, reference_res, atol=1e-5)
+
+
+if __name__ == '__main__':
+    test_batch_transformer()
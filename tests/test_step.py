@@ -0,0 +1,70 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import main, step
+from tnn.cell import component_conv
+
+BATCH_SIZE = 4
+NTIMES = 4
+SEED = 0
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+json_path = os.path.join(os.path.split(this_dir)[0], 'json', 'mnist_conv.json')
+
+
+def _build(frames):
+    """
+    The same network, unrolled on frames and as a step sharing its variables
+    """
+    tf.reset_default_graph()
+    G = main.graph_from_json(json_path)
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    inp = tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])
+    tnn_step = step.build_step(G, {'conv1': inp})
+    main.unroll(G, input_seq={'conv1': [tf.constant(f) for f in frames]}, ntimes=NTIMES)
+    return G, tnn_step
+
+
+def test_step():
+    frames = np.random.RandomState(SEED).standard_normal([NTIMES, BATCH_SIZE, 28, 28, 1]).astype(np.float32)
+    G, tnn_step = _build(frames)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        unrolled = sess.run(G.node['fc2']['outputs'])
+
+        # first step from scratch, then from the carry
+        carry = None
+        for t in range(NTIMES):
+            outputs, carry = tnn_step.run(sess, {'conv1': frames[t]}, carry, fetches=['fc2'])
+            assert np.allclose(outputs['fc2'], unrolled[t], atol=1e-5)
+
+        # the zero carry of every sample gives the first step, and carries split and stack per sample
+        carry = step.Step.stack([tnn_step.zero_carry()] * BATCH_SIZE)
+        for t in range(NTIMES):
+            outputs, carry = tnn_step.run(sess, {'conv1': frames[t]}, carry, fetches=['fc2'])
+            carry = step.Step.stack(step.Step.unstack(carry, BATCH_SIZE))
+            assert np.allclose(outputs['fc2'], unrolled[t], atol=1e-5)
+
+
+def test_step_time_sep():
+    tf.reset_default_graph()
+    G = main.graph_from_json(json_path)
+    # a pre-memory conv with separate variables per time step
+    G.node['conv1']['kwargs']['pre_memory'] = [(component_conv, {'out_depth': 32, 'input_name': 'conv1',
+                                                                  'time_sep': True})]
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=BATCH_SIZE)
+    try:
+        step.build_step(G, {'conv1': tf.placeholder(tf.float32, [BATCH_SIZE, 28, 28, 1])})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('build_step accepted time_sep ops')
+
+
+if __name__ == '__main__':
+    test_step()
+    test_step_time_sep()
@@ -6,6 +6,7 @@ import tensorflow as tf
 import math
 
 from tnn import main
+from tnn.cell import component_conv
 
 BATCH_SIZE = 256
 MEM = .5
@@ -315,6 +316,172 @@ def test_feedback():
         assert np.array_equal(conv3hr, concatr)
 
 
+def test_frame_sequence():
+    frames = np.random.RandomState(SEED).standard_normal([3, 8, 28, 28, 1]).astype(np.float32)
+    for frame_policy, ntimes, expected in [(('hold', 2), 6, [0, 0, 1, 1, 2, 2]),
+                                           (('stride', 2), 4, [0, 2, 2, 2])]:
+        tf.reset_default_graph()
+        G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+        main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+        input_seq = {'conv1': tf.constant(frames)}
+        main.unroll(G, input_seq=input_seq, ntimes=ntimes, frame_policy=frame_policy)
+        assert len(input_seq['conv1']) == ntimes
+        # steps that see the same frame share its tensor
+        assert len(set(input_seq['conv1'])) == len(set(expected))
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            inputs = sess.run(input_seq['conv1'])
+            sess.run(G.node['fc2']['outputs'][-1])
+        for inp, idx in zip(inputs, expected):
+            assert np.array_equal(inp, frames[idx])
+
+
+def test_frame_iterator():
+    tf.reset_default_graph()
+    frames = np.random.RandomState(SEED).standard_normal([4, 8, 28, 28, 1]).astype(np.float32)
+    G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+    main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+    # one frame batch per element, read once per frame
+    iterator = tf.data.Dataset.from_tensor_slices(frames).make_one_shot_iterator()
+    input_seq = {'conv1': iterator}
+    main.unroll(G, input_seq=input_seq, ntimes=4)
+    assert len(set(input_seq['conv1'])) == 4
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        inputs = sess.run(input_seq['conv1'])
+    for inp, frame in zip(inputs, frames):
+        assert np.array_equal(inp, frame)
+
+
+def test_delta_tol():
+    images = tf.constant(np.random.RandomState(SEED).standard_normal([8, 28, 28, 1]).astype(np.float32))
+    frames = tf.concat([tf.tile(images[None], [3, 1, 1, 1, 1]), tf.tile(images[None] * 2, [3, 1, 1, 1, 1])], 0)
+    ntimes = 6
+    graphs = {}
+    for scope, delta_tol in [('ref', None), ('delta', 1e-6)]:
+        with tf.variable_scope(scope):
+            G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+            if delta_tol is not None:
+                main.set_delta_tol(G, delta_tol)
+            main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+            main.unroll(G, input_seq={'conv1': frames}, ntimes=ntimes)
+        graphs[scope] = G
+    ref_vars = dict((v.name[len('ref/'):], v) for v in tf.global_variables() if v.name.startswith('ref/'))
+    copy_vars = [tf.assign(v, ref_vars[v.name[len('delta/'):]])
+                 for v in tf.global_variables() if v.name.startswith('delta/')]
+    skip_rates = main.skip_rates(graphs['delta'])
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(copy_vars)
+        ref, delta, rates = sess.run([graphs['ref'].node['fc2']['outputs'],
+                                      graphs['delta'].node['fc2']['outputs'], skip_rates])
+    # the input node sees the same frame at steps 1, 2, 4 and 5, so it skips them
+    assert np.isclose(rates['conv1'], 4. / ntimes)
+    for r, d in zip(ref, delta):
+        assert np.allclose(r, d, atol=1e-5)
+
+
+def test_closed_form():
+    images = tf.constant(np.random.RandomState(SEED).standard_normal([8, 28, 28, 1]).astype(np.float32))
+    ntimes = 6
+    graphs = {}
+    for scope, closed_form in [('ref', False), ('closed', True)]:
+        with tf.variable_scope(scope):
+            G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+            for node, attr in G.nodes(data=True):
+                attr['kwargs']['memory'][1]['memory_decay'] = MEM
+            main.set_closed_form(G, closed_form)
+            main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+            main.unroll(G, input_seq={'conv1': images}, ntimes=ntimes)
+        graphs[scope] = G
+    ref_vars = dict((v.name[len('ref/'):], v) for v in tf.global_variables() if v.name.startswith('ref/'))
+    copy_vars = [tf.assign(v, ref_vars[v.name[len('closed/'):]])
+                 for v in tf.global_variables() if v.name.startswith('closed/')]
+
+    # the input node sees the same image at every step, so none of its states depends on the previous one
+    def ancestors(tensor):
+        ops, stack = set(), [tensor.op]
+        while stack:
+            op = stack.pop()
+            if op not in ops:
+                ops.add(op)
+                stack.extend(inp.op for inp in op.inputs)
+        return ops
+
+    for scope, chained in [('ref', True), ('closed', False)]:
+        states = graphs[scope].node['conv1']['states']
+        assert (states[-2].op in ancestors(states[-1])) == chained
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(copy_vars)
+        for node in ['conv1', 'fc2']:
+            ref, closed = sess.run([graphs['ref'].node[node]['states'], graphs['closed'].node[node]['states']])
+            for r, c in zip(ref, closed):
+                assert np.allclose(r, c, rtol=1e-4, atol=1e-5)
+
+    # a pre-memory conv with separate variables per time step changes the pre-memory output
+    # at every step, so the closed form is not used
+    graphs = {}
+    for scope, closed_form in [('sep_ref', False), ('sep_closed', True)]:
+        with tf.variable_scope(scope):
+            G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+            for node, attr in G.nodes(data=True):
+                attr['kwargs']['memory'][1]['memory_decay'] = MEM
+            G.node['conv1']['kwargs']['pre_memory'] = [(component_conv, {'out_depth': 32, 'input_name': 'conv1',
+                                                                         'time_sep': True})]
+            main.set_closed_form(G, closed_form)
+            main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+            main.unroll(G, input_seq={'conv1': images}, ntimes=ntimes)
+        graphs[scope] = G
+    ref_vars = dict((v.name[len('sep_ref/'):], v) for v in tf.global_variables() if v.name.startswith('sep_ref/'))
+    copy_vars = [tf.assign(v, ref_vars[v.name[len('sep_closed/'):]])
+                 for v in tf.global_variables() if v.name.startswith('sep_closed/')]
+    states = graphs['sep_closed'].node['conv1']['states']
+    assert states[-2].op in ancestors(states[-1])
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(copy_vars)
+        ref, closed = sess.run([graphs['sep_ref'].node['conv1']['states'],
+                                graphs['sep_closed'].node['conv1']['states']])
+        for r, c in zip(ref, closed):
+            assert np.allclose(r, c, rtol=1e-4, atol=1e-5)
+
+
+def test_hoist():
+    images = tf.constant(np.random.RandomState(SEED).standard_normal([8, 28, 28, 1]).astype(np.float32))
+    ntimes = 6
+    graphs = {}
+    for scope, hoist in [('ref', False), ('hoist', True)]:
+        with tf.variable_scope(scope):
+            G = main.graph_from_json(os.path.join(json_dir, 'mnist_conv.json'))
+            main.set_hoist(G, hoist)
+            main.init_nodes(G, input_nodes=['conv1'], batch_size=8)
+            main.unroll(G, input_seq={'conv1': images}, ntimes=ntimes)
+        graphs[scope] = G
+    ref_vars = dict((v.name[len('ref/'):], v) for v in tf.global_variables() if v.name.startswith('ref/'))
+    copy_vars = [tf.assign(v, ref_vars[v.name[len('hoist/'):]])
+                 for v in tf.global_variables() if v.name.startswith('hoist/')]
+
+    # without feedback and memory, every node computes once its input has reached it
+    for depth, node in enumerate(['conv1', 'conv2', 'fc1', 'fc2']):
+        outputs = graphs['hoist'].node[node]['outputs']
+        assert all(out is outputs[depth] for out in outputs[depth:])
+        assert len(set(outputs)) == depth + 1
+    report = main.hoisting_report(graphs['hoist'])
+    assert report['saved_flops'] > 0
+    assert report['flops'] < main.forward_flops([out for _, attr in graphs['ref'].nodes(data=True)
+                                                 for out in attr['outputs']])
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(copy_vars)
+        ref, hoisted = sess.run([graphs['ref'].node['fc2']['outputs'], graphs['hoist'].node['fc2']['outputs']])
+    for r, h in zip(ref, hoisted):
+        assert np.allclose(r, h, atol=1e-5)
+
 if __name__ == '__main__':
 #    test_memory()
 
@@ -0,0 +1,121 @@
+"""
+Anytime inference: stop unrolling a sample once its readout has converged
+
+A TNN produces a readout at every time step, so easy inputs can be answered before
+ntimes steps. Samples are run step by step through a `tnn.step.Step` and leave the batch
+when the readout is confident enough or stops changing. The slot of a sample that left
+is refilled with the next input, so exited samples stop consuming compute.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from tnn.step import Step
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def has_converged(probs, prev_probs, threshold=None, tol=None):
+    """
+    Per-sample exit condition: the highest class probability is at least threshold, or
+    the class probabilities changed by less than tol (max absolute change) since the
+    previous step. Either criterion can be None to disable it.
+    """
+    converged = np.zeros(probs.shape[0], dtype=bool)
+    if threshold is not None:
+        converged |= probs.max(axis=-1) >= threshold
+    if tol is not None and prev_probs is not None:
+        converged |= np.abs(probs - prev_probs).max(axis=-1) < tol
+    return converged
+
+
+def anytime_predict(sess, step, inputs, readout, max_steps, threshold=None, tol=None,
+                    min_steps=1, refill=True):
+    """
+    Predicts the readout of static inputs with a per-sample early exit.
+
+    :Args:
+        - sess
+            Session in which the model variables are initialized or restored
+        - step
+            A `tnn.step.Step` with a single input node of fixed batch size
+        - inputs (np.ndarray)
+            Inputs of shape [n_samples, ...], each presented at every step
+        - readout (str)
+            Node whose output are the logits
+        - max_steps (int)
+            Steps after which a sample exits regardless
+    :Kwargs:
+        - threshold and tol (float or None, default: None)
+            Exit criteria, see has_converged
+        - min_steps (int, default: 1)
+            Steps before a sample may exit, e.g. the depth of the network that the input
+            needs to reach the readout
+        - refill (bool, default: True)
+            Refill the slot of an exited sample with the next input right away. Otherwise
+            inputs are processed in batches that exit when all of their samples have
+    :Returns:
+        A dict with the logits of every sample at its exit step ('logits'), the number
+        of steps after which each sample exited ('exit_steps'), the number of session runs
+        ('n_runs') and the fraction of batch slots that computed a pending sample ('utilization')
+    """
+    input_node, inp = list(step.inputs.items())[0]
+    batch_size = inp.shape.as_list()[0]
+    n_samples = len(inputs)
+
+    batch = np.zeros([batch_size] + list(inputs.shape[1:]), dtype=inputs.dtype)
+    carry = Step.stack([step.zero_carry()] * batch_size)
+    slot_sample = -np.ones(batch_size, dtype=int) # sample in each slot, -1 if empty
+    slot_steps = np.zeros(batch_size, dtype=int)
+    prev_probs = None
+
+    logits = None
+    exit_steps = np.zeros(n_samples, dtype=int)
+    next_sample = 0
+    n_runs = 0
+    n_active_steps = 0
+
+    while True:
+        # fill empty slots with the next inputs, resetting their carry
+        if refill or (slot_sample < 0).all():
+            for slot in np.where(slot_sample < 0)[0]:
+                if next_sample == n_samples:
+                    break
+                slot_sample[slot] = next_sample
+                slot_steps[slot] = 0
+                batch[slot] = inputs[next_sample]
+                for c in carry:
+                    c[slot] = 0
+                next_sample += 1
+        active = slot_sample >= 0
+        if not active.any():
+            break
+
+        outputs, carry = step.run(sess, {input_node: batch}, carry, fetches=[readout])
+        n_runs += 1
+        n_active_steps += active.sum()
+        slot_steps[active] += 1
+        out = outputs[readout].reshape([batch_size, -1])
+        if logits is None:
+            logits = np.zeros([n_samples, out.shape[1]], dtype=out.dtype)
+
+        probs = softmax(out)
+        if prev_probs is not None:
+            prev_probs[slot_steps == 1] = np.inf # new samples have no previous step to compare with
+        converged = has_converged(probs, prev_probs, threshold=threshold, tol=tol)
+        done = active & (((slot_steps >= min_steps) & converged) | (slot_steps >= max_steps))
+        for slot in np.where(done)[0]:
+            logits[slot_sample[slot]] = out[slot]
+            exit_steps[slot_sample[slot]] = slot_steps[slot]
+            slot_sample[slot] = -1
+        prev_probs = probs
+
+    return {'logits': logits,
+            'exit_steps': exit_steps,
+            'n_runs': n_runs,
+            'utilization': n_active_steps / max(1, n_runs * batch_size)}
@@ -11,9 +11,69 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.rnn import RNNCell
 from tensorflow.python.framework import ops
+from tensorflow.python.util import nest
 import tnn.spatial_transformer
 import tfutils.model
 import copy
+import weakref
+import contextlib
+
+_TFUTILS_FUNCS = {}
+_INITIALIZERS = {}
+_CONSTANT_POOL = weakref.WeakKeyDictionary()
+
+# initial affine transform of the spatial transformers
+IDENTITY_THETA = np.array([[1., 0, 0], [0, 1., 0]], dtype='float32').flatten()
+
+def _tfutils_func(name):
+    """
+    Returns tfutils.model.<name>, falling back to tfutils.model_tool_old for
+    older versions of tfutils. Resolved on first use and cached afterwards.
+    """
+    if name not in _TFUTILS_FUNCS:
+        try:
+            _TFUTILS_FUNCS[name] = getattr(tfutils.model, name)
+        except AttributeError:
+            import tfutils.model_tool_old
+            _TFUTILS_FUNCS[name] = getattr(tfutils.model_tool_old, name)
+    return _TFUTILS_FUNCS[name]
+
+def _batchnorm_corr(**kwargs):
+    """
+    tfutils.model.batchnorm_corr, falling back to tfutils.model_tool_old.batchnorm_corr for
+    versions of tfutils whose batchnorm_corr does not take some of the kwargs (e.g. time_suffix)
+    """
+    try:
+        return _tfutils_func('batchnorm_corr')(**kwargs)
+    except TypeError:
+        import tfutils.model_tool_old
+        return tfutils.model_tool_old.batchnorm_corr(**kwargs)
+
+def _initializer(kind, **kwargs):
+    """
+    tfutils.model.initializer(kind, **kwargs), built once per kind and kwargs of plain values
+    and reused by the ops of every time step
+    """
+    if not all(isinstance(v, (int, float, str, bool, type(None))) for v in kwargs.values()):
+        return _tfutils_func('initializer')(kind=kind, **kwargs)
+    key = (kind, tuple(sorted(kwargs.items())))
+    if key not in _INITIALIZERS:
+        _INITIALIZERS[key] = _tfutils_func('initializer')(kind=kind, **kwargs)
+    return _INITIALIZERS[key]
+
+def get_constant(kind, shape, dtype, builder):
+    """
+    Returns the constant tensor identified by (kind, shape, dtype) in the default graph,
+    calling builder() to create it the first time it is requested. The tensor is created
+    outside of any control flow context and under the 'tnn_constants' name scope, so that
+    nodes and timesteps of an unrolled graph all share a single copy of it.
+    """
+    pool = _CONSTANT_POOL.setdefault(tf.get_default_graph(), {})
+    key = (kind, tuple(shape), tf.as_dtype(dtype))
+    if key not in pool:
+        with ops.init_scope(), tf.name_scope('tnn_constants/'):
+            pool[key] = builder()
+    return pool[key]
 
 def laplacian_regularizer(scale, scope=None):
     ''' Compute loss term by filtering a rank-4 tensor with the discrete Laplacian kernel.
@@ -45,9 +105,9 @@ def laplacian_regularizer(scale, scope=None):
             # weights for readout have shape [h, w, d, out_channels]
             weights = tf.transpose(weights, perm=(3,0,1,2)) # out_ch treated as "batch" dimension of a convolution
             ch_in = weights.get_shape().as_list()[-1] 
-            L = tf.constant(value=[[0.5, 1, 0.5], [1, -6, 1], [0.5, 1, 0.5]], dtype=tf.float32) # 2D Laplacian kernel of shape [3,3]
-            L = tf.reshape(L, shape=[3,3,1,1])
-            L = tf.zeros(shape=[3,3,ch_in,1], dtype=tf.float32) + L # Broadcast L to ch_in copies of the same kernel
+            L = np.array([[0.5, 1, 0.5], [1, -6, 1], [0.5, 1, 0.5]], dtype=np.float32) # 2D Laplacian kernel of shape [3,3]
+            L = np.tile(L[:,:,None,None], [1,1,ch_in,1]) # ch_in copies of the same kernel
+            L = get_constant('laplacian', L.shape, tf.float32, lambda: tf.constant(L, name='laplacian'))
 
             # Now compute loss as L2 on the output of Laplacian filtering
             conv = tf.nn.depthwise_conv2d(weights, L, strides=[1,1,1,1], padding='VALID')
@@ -169,7 +229,7 @@ def input_aggregator(inputs, shape, spatial_op, channel_op, kernel_init='xavier'
         if len(shape) == 2:
             pat = re.compile(':|/')
             if len(inp.shape) == 2:
-                if channel_op != 'concat' and inp.shape[1] != shape[1]:
+                if channel_op not in ('concat', 'list') and inp.shape[1] != shape[1]:
                     nm = pat.sub('__', inp.name.split('/')[-2].split('_')[0])
                     nm = 'fc_to_fc_harbor_for_%s' % nm
                     with tf.variable_scope(nm, reuse=reuse):
@@ -179,7 +239,7 @@ def input_aggregator(inputs, shape, spatial_op, channel_op, kernel_init='xavier'
 
             elif len(inp.shape) == 4:
                 out = tf.reshape(inp, tf.cast([inp.get_shape().as_list()[0], -1], dtype=tf.int32))
-                if channel_op != 'concat' and out.shape[1] != shape[1]:
+                if channel_op not in ('concat', 'list') and out.shape[1] != shape[1]:
                     nm = pat.sub('__', inp.name.split('/')[-2].split('_')[0])
                     nm = 'conv_to_fc_harbor_for_%s' % nm
                     with tf.variable_scope(nm, reuse=reuse):
@@ -209,10 +269,9 @@ def input_aggregator(inputs, shape, spatial_op, channel_op, kernel_init='xavier'
 
                 # we may choose a different activation (like relu) and/or
                 # we did not need to learn an fc above so we directly apply the fc
-                # to the conv input, but in all cases we tile
-                xs, ys = shape[1: 3]
-                inp = tf.tile(inp, [1, xs*ys])
-                out = tf.reshape(inp, tf.cast((inp.shape.as_list()[0], xs, ys, nchannels), dtype=tf.int32))
+                # to the conv input, but in all cases we broadcast it over space
+                # when combining it with the other inputs (see _spatial_broadcast)
+                out = tf.reshape(inp, [inp.shape.as_list()[0], 1, 1, nchannels])
 
             elif len(inp.shape) == 4:
                 if spatial_op == 'tile':
@@ -234,7 +293,7 @@ def input_aggregator(inputs, shape, spatial_op, channel_op, kernel_init='xavier'
                 else:
                     out = tf.image.resize_images(inp, shape[1:3], align_corners=True)
 
-                if channel_op != 'concat' and out.shape[3] != shape[3] and spatial_op != 'factored_fc':
+                if channel_op not in ('concat', 'list') and out.shape[3] != shape[3] and spatial_op != 'factored_fc':
                     nm = pat.sub('__', inp.name.split('/')[-2].split('_')[0])
                     nm = 'conv_to_conv_harbor_for_%s' % nm
                     with tf.variable_scope(nm, reuse=reuse):
@@ -250,21 +309,72 @@ def input_aggregator(inputs, shape, spatial_op, channel_op, kernel_init='xavier'
         else:
             raise ValueError('harbor cannot process layer of dim {}'.format(len(shape)))
 
+    # inputs that are broadcast over space are combined with each other first,
+    # so that they are expanded to the full spatial shape at most once
+    full_outputs = [out for out in outputs if not _is_spatial_broadcast(out, shape)]
+    broadcast_outputs = [out for out in outputs if _is_spatial_broadcast(out, shape)]
     if channel_op == 'add':
-        output = tf.add_n(outputs, name='harbor')
+        output = None
+        if len(full_outputs) > 0:
+            output = tf.add_n(full_outputs)
+        if len(broadcast_outputs) > 0:
+            broadcast_sum = tf.add_n(broadcast_outputs)
+            output = broadcast_sum if output is None else output + broadcast_sum
+        output = tf.identity(_spatial_broadcast(output, shape), name='harbor')
     elif channel_op == 'multiply':
-        if len(outputs) == 1:
-            output = outputs[0]
+        output = None
+        for output_elem in full_outputs + broadcast_outputs:
+            output = output_elem if output is None else tf.multiply(output, output_elem)
+        output = _spatial_broadcast(output, shape)
+    elif channel_op == 'list':
+        # leave combining the inputs to the next function, e.g. component_conv with accumulate=True,
+        # which also takes the inputs broadcast over space as they are when the full-size inputs give
+        # it the spatial shape
+        if len(full_outputs) > 0:
+            output = list(outputs)
         else:
-            output = tf.multiply(outputs[0], outputs[1])
-            if len(outputs) > 2:
-                for output_elem in outputs[2:]:
-                    output = tf.multiply(output, output_elem)
+            output = [_spatial_broadcast(out, shape) for out in outputs]
     else:
-        output = tf.concat(outputs, axis=-1, name='harbor')  
+        output = tf.concat([_spatial_broadcast(out, shape) for out in outputs], axis=-1, name='harbor')  
 
     return output
 
+def _is_spatial_broadcast(inp, shape):
+    """
+    True if inp is a [B, 1, 1, C] input to a rank-4 harbor with a larger spatial shape
+    """
+    return len(shape) == 4 and len(inp.shape) == 4 and inp.shape.as_list()[1:3] == [1, 1] and list(shape[1:3]) != [1, 1]
+
+def _spatial_broadcast(inp, shape):
+    """
+    Expands a [B, 1, 1, C] input to the spatial shape of a rank-4 harbor in a single broadcast
+    multiply, instead of tiling and reshaping it
+    """
+    if _is_spatial_broadcast(inp, shape):
+        inp = inp * tf.ones([1, shape[1], shape[2], 1], dtype=inp.dtype)
+    return inp
+
+def _broadcast_conv2d(inp, kernel, spatial_shape, strides, padding):
+    """
+    tf.nn.conv2d of a [B, 1, 1, C] input broadcast to spatial_shape, without expanding it. The input
+    is multiplied with each kernel tap once, and every output position sums the taps that fall
+    inside the (zero padded) input.
+    """
+    ksize = kernel.shape.as_list()[:2]
+    in_depth, out_depth = kernel.shape.as_list()[2:]
+    n_taps = ksize[0] * ksize[1]
+    # taps[0, y, x, k] is 1 if tap k of the output position (y, x) is inside the input
+    tap_kernel = tf.reshape(tf.eye(n_taps, dtype=inp.dtype), ksize + [1, n_taps])
+    taps = tf.nn.conv2d(tf.ones([1] + list(spatial_shape) + [1], dtype=inp.dtype), tap_kernel,
+                        strides=strides, padding=padding)
+    out_shape = taps.shape.as_list()[1:3]
+    # [B, n_taps, out_depth]
+    tap_outputs = tf.tensordot(tf.reshape(inp, [-1, in_depth]), tf.reshape(kernel, [n_taps, in_depth, out_depth]),
+                               axes=[[1], [1]])
+    # [out_h * out_w, B, out_depth]
+    output = tf.tensordot(tf.reshape(taps, [-1, n_taps]), tap_outputs, axes=[[1], [1]])
+    return tf.reshape(tf.transpose(output, [1, 0, 2]), [inp.shape.as_list()[0] or -1] + out_shape + [out_depth])
+
 def crop_func(inputs, l1_inpnm, ff_inpnm, node_nms, shape, kernel_init, channel_op, reuse):
     # note: e.g. node_nms = ['split', 'V1', 'V2', 'V4', 'pIT', 'aIT']
 
@@ -355,10 +465,7 @@ def transform_func(inp, shape, weight_decay, ff_inpnm, reuse):
                                    regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
                                    name='weights')
 
-            initial_theta = np.array([[1., 0, 0], [0, 1., 0]])
-            initial_theta = initial_theta.astype('float32')
-            initial_theta = initial_theta.flatten()
-            biases = tf.get_variable(initializer=tf.constant_initializer(value=initial_theta),
+            biases = tf.get_variable(initializer=tf.constant_initializer(value=IDENTITY_THETA),
                                    shape=[6],
                                    dtype=tf.float32,
                                    regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
@@ -499,10 +606,7 @@ def sptransform_preproc(inputs, l1_inpnm, ff_inpnm, node_nms, shape, spatial_op,
                                dtype=tf.float32,
                                name='weights')
 
-        initial_theta = np.array([[1., 0, 0], [0, 1., 0]])
-        initial_theta = initial_theta.astype('float32')
-        initial_theta = initial_theta.flatten()
-        biases = tf.get_variable(initializer=tf.constant_initializer(value=initial_theta),
+        biases = tf.get_variable(initializer=tf.constant_initializer(value=IDENTITY_THETA),
                                shape=[6],
                                dtype=tf.float32,
                                name='bias')
@@ -598,15 +702,32 @@ def harbor(inputs, shape, name, ff_inpnm=None, node_nms=['split', 'V1', 'V2', 'V
 
     return output
 
+def harbor_split(inputs, ff_idx, shape, name, reuse=None, **harbor_kwargs):
+    """
+    Combines the feedforward input inputs[ff_idx] and the remaining (skip and feedback)
+    inputs separately, returning (ff_output, fb_output) instead of their concatenation.
+
+    This equals splitting harbor(inputs, ...) by depth into the feedforward and the other
+    channels, without materializing the concatenated tensor. Only valid for the default
+    harbor with channel_op='concat' and no preproc. fb_output is None when there is no
+    other input. Both harbor calls get the feedforward input name, as spatial_op='sp_transform'
+    needs it.
+    """
+    assert harbor_kwargs.get('channel_op', 'concat') == 'concat'
+    assert harbor_kwargs.get('preproc') is None
+    ff_inpnm = inputs[ff_idx].name
+    ff_output = harbor([inputs[ff_idx]], shape, name, ff_inpnm=ff_inpnm, reuse=reuse, **harbor_kwargs)
+    other_inputs = [inp for j, inp in enumerate(inputs) if j != ff_idx]
+    if len(other_inputs) == 0:
+        return ff_output, None
+    fb_output = harbor(other_inputs, shape, name, ff_inpnm=ff_inpnm, reuse=reuse, **harbor_kwargs)
+    return ff_output, fb_output
 
 def memory(inp, state, memory_decay=0, trainable=False, name='memory'):
     """
     Memory that decays over time
     """
-    try:
-        initializer = tfutils.model.initializer(kind='constant', value=memory_decay)
-    except:
-        initializer = tfutils.model_tool_old.initializer(kind='constant', value=memory_decay)
+    initializer = _initializer(kind='constant', value=memory_decay)
 
     mem = tf.get_variable(initializer=initializer,
                           shape=1,
@@ -616,6 +737,25 @@ def memory(inp, state, memory_decay=0, trainable=False, name='memory'):
     state = tf.add(state * mem, inp, name=name)
     return state
 
+def memory_closed_form(inp, state, steps, memory_decay=0, trainable=False, name='memory'):
+    """
+    State of `memory` after `steps` steps with the same input, in closed form:
+    state * decay^steps + inp * (1 + decay + ... + decay^(steps - 1)).
+    The state is dropped if it is known to be zero.
+    """
+    initializer = _initializer(kind='constant', value=memory_decay)
+
+    mem = tf.get_variable(initializer=initializer,
+                          shape=1,
+                          dtype=tf.float32,
+                          trainable=trainable,
+                          name='memory_decay')
+    # a sum of powers rather than (1 - decay^steps) / (1 - decay), which is undefined for decay = 1
+    geometric = tf.reduce_sum(tf.pow(mem, tf.range(steps, dtype=tf.float32)), keepdims=True)
+    if is_zero(state):
+        return tf.multiply(inp, geometric, name=name)
+    return tf.add(state * tf.pow(mem, float(steps)), inp * geometric, name=name)
+
 def residual_add(inp, res_inp, dtype=tf.float32, kernel_init='xavier', kernel_init_kwargs=None, strides=[1,1,1,1], 
                  padding='SAME', batch_norm=False, is_training=False, init_zero=None, 
                  batch_norm_decay=0.9, batch_norm_epsilon=1e-5, sp_resize=True, time_sep=False, time_suffix=None):
@@ -631,10 +771,7 @@ def residual_add(inp, res_inp, dtype=tf.float32, kernel_init='xavier', kernel_in
         return tf.add(inp, res_inp, name="residual_sum")
     elif inp.shape.as_list()[:-1] == res_inp.shape.as_list()[:-1]:
         # need to do a 1x1 conv to fix channels
-        try:
-            initializer = tfutils.model.initializer(kind=kernel_init, **kernel_init_kwargs)
-        except:
-            initializer = tfutils.model_tool_old.initializer(kind=kernel_init, **kernel_init_kwargs)
+        initializer = _initializer(kind=kernel_init, **kernel_init_kwargs)
 
         res_to_out_kernel = tf.get_variable("residual_add_weights",
                                             [1, 1, res_inp.shape.as_list()[-1], inp.shape.as_list()[-1]],
@@ -642,58 +779,155 @@ def residual_add(inp, res_inp, dtype=tf.float32, kernel_init='xavier', kernel_in
                                             initializer=initializer)
         projection_out = tf.nn.conv2d(res_inp, res_to_out_kernel, strides=strides, padding=padding)
         if batch_norm:
-            try:
-                projection_out = tfutils.model.batchnorm_corr(inputs=projection_out, 
-                                                          is_training=is_training, 
-                                                          decay=batch_norm_decay, 
-                                                          epsilon=batch_norm_epsilon, 
-                                                          init_zero=init_zero, 
-                                                          activation=None, 
-                                                          data_format='channels_last',
-                                                          time_suffix=time_suffix)
-            except:
-                projection_out = tfutils.model_tool_old.batchnorm_corr(inputs=projection_out, 
-                                                          is_training=is_training, 
-                                                          decay=batch_norm_decay, 
-                                                          epsilon=batch_norm_epsilon, 
-                                                          init_zero=init_zero, 
-                                                          activation=None, 
-                                                          data_format='channels_last',
-                                                          time_suffix=time_suffix)
+            projection_out = _batchnorm_corr(inputs=projection_out, 
+                                             is_training=is_training, 
+                                             decay=batch_norm_decay, 
+                                             epsilon=batch_norm_epsilon, 
+                                             init_zero=init_zero, 
+                                             activation=None, 
+                                             data_format='channels_last',
+                                             time_suffix=time_suffix)
         return tf.add(inp, projection_out)
     else: # shape mismatch in spatial dimension
         if sp_resize: # usually do this if strides are kept to 1 always
             res_inp = tf.image.resize_images(res_inp, inp.shape.as_list()[1:3], align_corners=True)
-        try:
-            initializer = tfutils.model.initializer(kind=kernel_init, **kernel_init_kwargs)
-        except:
-            initializer = tfutils.model_tool_old.initializer(kind=kernel_init, **kernel_init_kwargs)
+        initializer = _initializer(kind=kernel_init, **kernel_init_kwargs)
         res_to_out_kernel = tf.get_variable("residual_add_weights",
                                             [1, 1, res_inp.shape.as_list()[-1], inp.shape.as_list()[-1]],
                                             dtype=tf.float32,
                                             initializer=initializer)
         projection_out = tf.nn.conv2d(res_inp, res_to_out_kernel, strides=strides, padding=padding)
         if batch_norm:
-            try:
-                projection_out = tfutils.model.batchnorm_corr(inputs=projection_out, 
-                                                          is_training=is_training, 
-                                                          decay=batch_norm_decay, 
-                                                          epsilon=batch_norm_epsilon, 
-                                                          init_zero=init_zero, 
-                                                          activation=None, 
-                                                          data_format='channels_last',
-                                                          time_suffix=time_suffix)
-            except:
-                projection_out = tfutils.model_tool_old.batchnorm_corr(inputs=projection_out, 
-                                                          is_training=is_training, 
-                                                          decay=batch_norm_decay, 
-                                                          epsilon=batch_norm_epsilon, 
-                                                          init_zero=init_zero, 
-                                                          activation=None, 
-                                                          data_format='channels_last',
-                                                          time_suffix=time_suffix)
+            projection_out = _batchnorm_corr(inputs=projection_out, 
+                                             is_training=is_training, 
+                                             decay=batch_norm_decay, 
+                                             epsilon=batch_norm_epsilon, 
+                                             init_zero=init_zero, 
+                                             activation=None, 
+                                             data_format='channels_last',
+                                             time_suffix=time_suffix)
         return tf.add(inp, projection_out)
     
+def is_zero(tensor):
+    """
+    True if tensor is known to be all zeros when the graph is built, such as the
+    tf.zeros stand-ins for feedback inputs at t=0
+    """
+    op = tensor.op
+    if op.type == 'ZerosLike':
+        return True
+    if op.type == 'Fill':
+        value = tf.contrib.util.constant_value(op.inputs[1])
+        return value is not None and not np.any(value)
+    if op.type == 'Const':
+        return not np.any(tf.contrib.util.constant_value(tensor))
+    return False
+
+# ops whose output is zero if their first input is, such as the spatial ops of the harbor
+_ZERO_PRESERVING_OPS = ('Identity', 'Reshape', 'Tile', 'Pad', 'ResizeBilinear', 'ResizeNearestNeighbor',
+                        'ResizeBicubic', 'ResizeArea', 'Cast')
+
+def _is_zero_output(tensor):
+    """
+    True if tensor is known to be all zeros when the graph is built, also through ops that
+    keep zeros zero, such as the resizing and broadcasting of a zero stand-in by the harbor
+    (but not its fc, deconv or spatial transformer)
+    """
+    if is_zero(tensor):
+        return True
+    op = tensor.op
+    if op.type in _ZERO_PRESERVING_OPS:
+        return _is_zero_output(op.inputs[0])
+    if op.type == 'Mul':
+        return any(_is_zero_output(inp) for inp in op.inputs)
+    return False
+
+_CONCAT_CACHE = weakref.WeakKeyDictionary()
+
+def _cached_concat(values, axis, name, shapes=None):
+    """
+    tf.concat of variables (reshaped to shapes if given), built once per graph and
+    variable scope and reused by later timesteps instead of concatenating the same
+    variables at every step
+    """
+    def concat():
+        if shapes is None:
+            return tf.concat(values, axis=axis, name=name)
+        return tf.concat([tf.reshape(v, shape) for v, shape in zip(values, shapes)], axis=axis, name=name)
+
+    graph = tf.get_default_graph()
+    if graph._get_control_flow_context() is not None:
+        # tensors created inside a while loop or cond cannot be used outside of it
+        return concat()
+    cache = _CONCAT_CACHE.setdefault(graph, {})
+    key = (tf.get_variable_scope().name, name, tuple(v.name for v in values), axis)
+    if key not in cache:
+        cache[key] = concat()
+    return cache[key]
+
+_HOIST_CACHE = weakref.WeakKeyDictionary()
+
+def hoisted(fn, key):
+    """
+    Result of fn() (a tensor or a structure of tensors) built once per graph, variable scope
+    and key, and reused when it is asked for again. The key holds the input tensors of the
+    computation, which are compared by identity, so that computation on inputs that the
+    unrollers pass unchanged from step to step is hoisted out of the time loop.
+    Inside a while loop or cond, fn() is built every time.
+    """
+    graph = tf.get_default_graph()
+    if graph._get_control_flow_context() is not None:
+        # tensors created inside a while loop or cond cannot be used outside of it
+        return fn()
+    cache = _HOIST_CACHE.setdefault(graph, {'entries': {}, 'saved_flops': 0, 'hits': 0})
+    key = (tf.get_variable_scope().name,) + tuple(key)
+    entry = cache['entries'].get(key)
+    if entry is None:
+        first_id = graph._last_id + 1
+        entry = [fn(), first_id, None]
+        cache['entries'][key] = entry
+    else:
+        if entry[2] is None:
+            entry[2] = _flops(_ops_since(entry[0], entry[1]))
+        cache['saved_flops'] += entry[2]
+        cache['hits'] += 1
+    return entry[0]
+
+def _ops_since(tensors, first_id):
+    """
+    Ops that tensors depend on and that were created since the op with id first_id
+    """
+    found = set()
+    stack = [t.op for t in nest.flatten(tensors) if isinstance(t, tf.Tensor)]
+    while stack:
+        op = stack.pop()
+        if op._id >= first_id and op not in found:
+            found.add(op)
+            stack.extend(inp.op for inp in op.inputs)
+    return found
+
+def _flops(op_list):
+    """
+    Floating point operations of ops, from the flops statistics that TensorFlow
+    registers for its ops (ops without statistics or static shapes count 0)
+    """
+    total = 0
+    for op in op_list:
+        try:
+            value = ops.get_stats_for_node_def(op.graph, op.node_def, 'flops').value
+        except ValueError:
+            value = None
+        total += value or 0
+    return total
+
+def hoisting_stats(graph=None):
+    """
+    Number of computations reused by hoisted in graph (default: the default graph) and
+    the floating point operations that rebuilding them would have cost
+    """
+    cache = _HOIST_CACHE.get(graph or tf.get_default_graph(), {'saved_flops': 0, 'hits': 0})
+    return {'hits': cache['hits'], 'saved_flops': cache['saved_flops']}
+
 def component_conv(inp,
          inputs_list,
          out_depth,
@@ -716,6 +950,7 @@ def component_conv(inp,
          return_input=False,
          time_sep=False,
          time_suffix=None,
+         accumulate=False,
          name='component_conv'
          ):
 
@@ -723,6 +958,12 @@ def component_conv(inp,
     Function that breaks up the convolutional kernel to its basenet and non basenet components, when given
 the name of its feedforward input. This is useful when loading basenet weights into tnn when using a 
 harbor channel op of concat. Other channel ops should work with tfutils.model.conv just fine.
+
+    With accumulate=True, inp must be the list of per-input harbor outputs (harbor channel_op='list'), in the
+order of inputs_list. Each of them is convolved with its own kernel and the results are summed, so neither the
+inputs nor the kernels are concatenated, and harbor outputs known to be zero (e.g. of feedback stand-ins at t=0
+that the harbor only resizes) are skipped. The kernels take the depth of the harbor outputs. Harbor outputs of
+shape [B, 1, 1, C] (fc inputs) are broadcast to the spatial shape of the others without expanding them.
     """
     
     if time_sep:
@@ -736,26 +977,26 @@ harbor channel op of concat. Other channel ops should work with tfutils.model.co
         ksize = [ksize, ksize]
     if kernel_init_kwargs is None:
         kernel_init_kwargs = {}
-    in_depth = inp.get_shape().as_list()[-1]
+    if accumulate and not isinstance(inp, (list, tuple)):
+        raise ValueError('component_conv with accumulate=True needs the harbor outputs as a list (channel_op="list")')
 
     # weights
-    try:
-        init = tfutils.model.initializer(kernel_init, **kernel_init_kwargs)
-    except:
-        init = tfutils.model_tool_old.initializer(kernel_init, **kernel_init_kwargs)
+    init = _initializer(kernel_init, **kernel_init_kwargs)
 
     kernel_list = []
     w_idx = 0
-    for input_elem in inputs_list:
+    for j, input_elem in enumerate(inputs_list):
+       # the harbor can change the depth of an input, e.g. with an fc for an fc input to a conv
+       in_depth = inp[j].get_shape().as_list()[-1] if accumulate else input_elem.get_shape().as_list()[-1]
        if input_name is not None and input_name in input_elem.name:
             kernel = tf.get_variable(initializer=init,
-                            shape=[ksize[0], ksize[1], input_elem.get_shape().as_list()[-1], out_depth],
+                            shape=[ksize[0], ksize[1], in_depth, out_depth],
                             dtype=tf.float32,
                             regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
                             name='weights_basenet')
        else:
             kernel = tf.get_variable(initializer=init,
-                            shape=[ksize[0], ksize[1], input_elem.get_shape().as_list()[-1], out_depth],
+                            shape=[ksize[0], ksize[1], in_depth, out_depth],
                             dtype=tf.float32,
                             regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
                             name='weights_' + str(w_idx))
@@ -763,14 +1004,8 @@ harbor channel op of concat. Other channel ops should work with tfutils.model.co
 
        kernel_list.append(kernel)
 
-
-    new_kernel = tf.concat(kernel_list, axis=-2, name='weights')
-
     if use_bias:
-        try:
-            const_init = tfutils.model.initializer(kind='constant', value=bias)
-        except:
-            const_init = tfutils.model_tool_old.initializer(kind='constant', value=bias)
+        const_init = _initializer(kind='constant', value=bias)
 
         biases = tf.get_variable(initializer=const_init,
                             shape=[out_depth],
@@ -778,9 +1013,28 @@ harbor channel op of concat. Other channel ops should work with tfutils.model.co
                             regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
                             name='bias')
     # ops
-    conv = tf.nn.conv2d(inp, new_kernel,
-                        strides=strides,
-                        padding=padding)
+    if accumulate:
+        assert len(inp) == len(kernel_list)
+        spatial_shape = max(inp_elem.shape.as_list()[1:3] for inp_elem in inp)
+        convs = []
+        for j, (inp_elem, kernel) in enumerate(zip(inp, kernel_list)):
+            # the sum needs at least one term to have the right shape
+            if _is_zero_output(inp_elem) and (len(convs) > 0 or j < len(inp) - 1):
+                continue
+            if inp_elem.shape.as_list()[1:3] != spatial_shape:
+                convs.append(_broadcast_conv2d(inp_elem, kernel, spatial_shape, strides, padding))
+            else:
+                convs.append(tf.nn.conv2d(inp_elem, kernel,
+                                          strides=strides,
+                                          padding=padding))
+        conv = convs[0]
+        for conv_elem in convs[1:]:
+            conv = conv + conv_elem
+    else:
+        new_kernel = _cached_concat(kernel_list, axis=-2, name='weights')
+        conv = tf.nn.conv2d(inp, new_kernel,
+                            strides=strides,
+                            padding=padding)
 
     if use_bias:
         output = tf.nn.bias_add(conv, biases, name=name)
@@ -788,29 +1042,21 @@ harbor channel op of concat. Other channel ops should work with tfutils.model.co
         output = tf.identity(conv, name=name)
 
     if batch_norm:
-        try:
-            output = tfutils.model.batchnorm_corr(inputs=output, 
-                                              is_training=is_training, 
-                                              data_format=data_format, 
-                                              decay = batch_norm_decay, 
-                                              epsilon = batch_norm_epsilon, 
-                                              init_zero=init_zero, 
-                                              activation=activation,
-                                              time_suffix=time_suffix)
-        except:
-            output = tfutils.model_tool_old.batchnorm_corr(inputs=output, 
-                                              is_training=is_training, 
-                                              data_format=data_format, 
-                                              decay = batch_norm_decay, 
-                                              epsilon = batch_norm_epsilon, 
-                                              init_zero=init_zero, 
-                                              activation=activation,
-                                              time_suffix=time_suffix)
+        output = _batchnorm_corr(inputs=output, 
+                                 is_training=is_training, 
+                                 data_format=data_format, 
+                                 decay = batch_norm_decay, 
+                                 epsilon = batch_norm_epsilon, 
+                                 init_zero=init_zero, 
+                                 activation=activation,
+                                 time_suffix=time_suffix)
 
     if activation is not None:
         output = getattr(tf.nn, activation)(output, name=activation)
 
     if return_input:
+        if accumulate:
+            inp = tf.concat(inp, axis=-1)
         return output, inp
     else:
         return output
@@ -844,20 +1090,14 @@ def conv_bn(inp,
     in_depth = inp.get_shape().as_list()[-1]
 
     # weights
-    try:
-        init = tfutils.model.initializer(kernel_init, **kernel_init_kwargs)
-    except:
-        init = tfutils.model_tool_old.initializer(kernel_init, **kernel_init_kwargs)
+    init = _initializer(kernel_init, **kernel_init_kwargs)
 
     kernel = tf.get_variable(initializer=init,
                             shape=[ksize[0], ksize[1], in_depth, out_depth],
                             dtype=tf.float32,
                             regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
                             name='weights')
-    try:
-        init = tfutils.model.initializer(kind='constant', value=bias)
-    except:
-        init = tfutils.model_tool_old.initializer(kind='constant', value=bias)
+    init = _initializer(kind='constant', value=bias)
 
     biases = tf.get_variable(initializer=init,
                             shape=[out_depth],
@@ -872,28 +1112,56 @@ def conv_bn(inp,
 
 
     if batch_norm:
-        try:
-            output = tfutils.model.batchnorm_corr(inputs=output, 
-                                              is_training=is_training, 
-                                              data_format=data_format, 
-                                              decay = batch_norm_decay, 
-                                              epsilon = batch_norm_epsilon, 
-                                              init_zero=init_zero, 
-                                              activation=activation)
-        except:
-            output = tfutils.model_tool_old.batchnorm_corr(inputs=output, 
-                                              is_training=is_training, 
-                                              data_format=data_format, 
-                                              decay = batch_norm_decay, 
-                                              epsilon = batch_norm_epsilon, 
-                                              init_zero=init_zero, 
-                                              activation=activation)
+        output = _batchnorm_corr(inputs=output, 
+                                 is_training=is_training, 
+                                 data_format=data_format, 
+                                 decay = batch_norm_decay, 
+                                 epsilon = batch_norm_epsilon, 
+                                 init_zero=init_zero, 
+                                 activation=activation)
     
     if activation is not None:
         output = getattr(tf.nn, activation)(output, name=activation)
 
     return output
     
+@contextlib.contextmanager
+def _optional_variable_scope(scope):
+    """
+    tf.variable_scope(scope), or the current variable scope if scope is None
+    """
+    if scope is None:
+        yield
+    else:
+        with tf.variable_scope(scope):
+            yield
+
+def _spatial_fc_variables(in_shape, out_depth, kernel_init, kernel_init_kwargs, bias, reg_scales):
+    '''
+    Kernel of shape [H,W,D,out_depth] and bias of a spatial_fc readout, in the current variable scope
+    '''
+    if kernel_init_kwargs is None:
+        kernel_init_kwargs = {}
+
+    # kernel
+    init = _initializer(kernel_init, **kernel_init_kwargs)
+
+    reg_func = _get_regularizer(reg_scales)
+    kernel = tf.get_variable(initializer=init,
+                             shape=[in_shape[0], in_shape[1], in_shape[2], out_depth],
+                             dtype=tf.float32,
+                             regularizer=reg_func,
+                             name='weights')
+    
+    init = _initializer(kind='constant', value=bias)
+
+    biases = tf.get_variable(initializer=init,
+                             shape=[out_depth],
+                             dtype=tf.float32,
+                             regularizer=None,
+                             name='bias')
+    return kernel, biases
+
 def spatial_fc(inp,
                out_depth,
                kernel_init='xavier',
@@ -908,8 +1176,9 @@ def spatial_fc(inp,
     '''
     Function that fully connects a spatial tensor of rank 4 to a flat tensor of rank 2. 
     Whereas fc(inp) will flatten the input and perform an affine transformation, 
-    spatial_fc(inp) performs a conv op with kernel shape [H,W,D,out_depth].
+    spatial_fc(inp) uses a kernel of shape [H,W,D,out_depth], i.e. the kernel of a conv with full extent.
     This allows for regularization that takes into account the spatial nature of the kernel.
+    The op itself is the equivalent matmul of the flattened input and kernel.
 
     Args:
     
@@ -921,52 +1190,75 @@ def spatial_fc(inp,
     kernel_init_kwargs: kwargs to pass to tfutils.model.initializer, e.g. 'value' for a constant init
     bias: float value for constant bias initializer
     '''
-    if kernel_init_kwargs is None:
-        kernel_init_kwargs = {}
+    return spatial_fc_heads(inp, [(None, out_depth)],
+                            kernel_init=kernel_init,
+                            kernel_init_kwargs=kernel_init_kwargs,
+                            bias=bias,
+                            reg_scales=reg_scales,
+                            activation=activation,
+                            flatten=flatten,
+                            name=name)[0]
+
+def spatial_fc_heads(inp,
+                     heads,
+                     kernel_init='xavier',
+                     kernel_init_kwargs=None,
+                     bias=0.0,
+                     reg_scales=None,
+                     activation=None,
+                     flatten=False,
+                     name='spatial_fc'
+                     ):
+    '''
+    Evaluates several spatial_fc readouts of the same input as a single matmul.
 
-    # spatial dimensions of input layer
-    in_shape = inp.get_shape().as_list()[1:4]
-    
-    # kernel
-    try:
-        init = tfutils.model.initializer(kernel_init, **kernel_init_kwargs)
-    except:
-        init = tfutils.model_tool_old.initializer(kernel_init, **kernel_init_kwargs)
+    Args:
 
-    reg_func = _get_regularizer(reg_scales)
-    kernel = tf.get_variable(initializer=init,
-                             shape=[in_shape[0], in_shape[1], in_shape[2], out_depth],
-                             dtype=tf.float32,
-                             regularizer=reg_func,
-                             name='weights')
-    
-    try:
-        init = tfutils.model.initializer(kind='constant', value=bias)
-    except:
-        init = tfutils.model_tool_old.initializer(kind='constant', value=bias)
+    inp: a rank 4 tensor with shape [Batch, H, W, D]
+    heads: list of (scope, out_depth) pairs. The variables of each head are those spatial_fc would create
+           in variable scope scope (or the current variable scope if scope is None), so they are interchangeable
+           with separately built spatial_fc heads.
+    Other args are as in spatial_fc and shared by all heads.
 
-    biases = tf.get_variable(initializer=init,
-                             shape=[out_depth],
-                             dtype=tf.float32,
-                             regularizer=None,
-                             name='bias')
+    Returns the list of head outputs, of shape [Batch, 1, 1, out_depth] (or [Batch, out_depth] if flatten)
+    '''
+    in_shape = inp.get_shape().as_list()[1:4]
+    in_size = in_shape[0] * in_shape[1] * in_shape[2]
 
+    kernels = []
+    biases = []
+    for scope, out_depth in heads:
+        with _optional_variable_scope(scope):
+            kernel, bias_var = _spatial_fc_variables(in_shape, out_depth, kernel_init, kernel_init_kwargs, bias, reg_scales)
+        kernels.append(kernel)
+        biases.append(bias_var)
 
-    
     # ops
-    # conv has full connectivity
-    conv = tf.nn.conv2d(inp, kernel,
-                        strides=[1,1,1,1],
-                        padding='VALID')
-    output = tf.nn.bias_add(conv, biases, name=name)
-    
-    if activation is not None:
-        output = getattr(tf.nn, activation)(output, name=activation)
-    if flatten:
-        output = tf.reshape(output, shape=[output.shape.as_list()[0], -1], name="flatten")
-    print(output.name, output.shape)
-
-    return output
+    # the kernel has full extent, so the conv is a matmul of the flattened input and kernel
+    flat_inp = tf.reshape(inp, [-1, in_size])
+    if len(heads) == 1:
+        kernel = tf.reshape(kernels[0], [in_size, heads[0][1]])
+        bias_var = biases[0]
+    else:
+        kernel = _cached_concat(kernels, axis=1, name='weights',
+                                shapes=[[in_size, out_depth] for _, out_depth in heads])
+        bias_var = _cached_concat(biases, axis=0, name='bias')
+    outputs = tf.nn.bias_add(tf.matmul(flat_inp, kernel), bias_var)
+    if len(heads) > 1:
+        outputs = tf.split(outputs, [out_depth for _, out_depth in heads], axis=1)
+    else:
+        outputs = [outputs]
+
+    results = []
+    for (scope, out_depth), output in zip(heads, outputs):
+        with _optional_variable_scope(scope):
+            if not flatten:
+                output = tf.reshape(output, [-1, 1, 1, out_depth])
+            output = tf.identity(output, name=name)
+            if activation is not None:
+                output = getattr(tf.nn, activation)(output, name=activation)
+        results.append(output)
+    return results
 
 def factored_fc(inp,
                 out_depth,
@@ -983,6 +1275,7 @@ def factored_fc(inp,
                 flatten=True,
                 dropout=None,
                 dropout_seed=0,
+                contraction='feature_first',
                 name='factored_fc'):
 
     '''
@@ -1003,6 +1296,60 @@ def factored_fc(inp,
     spatial_mask_init, feature_kernel_init: in ['xavier', 'zeros', 'constant', etc.]
     spatial_mask_init_kwargs, feature_kernel_init_kwargs: kwargs to pass to tfutils.model.initializer, e.g. 'value' for a constant init
     bias: float value for constant bias initializer
+    contraction: order in which the input is contracted with the two kernels. All give the same result up to float rounding.
+                 'feature_first': over D first, with a B x H x W x N intermediate, then a depthwise conv with the spatial mask
+                 'spatial_first': over H, W first, with a B x D x N intermediate, then over D
+                 'einsum': a single tf.einsum over both
+                 'auto': whichever of 'feature_first' and 'spatial_first' has the smaller intermediate
+                 The default 'feature_first' is the original order, so outputs of existing models do not change;
+                 the others sum in a different order and differ from it by float rounding.
+    '''
+    return factored_fc_heads(inp, [(None, out_depth)],
+                             spatial_mask_init=spatial_mask_init,
+                             spatial_mask_init_kwargs=spatial_mask_init_kwargs,
+                             feature_kernel_init=feature_kernel_init,
+                             feature_kernel_init_kwargs=feature_kernel_init_kwargs,
+                             kernel_init=kernel_init,
+                             kernel_init_kwargs=kernel_init_kwargs,
+                             bias=bias,
+                             spatial_reg_scales=spatial_reg_scales,
+                             feature_reg_scales=feature_reg_scales,
+                             activation=activation,
+                             flatten=flatten,
+                             dropout=dropout,
+                             dropout_seed=dropout_seed,
+                             contraction=contraction,
+                             name=name)[0]
+
+def factored_fc_heads(inp,
+                      heads,
+                      spatial_mask_init='xavier',
+                      spatial_mask_init_kwargs=None,
+                      feature_kernel_init='xavier',
+                      feature_kernel_init_kwargs=None,
+                      kernel_init=None,
+                      kernel_init_kwargs={},
+                      bias=1.0,
+                      spatial_reg_scales=None,
+                      feature_reg_scales=None,
+                      activation=None,
+                      flatten=True,
+                      dropout=None,
+                      dropout_seed=0,
+                      contraction='feature_first',
+                      name='factored_fc'):
+    '''
+    Evaluates several factored_fc readouts of the same input as one, with the kernels of
+    all heads concatenated along the neuron dimension.
+
+    Args:
+
+    inp: a rank 4 tensor with shape [Batch, H, W, D]
+    heads: list of (scope, out_depth) pairs. The variables of each head are those factored_fc would create
+           in variable scope scope (or the current variable scope if scope is None).
+    Other args are as in factored_fc and shared by all heads.
+
+    Returns the list of head outputs
     '''
     if spatial_mask_init_kwargs is None:
         spatial_mask_init_kwargs = {}
@@ -1017,73 +1364,97 @@ def factored_fc(inp,
     # spatial dimensions of input layer, H x W x D
     in_shape = inp.get_shape().as_list()[1:4]
 
-    # spatial mask conv kernel 
-    try:
-        init = tfutils.model.initializer(spatial_mask_init, **spatial_mask_init_kwargs)
-    except:
-        init = tfutils.model_tool_old.initializer(spatial_mask_init, **spatial_mask_init_kwargs)
+    spatial_kernels = []
+    feature_kernels = []
+    biases = []
+    for scope, out_depth in heads:
+        with _optional_variable_scope(scope):
+            # spatial mask conv kernel 
+            init = _initializer(spatial_mask_init, **spatial_mask_init_kwargs)
 
-    reg_func = _get_regularizer(spatial_reg_scales)
+            reg_func = _get_regularizer(spatial_reg_scales)
 
-    # kernel for depthwise convolution with channel_multiplier=1
-    spatial_kernel = tf.get_variable(initializer=init,
-                             shape=[in_shape[0], in_shape[1], out_depth, 1],
-                             dtype=tf.float32,
-                             regularizer=reg_func,
-                             name='weights_spatial')
-    #print(spatial_kernel.name, spatial_kernel.get_shape().as_list())
+            # kernel for depthwise convolution with channel_multiplier=1
+            spatial_kernels.append(tf.get_variable(initializer=init,
+                                     shape=[in_shape[0], in_shape[1], out_depth, 1],
+                                     dtype=tf.float32,
+                                     regularizer=reg_func,
+                                     name='weights_spatial'))
     
-    # feature kernel
-    try:
-        init = tfutils.model.initializer(feature_kernel_init, **feature_kernel_init_kwargs)
-    except:
-        init = tfutils.model_tool_old.initializer(feature_kernel_init, **feature_kernel_init_kwargs)
+            # feature kernel
+            init = _initializer(feature_kernel_init, **feature_kernel_init_kwargs)
 
-    reg_func = _get_regularizer(feature_reg_scales)
+            reg_func = _get_regularizer(feature_reg_scales)
 
-    # kernel only operates in D dimension
-    feature_kernel = tf.get_variable(initializer=init,
-                             shape=[in_shape[2], out_depth],
-                             dtype=tf.float32,
-                             regularizer=reg_func,
-                             name='weights_feature')
-    #print(feature_kernel.name, feature_kernel.get_shape().as_list())
-    try:    
-        init = tfutils.model.initializer(kind='constant', value=bias)
-    except:
-        init = tfutils.model_tool_old.initializer(kind='constant', value=bias)
-    biases = tf.get_variable(initializer=init,
-                             shape=[out_depth],
-                             dtype=tf.float32,
-                             regularizer=None,
-                             name='bias')
+            # kernel only operates in D dimension
+            feature_kernels.append(tf.get_variable(initializer=init,
+                                     shape=[in_shape[2], out_depth],
+                                     dtype=tf.float32,
+                                     regularizer=reg_func,
+                                     name='weights_feature'))
 
+            init = _initializer(kind='constant', value=bias)
+            biases.append(tf.get_variable(initializer=init,
+                                     shape=[out_depth],
+                                     dtype=tf.float32,
+                                     regularizer=None,
+                                     name='bias'))
 
+    out_depths = [out_depth for _, out_depth in heads]
+    if len(heads) == 1:
+        spatial_kernel, feature_kernel, bias_var = spatial_kernels[0], feature_kernels[0], biases[0]
+    else:
+        spatial_kernel = _cached_concat(spatial_kernels, axis=2, name='weights_spatial')
+        feature_kernel = _cached_concat(feature_kernels, axis=1, name='weights_feature')
+        bias_var = _cached_concat(biases, axis=0, name='bias')
     
     # ops
     if dropout is not None:
         inp = tf.nn.dropout(inp, dropout, seed=dropout_seed, name='dropout')
-    # inner product along dimension D
-    #print(inp.name, inp.shape)
-    inp = tf.tensordot(inp, feature_kernel, axes=[[3],[0]]) # inp now B x H x W x N
-
-    # depthwise conv to fully connect all spatial points within a neuron
-    #print(inp,name, inp.shape)
-    inp = tf.nn.depthwise_conv2d(inp, spatial_kernel,
-                        strides=[1,1,1,1],
-                        padding='VALID')
-
-    # flatten and add biases
-    #print(inp.name, inp.shape)
-    if flatten:
+    if contraction == 'auto':
+        # both orders cost B*H*W*D*N multiply-adds; pick the one with the smaller intermediate
+        contraction = 'spatial_first' if in_shape[0] * in_shape[1] > in_shape[2] else 'feature_first'
+
+    if contraction == 'feature_first':
+        # inner product along dimension D
+        #print(inp.name, inp.shape)
+        inp = tf.tensordot(inp, feature_kernel, axes=[[3],[0]]) # inp now B x H x W x N
+
+        # depthwise conv to fully connect all spatial points within a neuron
+        #print(inp,name, inp.shape)
+        inp = tf.nn.depthwise_conv2d(inp, spatial_kernel,
+                            strides=[1,1,1,1],
+                            padding='VALID')
         inp = tf.squeeze(inp, axis=[1, 2]) # do not want to accidentally squeeze N dimension if N = 1, else bias_add will throw error
-    output = tf.nn.bias_add(inp, biases, name=name)
-    
-    if activation is not None:
-        output = getattr(tf.nn, activation)(output, name=activation)
+    elif contraction == 'spatial_first':
+        # inner product along dimensions H, W
+        inp = tf.tensordot(inp, spatial_kernel[:, :, :, 0], axes=[[1, 2], [0, 1]]) # inp now B x D x N
+
+        # inner product along dimension D, separately for each neuron
+        inp = tf.reduce_sum(inp * feature_kernel, axis=1)
+    elif contraction == 'einsum':
+        inp = tf.einsum('bhwd,hwn,dn->bn', inp, spatial_kernel[:, :, :, 0], feature_kernel)
+    else:
+        raise ValueError('Unknown contraction: {}'.format(contraction))
 
-    #print(output.name, output.shape)
-    return output
+    # add biases
+    #print(inp.name, inp.shape)
+    inp = tf.nn.bias_add(inp, bias_var)
+    if len(heads) > 1:
+        outputs = tf.split(inp, out_depths, axis=1)
+    else:
+        outputs = [inp]
+
+    results = []
+    for (scope, out_depth), output in zip(heads, outputs):
+        with _optional_variable_scope(scope):
+            if not flatten:
+                output = tf.reshape(output, [-1, 1, 1, out_depth])
+            output = tf.identity(output, name=name)
+            if activation is not None:
+                output = getattr(tf.nn, activation)(output, name=activation)
+        results.append(output)
+    return results
 
 def shared_spatial_mlp(inp,
                         out_depth,
@@ -1099,10 +1470,7 @@ def shared_spatial_mlp(inp,
     
     if kernel_initializer_kwargs is None:
         kernel_initializer_kwargs = {}
-    try:
-        kernel_init = tfutils.model.initializer(kind=kernel_initializer, **kernel_initializer_kwargs)        
-    except:
-        kernel_init = tfutils.model_tool_old.initializer(kind=kernel_initializer, **kernel_initializer_kwargs)
+    kernel_init = _initializer(kind=kernel_initializer, **kernel_initializer_kwargs)        
     bias_init = tf.constant_initializer(value=bias)                    
 
     if activation is None:
@@ -1159,25 +1527,21 @@ def shared_xy_graph_conv(inp,
 
     print("inp shape", inp.shape.as_list())
     B,H,W,C = inp.shape.as_list()
-    try:
-        init = tfutils.model.initializer(kind='constant', value=bias)        
-        bias_init = tfutils.model.initializer(kind='constant', value=bias)
-    except:
-        init = tfutils.model_tool_old.initializer(kind='constant', value=bias)                
-        bias_init = tfutils.model_tool_old.initializer(kind='constant', value=bias)
+    init = _initializer(kind='constant', value=bias)        
+    bias_init = _initializer(kind='constant', value=bias)
     
     # X,Y coordinate functions
-    ones = tf.ones(shape=[1,H,W], dtype=tf.float32)
-    hw_grid = scale * tf.stack([tf.reshape(tf.range(W, dtype=tf.float32), [1,1,W]) * ones,
-                                tf.reshape(tf.range(H, dtype=tf.float32), [1,H,1]) * ones],
-                               axis=-1) # [1,H,W,2] channels will be mapped to x,y
+    hw_grid = np.stack(np.meshgrid(np.arange(W), np.arange(H)), axis=-1)[None].astype(np.float32)
+    hw_grid = get_constant(('hw_grid', scale), hw_grid.shape, tf.float32,
+                           lambda: tf.constant(scale * hw_grid, name='hw_grid')) # [1,H,W,2] channels will be mapped to x,y
 
     coordinate_filter = tf.get_variable("xy_filter",
                                         shape=[1,1,2,1],
                                         dtype=tf.float32,
                                         initializer=init
     )
-    coordinate_filter *= tf.reshape(tf.constant([1.0, -1.0], dtype=tf.float32), [1,1,2,1])
+    coordinate_filter *= get_constant('xy_sign', [1,1,2,1], tf.float32,
+                                      lambda: tf.constant([1.0, -1.0], shape=[1,1,2,1], dtype=tf.float32, name='xy_sign'))
     coordinate_bias = tf.get_variable("xy_bias",
                                       shape=[1,1,1,2],
                                       dtype=tf.float32,
@@ -1197,7 +1561,7 @@ def shared_xy_graph_conv(inp,
     # add coordinates to MLP outputs
     # out = tf.expand_dims(tf.concat([xy_grid, tf.zeros([1,H,W,num_out_attrs-2], dtype=tf.float32)], axis=3), -1) # [B,H,W,num_out_attrs,node_multiplier]
     # out *= tf.ones([B,H,W,num_out_attrs, node_multiplier], dtype=tf.float32)
-    out += tf.expand_dims(tf.concat([xy_grid, tf.zeros([1,H,W,num_out_attrs-2], dtype=tf.float32)], axis=3), -1) # [B,H,W,num_out_attrs,node_multiplier]
+    out += tf.expand_dims(tf.pad(xy_grid, [[0,0], [0,0], [0,0], [0,num_out_attrs-2]]), -1) # [B,H,W,num_out_attrs,node_multiplier]
 
     # reshape to 4-tensor with spatial dimensions combined
     out = tf.transpose(out, [0,1,2,4,3]) # [B,H,W,M,num_out_attrs]
@@ -1207,6 +1571,19 @@ def shared_xy_graph_conv(inp,
     print("node output shape", out.shape.as_list())
     return out
     
+def identity_state(state, name='state'):
+    """
+    Applies tf.identity to every tensor of a state, which can be a nested
+    structure (tuple, namedtuple, dict) that is carried across time as is
+    """
+    return nest.map_structure(lambda s: tf.identity(s, name=name), state)
+
+def get_state_shape(state):
+    """
+    Shapes of the tensors of a (possibly nested) state, in the same structure
+    """
+    return nest.map_structure(lambda s: s.shape, state)
+
 class GenFuncCell(RNNCell):
 
     def __init__(self,
@@ -1218,7 +1595,10 @@ class GenFuncCell(RNNCell):
                  input_init=(tf.zeros, None),
                  state_init=(tf.zeros, None),
                  dtype=tf.float32,
-                 name=None
+                 name=None,
+                 delta_tol=None,
+                 closed_form=False,
+                 hoist=False
                  ):
 
         self.harbor_shape = harbor_shape
@@ -1237,6 +1617,153 @@ class GenFuncCell(RNNCell):
 
         self.internal_time = 0
 
+        # inference mode that reuses the pre-memory result while the harbor output barely changes
+        self.delta_tol = delta_tol
+        self.reset_delta()
+
+        # states of the default memory over steps with the same inputs are computed in closed form
+        self.closed_form = closed_form
+        self._window = None
+
+        # computation on the same inputs as at an earlier step is reused, see hoisted
+        self.hoist = hoist
+
+        self._compile()
+
+    def _compile(self):
+        """
+        Resolves once how each pre- and post-memory function and the memory
+        function are called, so that __call__ does no per-timestep dispatching
+        or copying of kwargs
+        """
+        self._pre_memory_ops = [self._compile_op(function, kwargs) for function, kwargs in self.pre_memory or []]
+        self._post_memory_ops = [self._compile_op(function, kwargs) for function, kwargs in self.post_memory or []]
+
+        mem_kwargs = copy.deepcopy(self.memory[1])
+        self._no_state = mem_kwargs.pop('no_state', False)
+        mem_kwargs.pop('time_suffix', None)
+        self._memory_op = (self.memory[0], mem_kwargs, mem_kwargs.get('time_sep', False))
+        # the closed form assumes that the pre-memory output over a window is the one at its start,
+        # which ops with separate variables per time step or with dropout break
+        self._closed_form = (self.closed_form and self.memory[0] is memory and not self._memory_op[2]
+                             and not any(op[3] for op in self._pre_memory_ops)
+                             and not _is_stochastic(*self.harbor)
+                             and not any(_is_stochastic(op[0], op[1]) for op in self._pre_memory_ops))
+
+        # harbor and pre-memory ops only depend on the inputs, unless they are separate per time step;
+        # the whole step also does when the memory does not carry anything over from the last step
+        self._hoist_pre_memory = self.hoist and self.delta_tol is None and not any(op[3] for op in self._pre_memory_ops)
+        function, mem_kwargs, _ = self._memory_op
+        stateless = self._no_state or (function is memory and mem_kwargs.get('memory_decay', 0) == 0
+                                       and not mem_kwargs.get('trainable', False))
+        self._hoist_step = self._hoist_pre_memory and stateless and not any(op[3] for op in self._post_memory_ops)
+
+        if self.delta_tol is not None and any(op[3] for op in self._pre_memory_ops):
+            raise ValueError('delta_tol requires pre-memory ops that share their variables across time (no time_sep)')
+
+    def reset_delta(self):
+        """
+        Forgets the harbor output and pre-memory result that the next call compares with
+        (see delta_tol) and the record of skipped steps; called by the unrollers before the
+        first time step
+        """
+        self._delta_ref = None
+        self.skips = []
+
+    @staticmethod
+    def _compile_op(function, kwargs):
+        """
+        Returns (function, kwargs, calling convention, time_sep) where the
+        calling convention is one of
+            - None: function(output, **kwargs)
+            - 'inputs': function(output, inputs, **kwargs), as component_conv needs to know the inputs
+            - 'return_input': same as 'inputs', but the function also returns its input for a residual
+            - 'res_input': function(output, res_input, **kwargs)
+        """
+        kwargs = dict(kwargs)
+        kwargs.pop('time_suffix', None) # passed explicitly at call time
+        name = getattr(function, '__name__', None)
+        if name == 'component_conv':
+            convention = 'return_input' if kwargs.get('return_input', False) else 'inputs'
+        elif name == 'residual_add':
+            convention = 'res_input'
+        else:
+            convention = None
+        return function, kwargs, convention, kwargs.get('time_sep', False)
+
+    @staticmethod
+    def _apply_op(op, output, inputs, res_input, time_suffix):
+        """
+        Calls a compiled op and returns (output, res_input)
+        """
+        function, kwargs, convention, time_sep = op
+        if time_sep:
+            kwargs = dict(kwargs, time_suffix=time_suffix) # used for scoping in the op
+        if convention == 'return_input':
+            return function(output, inputs, **kwargs)
+        elif convention == 'inputs':
+            output = function(output, inputs, **kwargs)
+        elif convention == 'res_input':
+            output = function(output, res_input, **kwargs)
+        else:
+            output = function(output, **kwargs)
+        return output, res_input
+
+    def _pre_memory(self, output, inputs, time_suffix):
+        res_input = None
+        for pre_name_counter, op in enumerate(self._pre_memory_ops):
+            with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
+                output, res_input = self._apply_op(op, output, inputs, res_input, time_suffix)
+        return output, res_input
+
+    def _delta_pre_memory(self, harbor_output, inputs, time_suffix):
+        """
+        Pre-memory ops that are skipped (with tf.cond) when the harbor output differs from
+        the one of the last computed step by less than delta_tol (max absolute difference),
+        in which case the pre-memory result of that step is reused. Whether the step was
+        skipped is appended to self.skips.
+        """
+        if self._delta_ref is None:
+            output, res_input = self._pre_memory(harbor_output, inputs, time_suffix)
+            self.skips.append(tf.constant(False))
+        else:
+            ref_harbor, ref_output, ref_res_input = self._delta_ref
+            delta = tf.reduce_max(tf.abs(harbor_output - ref_harbor))
+            skip = tf.less(delta, self.delta_tol, name='delta_skip')
+            self.skips.append(skip)
+
+            def reuse():
+                return [ref_output] if ref_res_input is None else [ref_output, ref_res_input]
+
+            def compute():
+                output, res_input = self._pre_memory(harbor_output, inputs, time_suffix)
+                return [output] if ref_res_input is None else [output, res_input]
+
+            results = tf.cond(skip, reuse, compute)
+            output = results[0]
+            res_input = None if ref_res_input is None else results[1]
+            # compare later steps with the last computed harbor output, so that small changes do not accumulate
+            harbor_output = tf.cond(skip, lambda: ref_harbor, lambda: harbor_output)
+        self._delta_ref = (harbor_output, output, res_input)
+        return output, res_input
+
+    def _harbor_pre_memory(self, inputs, time_suffix):
+        output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
+        return self._pre_memory(output, inputs, time_suffix)
+
+    def _window_steps(self, inputs, state):
+        """
+        Number of steps, including this call, in the current window of calls that continue
+        from each other's state with the same input tensors (such as a static input
+        repeated by the unrollers), or 0 if this call starts a new window
+        """
+        if self._window is None or state is None or state is not getattr(self, 'state', None):
+            return 0
+        window_inputs, _, steps = self._window
+        if len(inputs) != len(window_inputs) or any(a is not b for a, b in zip(inputs, window_inputs)):
+            return 0
+        return steps + 1
+
     def __call__(self, inputs=None, state=None):
         """
         Produce outputs given inputs
@@ -1251,6 +1778,20 @@ class GenFuncCell(RNNCell):
         :Returns:
             (output, state)
         """
+        if self._hoist_step and inputs is not None:
+            output, state = hoisted(lambda: self._step(inputs, state), ('step', self.name_tmp) + tuple(inputs))
+        else:
+            output, state = self._step(inputs, state)
+        self.output_tmp = output
+        self.state = state
+        self.output_shape_tmp = output.shape
+        self.internal_time = self.internal_time + 1
+        return output, state
+
+    def _step(self, inputs, state):
+        """
+        One step of the cell, see __call__
+        """
         # if hasattr(self, 'output') and inputs is None:
         #     raise ValueError('must provide inputs')
 
@@ -1269,72 +1810,55 @@ class GenFuncCell(RNNCell):
                 inputs = [self.input_init[0](shape=self.harbor_shape,
                                              **self.input_init[1])]
                 
-            output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
-
-            res_input = None
             curr_time_suffix = 't' + str(self.internal_time)
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if kwargs.get('time_sep', False):
-                        kwargs['time_suffix'] = curr_time_suffix # used for scoping in the op
-
-                    if function.__name__ == "component_conv":
-                        if kwargs.get('return_input', False):
-                            output, res_input = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                        else:
-                            output = function(output, inputs, **kwargs) # component_conv needs to know the inputs                            
-                    else:
-                        output = function(output, **kwargs)
+            if self.delta_tol is not None:
+                output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
+                output, res_input = self._delta_pre_memory(output, inputs, curr_time_suffix)
+            elif self._hoist_pre_memory:
+                output, res_input = hoisted(lambda: self._harbor_pre_memory(inputs, curr_time_suffix),
+                                            ('pre_memory',) + tuple(inputs))
+            else:
+                output, res_input = self._harbor_pre_memory(inputs, curr_time_suffix)
 
-                pre_name_counter += 1
+            window_steps = self._window_steps(inputs, state) if self._closed_form else 0
 
-            no_state = self.memory[1].get('no_state', False)
-            if no_state:
+            if self._no_state:
                 print('Bypassing state')
                 self.state_shape = None
                 self.state = None
             else:
-                mem_kwargs = copy.deepcopy(self.memory[1])
-                if 'no_state' in mem_kwargs.keys():
-                    mem_kwargs.pop('no_state')
-
                 if state is None:
                     state = self.state_init[0](shape=output.shape,
                                            dtype=self.dtype_tmp,
                                            **self.state_init[1])
 
-                if mem_kwargs.get('time_sep', False):
-                    mem_kwargs['time_suffix'] = curr_time_suffix # used for scoping in the op
-
-                state = self.memory[0](output, state, **mem_kwargs)
-                self.state = tf.identity(state, name='state')
+                function, mem_kwargs, time_sep = self._memory_op
+                if window_steps > 0:
+                    # the pre-memory output has the same value as at the start of the window
+                    _, start_state, _ = self._window
+                    state = memory_closed_form(output, start_state, window_steps, **mem_kwargs)
+                    self._window = (self._window[0], start_state, window_steps)
+                else:
+                    if self._closed_form:
+                        self._window = (list(inputs), state, 1)
+                    if time_sep:
+                        state = function(output, state, time_suffix=curr_time_suffix, **mem_kwargs) # used for scoping in the op
+                    else:
+                        state = function(output, state, **mem_kwargs)
+                self.state = identity_state(state)
 
-                self.state_shape = self.state.shape
+                self.state_shape = get_state_shape(self.state)
 
                 output = self.state
 
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
+            for post_name_counter, op in enumerate(self._post_memory_ops):
                 with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if kwargs.get('time_sep', False):
-                        kwargs['time_suffix'] = curr_time_suffix # used for scoping in the op
-
-                    if function.__name__ == "component_conv":
-                        output = function(output, inputs, **kwargs)
-                    elif function.__name__ == "residual_add":
-                        output = function(output, res_input, **kwargs)
-                    else:
-                        output = function(output, **kwargs)
-                post_name_counter += 1
-            self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
+                    output, res_input = self._apply_op(op, output, inputs, res_input, curr_time_suffix)
+            output = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
             # scope.reuse_variables()
             self._reuse = True
-        self.output_shape_tmp = self.output_tmp.shape
-
-        self.internal_time = self.internal_time + 1
 
-        return self.output_tmp, self.state
+        return output, self.state
 
     @property
     def state_size(self):
@@ -1358,3 +1882,27 @@ class GenFuncCell(RNNCell):
         return self.output_shape_tmp
         # else:
         #     raise ValueError('Output not initialized yet')
+
+
+def _is_stochastic(function, kwargs):
+    """
+    True if an op draws new random numbers at every call, i.e. applies dropout
+    """
+    return 'dropout' in (getattr(function, '__name__', None) or '') or kwargs.get('dropout') is not None
+
+def compile_ops(ops):
+    """
+    Resolves once how each (function, kwargs) of a pre- or post-memory list is called (see
+    GenFuncCell._compile_op), for the cells that wrap tensorflow RNN cells
+    """
+    return [GenFuncCell._compile_op(function, kwargs) for function, kwargs in ops or []]
+
+def apply_ops(ops, output, inputs, scope_prefix, reuse, time_suffix=None):
+    """
+    Calls compiled ops in the variable scopes scope_prefix + index and returns (output, res_input)
+    """
+    res_input = None
+    for counter, op in enumerate(ops):
+        with tf.variable_scope(scope_prefix + str(counter), reuse=reuse):
+            output, res_input = GenFuncCell._apply_op(op, output, inputs, res_input, time_suffix)
+    return output, res_input
@@ -159,13 +159,16 @@ class ConvGRUCell(ConvRNNCell):
                out_depth, 
                activation=tf.nn.tanh,
                kernel_initializer=None,
-               bias_initializer=None):
+               bias_initializer=None,
+               hoist_input=False):
     """Initialize the Conv GRU cell.
     Args:
       shape: int tuple thats the height and width of the cell
       filter_size: int tuple thats the height and width of the filter
       out_depth: int thats the depth of the cell 
       activation: Activation function of the inner states.
+      hoist_input: bool, compute the input projections once per input tensor
+        (see _conv_linear_hoisted)
     """
     self.shape = shape
     self.filter_size = filter_size
@@ -174,6 +177,7 @@ class ConvGRUCell(ConvRNNCell):
     self._activation = activation
     self._kernel_initializer = kernel_initializer
     self._bias_initializer = bias_initializer
+    self._hoist_input = hoist_input
 
   @property
   def state_size(self):
@@ -183,6 +187,13 @@ class ConvGRUCell(ConvRNNCell):
   def output_size(self):
     return self._size
 
+  def _linear(self, inputs, rec, out_depth, bias_initializer):
+    if self._hoist_input:
+      return _conv_linear_hoisted(inputs, rec, self.filter_size, out_depth, True, bias_initializer,
+                                  self._kernel_initializer)
+    return _conv_linear([inputs, rec], self.filter_size, out_depth, True, bias_initializer,
+                        self._kernel_initializer)
+
   def __call__(self, inputs, state):
     """Gated recurrent unit (GRU)."""
     with tf.variable_scope(type(self).__name__):  # "ConvGRUCell"
@@ -192,15 +203,11 @@ class ConvGRUCell(ConvRNNCell):
         if self._bias_initializer is None:
           dtype = [a.dtype for a in [inputs, state]][0]
           bias_ones = tf.constant_initializer(1.0, dtype=dtype)
-        value = tf.nn.sigmoid(
-              _conv_linear([inputs, state], self.filter_size, 2*self._out_depth, True, bias_ones,
-                self._kernel_initializer))
+        value = tf.nn.sigmoid(self._linear(inputs, state, 2*self._out_depth, bias_ones))
         r, u = tf.split(value=value, num_or_size_splits=2, axis=3)
 
       with tf.variable_scope("candidates"):
-        c = self._activation(
-          _conv_linear([inputs, r * state], self.filter_size, self._out_depth, True,
-              self._bias_initializer, self._kernel_initializer))
+        c = self._activation(self._linear(inputs, r * state, self._out_depth, self._bias_initializer))
 
       new_h = u * state + (1 - u) * c
       return new_h, new_h
@@ -222,7 +229,9 @@ class ConvLSTMCell(ConvRNNCell):
                weight_decay=0.0,
                layer_norm=False,
                norm_gain=1.0,
-               norm_shift=0.0):
+               norm_shift=0.0,
+               fused_norm=True,
+               hoist_input=False):
     """Initialize the Conv LSTM cell.
     Args:
       shape: int tuple thats the height and width of the cell
@@ -234,6 +243,10 @@ class ConvLSTMCell(ConvRNNCell):
       state_is_tuple: If True, accepted and returned states are 2-tuples of
         the `c_state` and `m_state`.  If False, they are concatenated
         along the column axis.  The latter behavior will soon be deprecated.
+      fused_norm: bool, layer normalize all gates in a single reduction
+        (see _fused_norm) instead of one layer_norm call per gate
+      hoist_input: bool, compute the input projection once per input tensor
+        (see _conv_linear_hoisted)
     """
     self.shape = shape
     self.filter_size = filter_size
@@ -253,6 +266,8 @@ class ConvLSTMCell(ConvRNNCell):
     self._weight_decay = weight_decay
     self._g = norm_gain
     self._b = norm_shift
+    self._fused_norm = fused_norm
+    self._hoist_input = hoist_input
 
   @property
   def state_size(self):
@@ -303,14 +318,21 @@ class ConvLSTMCell(ConvRNNCell):
       else:
           c, h = tf.split(axis=3, num_or_size_splits=2, value=state)
 
-      concat = _conv_linear([inputs, h], \
-                            self.filter_size, self._out_depth * 4, True, self._bias_initializer, self._kernel_initializer, kernel_regularizer=self._weight_decay)
+      if self._hoist_input:
+          concat = _conv_linear_hoisted(inputs, h, self.filter_size, self._out_depth * 4, True, self._bias_initializer,
+                                        self._kernel_initializer, kernel_regularizer=self._weight_decay)
+      else:
+          concat = _conv_linear([inputs, h], \
+                                self.filter_size, self._out_depth * 4, True, self._bias_initializer, self._kernel_initializer, kernel_regularizer=self._weight_decay)
+
 
+      if self._layer_norm and self._fused_norm:
+          concat = _fused_norm(concat, ["input", "transform", "forget", "output"], self._g, self._b)
 
       # i = input_gate, j = new_input, f = forget_gate, o = output_gate
       i, j, f, o = tf.split(axis=3, num_or_size_splits=4, value=concat)
 
-      if self._layer_norm:
+      if self._layer_norm and not self._fused_norm:
           #print("using layer norm")
           i = self._norm(i, "input")
           j = self._norm(j, "transform")
@@ -368,7 +390,8 @@ class ConvUGRNNCell(ConvRNNCell):
                bias_initializer=None,
                layer_norm=False,
                norm_gain=1.0,
-               norm_shift=0.0):
+               norm_shift=0.0,
+               fused_norm=True):
     """Initialize the Conv UGRNN cell.
     Args:
       shape: int tuple thats the height and width of the cell
@@ -378,6 +401,8 @@ class ConvUGRNNCell(ConvRNNCell):
       state_is_tuple: If True, accepted and returned states are 2-tuples of
         the `c_state` and `m_state`.  If False, they are concatenated
         along the column axis.  The latter behavior will soon be deprecated.
+      fused_norm: bool, layer normalize all gates in a single reduction
+        (see _fused_norm) instead of one layer_norm call per gate
     """
     self.shape = shape
     self.filter_size = filter_size
@@ -389,6 +414,7 @@ class ConvUGRNNCell(ConvRNNCell):
     self._forget_bias = forget_bias
     self._g = norm_gain
     self._b = norm_shift
+    self._fused_norm = fused_norm
     self._weight_decay = weight_decay
 
   @property
@@ -431,11 +457,14 @@ class ConvUGRNNCell(ConvRNNCell):
       concat = _conv_linear([inputs, state], \
               self.filter_size, 2*self._out_depth, True, self._bias_initializer, self._kernel_initializer, bias_regularizer=self._weight_decay, kernel_regularizer=self._weight_decay)
       
+      if self._layer_norm and self._fused_norm:
+          concat = _fused_norm(concat, ["g_act", "c_act"], self._g, self._b)
+
       g_act, c_act = tf.split(axis=3, num_or_size_splits=2, value=concat)
 
-      if self._layer_norm:
+      if self._layer_norm and not self._fused_norm:
           g_act = self._norm(g_act, "g_act")
-          c_act = self._norm(h_act, "c_act")
+          c_act = self._norm(c_act, "c_act")
 
       c = tf.nn.tanh(c_act)
       g = tf.nn.sigmoid(g_act + self._forget_bias)
@@ -458,7 +487,8 @@ class ConvIntersectionRNNCell(ConvRNNCell):
                bias_initializer=None,
                layer_norm=False,
                norm_gain=1.0,
-               norm_shift=0.0):
+               norm_shift=0.0,
+               fused_norm=True):
     """Initialize the Conv IntersectionRNN cell.
     Args:
       shape: int tuple thats the height and width of the cell
@@ -468,6 +498,8 @@ class ConvIntersectionRNNCell(ConvRNNCell):
       state_is_tuple: If True, accepted and returned states are 2-tuples of
         the `c_state` and `m_state`.  If False, they are concatenated
         along the column axis.  The latter behavior will soon be deprecated.
+      fused_norm: bool, layer normalize all gates in a single reduction
+        (see _fused_norm) instead of one layer_norm call per gate
     """
     self.shape = shape
     self.filter_size = filter_size
@@ -479,6 +511,7 @@ class ConvIntersectionRNNCell(ConvRNNCell):
     self._forget_bias = forget_bias
     self._g = norm_gain
     self._b = norm_shift
+    self._fused_norm = fused_norm
     self._weight_decay = weight_decay
 
   @property
@@ -525,9 +558,12 @@ class ConvIntersectionRNNCell(ConvRNNCell):
       concat = _conv_linear([inputs, state], \
               self.filter_size, 2*n_dim + 2*i_dim, True, self._bias_initializer, self._kernel_initializer, bias_regularizer=self._weight_decay, kernel_regularizer=self._weight_decay)
       
+      if self._layer_norm and self._fused_norm:
+          concat = _fused_norm(concat, ["gh_act", "h_act", "gy_act", "y_act"], self._g, self._b)
+
       gh_act, h_act, gy_act, y_act = tf.split(axis=3, num_or_size_splits=[n_dim, n_dim, i_dim, i_dim], value=concat)
 
-      if self._layer_norm:
+      if self._layer_norm and not self._fused_norm:
           gh_act = self._norm(gh_act, "gh_act")
           h_act = self._norm(h_act, "h_act")
           gy_act = self._norm(gy_act, "gy_act")
@@ -562,6 +598,9 @@ class tnn_ConvBasicCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -592,35 +631,21 @@ class tnn_ConvBasicCell(ConvRNNCell):
                                              **self.input_init[1])]
             output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
 
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -666,6 +691,9 @@ class tnn_ConvNormBasicCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -696,35 +724,21 @@ class tnn_ConvNormBasicCell(ConvRNNCell):
                                              **self.input_init[1])]
             output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
 
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -761,7 +775,8 @@ class tnn_ConvGRUCell(ConvRNNCell):
                  input_init=(tf.zeros, None),
                  state_init=(tf.zeros, None),
                  dtype=tf.float32,
-                 name=None
+                 name=None,
+                 hoist=False
                  ):
 
         self.harbor_shape = harbor_shape
@@ -769,6 +784,9 @@ class tnn_ConvGRUCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -778,7 +796,17 @@ class tnn_ConvGRUCell(ConvRNNCell):
 
         self._reuse = None
 
-        self.conv_cell = ConvGRUCell(memory[1]['shape'], memory[1]['filter_size'], memory[1]['out_depth'])
+        # computation on the same inputs as at an earlier step is reused, see tnn.main.set_hoist
+        self.hoist = hoist
+
+        self.conv_cell = ConvGRUCell(memory[1]['shape'], memory[1]['filter_size'], memory[1]['out_depth'],
+                                     hoist_input=hoist)
+
+    def _harbor_pre_memory(self, inputs):
+        output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
+
+        output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
+        return output
 
     def __call__(self, inputs=None, state=None):
         """
@@ -797,37 +825,25 @@ class tnn_ConvGRUCell(ConvRNNCell):
             if inputs is None:
                 inputs = [self.input_init[0](shape=self.harbor_shape,
                                              **self.input_init[1])]
-            output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
-
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            if self.hoist:
+                # the harbor and pre-memory ops only depend on the inputs
+                output = hoisted(lambda: self._harbor_pre_memory(inputs), ('pre_memory',) + tuple(inputs))
+            else:
+                output = self._harbor_pre_memory(inputs)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -864,7 +880,8 @@ class tnn_ConvLSTMCell(ConvRNNCell):
                  input_init=(tf.zeros, None),
                  state_init=(tf.zeros, None),
                  dtype=tf.float32,
-                 name=None
+                 name=None,
+                 hoist=False
                  ):
 
         self.harbor_shape = harbor_shape
@@ -872,6 +889,9 @@ class tnn_ConvLSTMCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -881,7 +901,20 @@ class tnn_ConvLSTMCell(ConvRNNCell):
 
         self._reuse = None
 
-        self.conv_cell = ConvLSTMCell(**self.memory[1])
+        # computation on the same inputs as at an earlier step is reused, see tnn.main.set_hoist
+        self.hoist = hoist
+
+        # "state_is_tuple": true in the memory kwargs carries (c, h) across time as a tuple
+        # rather than concatenating them every step (off by default, as for existing models)
+        mem_kwargs = dict(self.memory[1])
+        mem_kwargs.setdefault('hoist_input', hoist)
+        self.conv_cell = ConvLSTMCell(**mem_kwargs)
+
+    def _harbor_pre_memory(self, inputs):
+        output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
+
+        output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
+        return output
 
     def __call__(self, inputs=None, state=None):
         """
@@ -900,37 +933,25 @@ class tnn_ConvLSTMCell(ConvRNNCell):
             if inputs is None:
                 inputs = [self.input_init[0](shape=self.harbor_shape,
                                              **self.input_init[1])]
-            output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
-
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            if self.hoist:
+                # the harbor and pre-memory ops only depend on the inputs
+                output = hoisted(lambda: self._harbor_pre_memory(inputs), ('pre_memory',) + tuple(inputs))
+            else:
+                output = self._harbor_pre_memory(inputs)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -975,6 +996,9 @@ class tnn_ConvUGRNNCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -1005,35 +1029,21 @@ class tnn_ConvUGRNNCell(ConvRNNCell):
                                              **self.input_init[1])]
             output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
 
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -1078,6 +1088,9 @@ class tnn_ConvIntersectionRNNCell(ConvRNNCell):
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -1108,35 +1121,21 @@ class tnn_ConvIntersectionRNNCell(ConvRNNCell):
                                              **self.input_init[1])]
             output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
 
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs) # component_conv needs to know the inputs
-                    else:
-                       output = function(output, **kwargs)
-                pre_name_counter += 1
+            output, _ = apply_ops(self._pre_memory_ops, output, inputs, 'pre_', self._reuse)
 
             if state is None:
                 bs = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(bs, dtype = self.dtype_tmp)
 
             output, state = self.conv_cell(output, state)
-            self.state = tf.identity(state, name='state')
-
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
+            self.state = identity_state(state)
+
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse)
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             self._reuse = True
 
-        self.state_shape = self.state.shape
+        self.state_shape = get_state_shape(self.state)
         self.output_tmp_shape = self.output_tmp.shape
         return self.output_tmp, state
 
@@ -1217,6 +1216,81 @@ def _conv_linear(args, filter_size, out_depth, bias, bias_initializer=None, kern
       regularizer=tf.contrib.layers.l2_regularizer(bias_regularizer))
   return res + bias_term
 
+def _conv_linear_hoisted(inp, rec, filter_size, out_depth, bias, bias_initializer=None, kernel_initializer=None, bias_regularizer=None, kernel_regularizer=None):
+  """convolution of [inp, rec] as in _conv_linear, with the same variables, computed as a conv
+  of inp plus a conv of rec. The conv of inp (with the bias) only depends on inp, so it is
+  built once per inp tensor and reused at later steps (see tnn.cell.hoisted).
+  Args:
+    inp: a 4D Tensor, the input.
+    rec: a 4D Tensor, the recurrent input.
+    Others as in _conv_linear.
+  Returns:
+    A 4D Tensor with shape [batch h w out_depth]
+  """
+  in_depth = inp.get_shape().as_list()[3]
+  rec_depth = rec.get_shape().as_list()[3]
+  dtype = inp.dtype
+
+  if kernel_regularizer is None:
+    kernel_regularizer = 0.
+  if bias_regularizer is None:
+    bias_regularizer = 0.
+  if kernel_initializer is None:
+    kernel_initializer = tf.contrib.layers.xavier_initializer()
+  if bias_initializer is None:
+    bias_initializer = tf.contrib.layers.xavier_initializer()
+
+  kernel = tf.get_variable(
+      "weights", [filter_size[0], filter_size[1], in_depth + rec_depth, out_depth], dtype=dtype, initializer=kernel_initializer, regularizer=tf.contrib.layers.l2_regularizer(kernel_regularizer))
+  bias_term = None
+  if bias:
+    bias_term = tf.get_variable(
+        "bias", [out_depth],
+        dtype=dtype,
+        initializer=bias_initializer,
+        regularizer=tf.contrib.layers.l2_regularizer(bias_regularizer))
+
+  def input_projection():
+    res = tf.nn.conv2d(inp, kernel[:, :, :in_depth], strides=[1, 1, 1, 1], padding='SAME')
+    return res if bias_term is None else res + bias_term
+
+  res = hoisted(input_projection, ('input_projection', inp))
+  return res + tf.nn.conv2d(rec, kernel[:, :, in_depth:], strides=[1, 1, 1, 1], padding='SAME')
+
+def _fused_norm(inp, scopes, norm_gain=1.0, norm_shift=0.0):
+  """layer normalization of gates concatenated along the last axis:
+  Args:
+    inp: a 4D Tensor holding len(scopes) equally sized gates along axis 3.
+    scopes: list of str, the variable scope of each gate.
+    norm_gain: float, initial value of gamma.
+    norm_shift: float, initial value of beta.
+  Returns:
+    A 4D Tensor with the shape of inp where every gate is normalized as by
+    tf.contrib.layers.layer_norm(gate, scope=scope), but with the statistics of
+    all gates computed in one reduction. The gamma and beta variables are the
+    per-gate ones, so checkpoints are interchangeable with the unfused path.
+  """
+  shape = inp.get_shape().as_list()
+  num_gates = len(scopes)
+  depth = shape[-1] // num_gates
+
+  gammas = []
+  betas = []
+  for scope in scopes:
+    with tf.variable_scope(scope):
+      gammas.append(tf.get_variable(shape=[depth], initializer=tf.constant_initializer(norm_gain), name="gamma"))
+      betas.append(tf.get_variable(shape=[depth], initializer=tf.constant_initializer(norm_shift), name="beta"))
+
+  # [batch, h, w, gates, depth] with per-gate moments over h, w and depth
+  gates = tf.reshape(inp, [-1] + shape[1:-1] + [num_gates, depth])
+  axes = list(range(1, len(shape) - 1)) + [len(shape)]
+  mean, variance = tf.nn.moments(gates, axes, keep_dims=True)
+  normalized = tf.nn.batch_normalization(gates, mean, variance,
+                                         offset=tf.stack(betas),
+                                         scale=tf.stack(gammas),
+                                         variance_epsilon=1e-12)
+  return tf.reshape(normalized, [-1] + shape[1:])
+
 def _transpose_conv_linear(args, out_shape, filter_size, out_depth, bias, bias_initializer=None, kernel_initializer=None):
   """transpose convolution for dealing with feedbacks:
   Args:
@@ -0,0 +1,120 @@
+"""
+tf.data input pipelines for the input_seq of `tnn.main.unroll` and `tnn.main.unroll_tf`
+
+Batches are decoded and augmented in parallel and prefetched by tf.data, and a staging
+area holds the next batch so that a training step never waits on the host.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.util import nest
+
+
+def make_dataset(data, batch_size, map_fn=None, num_parallel_calls=None, shuffle_buffer=None,
+                 repeat=True, prefetch=2, seed=None):
+    """
+    Batched dataset of fixed batch size, as TNN harbors require.
+
+    :Args:
+        - data
+            A tf.data.Dataset of single examples, or arrays/tensors (or a dict of them) sliced
+            along their first dimension
+        - batch_size (int)
+    :Kwargs:
+        - map_fn (callable or None, default: None)
+            Per-example decoding and augmentation, run on num_parallel_calls threads
+            (default: the number of cores)
+        - shuffle_buffer (int or None, default: None)
+            Shuffle the examples with a buffer of this size
+        - repeat (bool, default: True)
+            Repeat the data indefinitely
+        - prefetch (int, default: 2)
+            Number of batches prepared ahead of the training loop
+        - seed (int or None, default: None)
+            Shuffle seed
+    """
+    dataset = data if isinstance(data, tf.data.Dataset) else tf.data.Dataset.from_tensor_slices(data)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+    if repeat:
+        dataset = dataset.repeat()
+    if map_fn is not None:
+        dataset = dataset.map(map_fn, num_parallel_calls=num_parallel_calls or multiprocessing.cpu_count())
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    if prefetch:
+        dataset = dataset.prefetch(prefetch)
+    return dataset
+
+
+def stage(tensors, capacity=1, name='input_staging'):
+    """
+    Passes a (nested) structure of tensors through a StagingArea.
+
+    Returns the staged tensors and the op that stages the next values. Run the op once
+    before the first step and then together with every step, so that the step reads the
+    batch staged by the previous one while the next batch is staged.
+    """
+    flat = nest.flatten(tensors)
+    area = tf.contrib.staging.StagingArea(dtypes=[t.dtype for t in flat],
+                                          shapes=[t.shape for t in flat],
+                                          capacity=capacity, name=name)
+    stage_op = area.put(flat)
+    staged = area.get()
+    if not isinstance(staged, (list, tuple)):
+        staged = [staged]
+    return nest.pack_sequence_as(tensors, list(staged)), stage_op
+
+
+def build_input_seq(dataset, inputs, sequences=(), time_major=False, staging=True):
+    """
+    input_seq for the unrollers from a batched dataset of dicts.
+
+    :Args:
+        - dataset
+            Batched tf.data.Dataset (see make_dataset) whose elements are dicts of tensors
+        - inputs (dict)
+            Dataset key of the input of each input node
+    :Kwargs:
+        - sequences (iterable, default: ())
+            Keys of per-timestep inputs of shape [batch, T, ...] ([T, batch, ...] if time_major),
+            which are split into a list of T inputs
+        - time_major (bool, default: False)
+            Layout of the sequence inputs
+        - staging (bool, default: True)
+            Pass the batches through a staging area, see stage
+    :Returns:
+        (input_seq, batch, stage_op): input_seq to pass to `tnn.main.unroll`, the full
+        batch dict (e.g. for the labels) and the op to run with every step (a no_op
+        without staging)
+    """
+    batch = dataset.make_one_shot_iterator().get_next()
+    if staging:
+        batch, stage_op = stage(batch)
+    else:
+        stage_op = tf.no_op()
+
+    input_seq = {}
+    for node, key in inputs.items():
+        if key in sequences:
+            input_seq[node] = tf.unstack(batch[key], axis=0 if time_major else 1)
+        else:
+            input_seq[node] = batch[key]
+    return input_seq, batch, stage_op
+
+
+def sliding_windows(frames, clip_len, stride=1):
+    """
+    Overlapping clips of clip_len frames, every stride frames, of a decoded video of shape
+    [n_frames, ...], as a read-only view of shape [n_clips, clip_len, ...] (no frames are copied)
+    """
+    frames = np.asarray(frames)
+    n_clips = (frames.shape[0] - clip_len) // stride + 1
+    if n_clips < 1:
+        raise ValueError('A video of {} frames is shorter than a clip of {}'.format(frames.shape[0], clip_len))
+    shape = (n_clips, clip_len) + frames.shape[1:]
+    strides = (frames.strides[0] * stride,) + frames.strides
+    return np.lib.stride_tricks.as_strided(frames, shape=shape, strides=strides, writeable=False)
@@ -0,0 +1,195 @@
+"""
+Equilibrium mode: the fixed point of the joint node update of a TNN
+
+Instead of unrolling ntimes steps and backpropagating through all of them, the outputs
+and states of all nodes are solved for the fixed point z* = F(z*, x) of one step of
+`tnn.main.unroll` (see `tnn.step.update`) on a static input x, with Anderson acceleration
+or plain fixed-point iteration in a tf.while_loop. The solver iterations are not
+differentiated. Gradients come from implicit differentiation at the fixed point
+instead: the gradient g with respect to z* solves g = dy + J^T g, with J = dF/dz at z*,
+which is iterated with vector-Jacobian products of a single extra application of F.
+Memory for the backward pass therefore does not grow with the solver iterations.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import step
+
+EPS = 1e-8
+
+
+def _to_vec(carry):
+    batch_size = carry[0].shape.as_list()[0]
+    return tf.concat([tf.reshape(c, [batch_size, -1]) for c in carry], axis=1)
+
+
+def _from_vec(vec, template):
+    sizes = [int(np.prod(c.shape.as_list()[1:])) for c in template]
+    parts = tf.split(vec, sizes, axis=1)
+    return [tf.reshape(p, c.shape) for p, c in zip(parts, template)]
+
+
+def _relative_residual(fx, x):
+    """
+    Largest ||F(x) - x|| / ||F(x)|| over the batch, for [batch, n] tensors
+    """
+    return tf.reduce_max(tf.norm(fx - x, axis=1) / (tf.norm(fx, axis=1) + EPS))
+
+
+def picard(func, x0, max_iter=30, tol=1e-4):
+    """
+    Fixed-point iteration x <- func(x) on [batch, n] vectors until the relative
+    residual is below tol. Returns (x, n_iter, residual)
+    """
+    def cond(k, x, res):
+        return tf.logical_and(k < max_iter, res > tol)
+
+    def body(k, x, res):
+        fx = func(x)
+        return k + 1, fx, _relative_residual(fx, x)
+
+    k, x, res = tf.while_loop(cond, body, [tf.constant(0), x0, tf.constant(np.inf, dtype=x0.dtype)],
+                              back_prop=False)
+    return x, k, res
+
+
+def anderson(func, x0, max_iter=30, tol=1e-4, history=5, beta=1., lam=1e-4):
+    """
+    Anderson acceleration of the fixed-point iteration x <- func(x) on [batch, n] vectors.
+
+    Every iterate is the combination of the last `history` func values (mixed with the
+    iterates by 1 - beta) whose residuals have the least squared norm, with weights that
+    sum to one, solved per sample (regularized by lam). Returns (x, n_iter, residual)
+    """
+    batch_size, n = x0.shape.as_list()
+    m = history
+    dtype = x0.dtype
+
+    def cond(k, x, X, F, res):
+        return tf.logical_and(k < max_iter, res > tol)
+
+    def body(k, x, X, F, res):
+        fx = func(x)
+        res = _relative_residual(fx, x)
+
+        # ring buffers of the last m iterates and their func values
+        pos = tf.one_hot(k % m, m, dtype=dtype)[None, :, None]
+        X = X * (1 - pos) + x[:, None] * pos
+        F = F * (1 - pos) + fx[:, None] * pos
+        valid = tf.cast(tf.range(m) < tf.minimum(k + 1, m), dtype)
+
+        # least-squares weights with sum one from the bordered normal equations;
+        # empty history slots get an identity row and zero weight
+        G = F - X
+        H = tf.matmul(G, G, transpose_b=True) * (valid[:, None] * valid[None, :])
+        H += tf.matrix_diag(lam * valid + (1 - valid))
+        border = tf.tile(valid[None, None, :], [batch_size, 1, 1])
+        top = tf.concat([tf.zeros([batch_size, 1, 1], dtype), border], axis=2)
+        bottom = tf.concat([tf.transpose(border, [0, 2, 1]), H], axis=2)
+        rhs = tf.concat([tf.ones([batch_size, 1, 1], dtype), tf.zeros([batch_size, m, 1], dtype)], axis=1)
+        alpha = tf.matrix_solve(tf.concat([top, bottom], axis=1), rhs)[:, 1:, 0]
+
+        x_new = beta * tf.einsum('bm,bmn->bn', alpha, F) + (1 - beta) * tf.einsum('bm,bmn->bn', alpha, X)
+        return k + 1, x_new, X, F, res
+
+    zeros = tf.zeros([batch_size, m, n], dtype)
+    k, x, _, _, res = tf.while_loop(cond, body,
+                                    [tf.constant(0), x0, zeros, zeros, tf.constant(np.inf, dtype=dtype)],
+                                    back_prop=False)
+    return x, k, res
+
+
+def _implicit_grad_hook(f_out, f_jac, z_jac, backward_iters):
+    """
+    Identity on f_out whose gradient dy is replaced by the solution g of g = dy + J^T g,
+    J^T g being the vector-Jacobian product of f_jac with respect to z_jac
+    """
+    @tf.custom_gradient
+    def hook(*zs):
+        def grad(*dys):
+            dys = [tf.zeros_like(z) if dy is None else dy for z, dy in zip(zs, dys)]
+            g = list(dys)
+            for _ in range(backward_iters):
+                vjp = tf.gradients(f_jac, z_jac, grad_ys=g)
+                g = [dy + (tf.zeros_like(dy) if v is None else v) for dy, v in zip(dys, vjp)]
+            return g
+        return [tf.identity(z) for z in zs], grad
+    return hook(*f_out)
+
+
+def equilibrium(G, inputs, solver='anderson', max_iter=30, tol=1e-4, backward_iters=20, **solver_kwargs):
+    """
+    Solves for the outputs and states of G at the fixed point of its time step on static inputs.
+
+    :Args:
+        - G
+            NetworkX DiGraph initialized with `tnn.main.init_nodes`
+        - inputs (dict)
+            External input tensor of each input node, the same at every step
+    :Kwargs:
+        - solver ('anderson' or 'picard', default: 'anderson')
+            See anderson and picard; solver_kwargs are passed to it
+        - max_iter (int, default: 30) and tol (float, default: 1e-4)
+            Solver iterations and relative residual at which it stops
+        - backward_iters (int, default: 20)
+            Iterations of the implicit gradient solve
+    :Returns:
+        A dict with
+            - 'outputs' and 'states': node outputs and states at the fixed point, keyed by
+              node. Their gradients are the implicit ones
+            - 'n_iter': solver iterations
+            - 'residual': relative residual of the whole carry at the last iteration
+            - 'node_residuals': relative residual ||F(z*) - z*|| / ||F(z*)|| of each node's
+              output at the solution, keyed by node
+    """
+    if solver == 'anderson':
+        solver_func = anderson
+    elif solver == 'picard':
+        solver_func = picard
+    else:
+        raise ValueError('Unknown solver: {}'.format(solver))
+    time_sep_nodes = step.time_sep_nodes(G)
+    if len(time_sep_nodes) > 0:
+        raise ValueError('equilibrium requires ops that share their variables across time (no time_sep), '
+                         'but nodes {} have time_sep ops'.format(time_sep_nodes))
+
+    # the first step creates the variables and defines the structure of the carry
+    with tf.name_scope('equilibrium_init'):
+        first_outputs, first_states = step.first_update(G, inputs)
+        template = step.flatten_carry(first_outputs, first_states)
+
+    def func(vec):
+        outputs, states = step.update(G, inputs, *step.unflatten_carry(_from_vec(vec, template),
+                                                                       first_outputs, first_states))
+        return _to_vec(step.flatten_carry(outputs, states))
+
+    with tf.name_scope('equilibrium_solve'):
+        vec, n_iter, residual = solver_func(func, tf.stop_gradient(_to_vec(template)),
+                                            max_iter=max_iter, tol=tol, **solver_kwargs)
+        z_star = _from_vec(tf.stop_gradient(vec), template)
+
+    # one more application of the step at the fixed point carries the gradients
+    # to the variables and inputs; the hook accounts for the dependence on z*
+    with tf.name_scope('equilibrium_grad'):
+        z_jac = [tf.identity(z) for z in z_star]
+        outputs, states = step.update(G, inputs, *step.unflatten_carry(z_jac, first_outputs, first_states))
+        f_jac = step.flatten_carry(outputs, states)
+        f_out = _implicit_grad_hook(f_jac, f_jac, z_jac, backward_iters)
+        outputs, states = step.unflatten_carry(f_out, first_outputs, first_states)
+
+    z_outputs, _ = step.unflatten_carry(z_star, first_outputs, first_states)
+    f_outputs, _ = step.unflatten_carry(f_jac, first_outputs, first_states)
+    batch_size = template[0].shape.as_list()[0]
+    node_residuals = {}
+    for node in outputs:
+        node_residuals[node] = _relative_residual(tf.reshape(f_outputs[node], [batch_size, -1]),
+                                                  tf.reshape(z_outputs[node], [batch_size, -1]))
+
+    return {'outputs': outputs,
+            'states': states,
+            'n_iter': n_iter,
+            'residual': residual,
+            'node_residuals': node_residuals}
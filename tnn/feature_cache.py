@@ -0,0 +1,230 @@
+"""
+Disk-backed cache of the outputs of an unrolled TNN per (node, timestep)
+
+Readouts trained on a frozen backbone only need its features, so the backbone can be run
+once over a dataset and the selected G.node[node]['outputs'][t] tensors stored in
+memory-mapped .npy files that later jobs slice without copying.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import glob
+import json
+import hashlib
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+
+
+def feature_name(node, t):
+    return '{}_t{}'.format(node, t)
+
+
+def cache_key(checkpoint=None, json_file=None, ntimes=None, **extra):
+    """
+    Hash identifying the features of a model: its checkpoint files (names, sizes and
+    modification times), its JSON (file contents or dict), ntimes and any extra settings
+    """
+    h = hashlib.sha1()
+    if checkpoint is not None:
+        for path in sorted(glob.glob(checkpoint + '*')):
+            st = os.stat(path)
+            h.update('{}:{}:{};'.format(os.path.basename(path), st.st_size, int(st.st_mtime)).encode('utf-8'))
+    if json_file is not None:
+        if isinstance(json_file, dict):
+            h.update(json.dumps(json_file, sort_keys=True).encode('utf-8'))
+        else:
+            with open(json_file, 'rb') as f:
+                h.update(f.read())
+    h.update(json.dumps([ntimes, sorted(extra.items())], sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _fit_pca(features, n_components):
+    """
+    Mean and the first n_components principal axes (rows) of features of shape [n, ...]
+    """
+    features = features.reshape([features.shape[0], -1]).astype(np.float64)
+    mean = features.mean(axis=0)
+    _, _, vt = np.linalg.svd(features - mean, full_matrices=False)
+    return mean.astype(np.float32), vt[:n_components].astype(np.float32)
+
+
+def build_feature_cache(sess, G, selection, batches, n_samples, cache_dir, key,
+                        dtype='float32', pca_components=None, pca_fit_samples=None):
+    """
+    Runs the unrolled graph G over a dataset once and stores the selected outputs.
+
+    If the cache for key is already complete it is returned without running anything, as long
+    as it was built with the same selection, n_samples, dtype and pca_components (otherwise a
+    ValueError is raised, since key should then have been different).
+
+    :Args:
+        - sess
+            Session in which the backbone variables are initialized or restored
+        - G
+            NetworkX DiGraph that has been unrolled with `tnn.main.unroll` or `tnn.main.unroll_tf`
+        - selection (list)
+            (node, t) pairs whose outputs are stored
+        - batches
+            Iterable of feed_dicts covering the dataset
+        - n_samples (int)
+            Number of samples in the dataset
+        - cache_dir (str)
+            Directory under which the features are stored in a subdirectory named key
+        - key (str)
+            Identifies the model, see cache_key
+    :Kwargs:
+        - dtype ('float32' or 'float16', default: 'float32')
+            Storage dtype
+        - pca_components (int or None, default: None)
+            If given, features are stored projected onto this many principal components,
+            fit on the first pca_fit_samples samples
+        - pca_fit_samples (int or None, default: None)
+            Number of samples used to fit the PCA (rounded up to whole batches). Defaults to
+            10 * pca_components
+    :Returns:
+        A FeatureCacheReader of the cache
+    """
+    names = [feature_name(node, t) for node, t in selection]
+    path = os.path.join(cache_dir, key)
+    if FeatureCacheReader.is_complete(path):
+        reader = FeatureCacheReader(path)
+        expected = {'features': names, 'n_samples': n_samples, 'dtype': dtype, 'pca_components': pca_components}
+        mismatched = sorted(k for k, v in expected.items() if reader.manifest.get(k) != v)
+        if len(mismatched) > 0:
+            raise ValueError('Feature cache {} was built with different {}: {} instead of {}'.format(
+                path, ', '.join(mismatched), [reader.manifest.get(k) for k in mismatched],
+                [expected[k] for k in mismatched]))
+        return reader
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    tensors = dict((feature_name(node, t), G.node[node]['outputs'][t]) for node, t in selection)
+    if pca_components is not None and pca_fit_samples is None:
+        pca_fit_samples = 10 * pca_components
+
+    arrays = {}
+    pca = {}
+    pending = [] # batches held back until the PCA is fit
+    n_written = 0
+
+    def write(outputs):
+        n = outputs[names[0]].shape[0]
+        for name in names:
+            out = outputs[name]
+            if name in pca:
+                mean, components = pca[name]
+                out = (out.reshape([n, -1]) - mean).dot(components.T)
+            if name not in arrays:
+                arrays[name] = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                                         dtype=dtype, shape=(n_samples,) + out.shape[1:])
+            arrays[name][n_written:n_written + n] = out
+        return n_written + n
+
+    for feed_dict in batches:
+        outputs = sess.run(tensors, feed_dict=feed_dict)
+        if pca_components is None:
+            n_written = write(outputs)
+            continue
+        pending.append(outputs)
+        if len(pca) == 0 and sum(p[names[0]].shape[0] for p in pending) >= pca_fit_samples:
+            for name in names:
+                pca[name] = _fit_pca(np.concatenate([p[name] for p in pending]), pca_components)
+        if len(pca) > 0:
+            for outputs in pending:
+                n_written = write(outputs)
+            pending = []
+    if len(pending) > 0:
+        # dataset smaller than pca_fit_samples
+        for name in names:
+            pca[name] = _fit_pca(np.concatenate([p[name] for p in pending]), pca_components)
+        for outputs in pending:
+            n_written = write(outputs)
+
+    if n_written != n_samples:
+        raise ValueError('Batches contained {} samples, expected {}'.format(n_written, n_samples))
+    for name in names:
+        arrays[name].flush()
+        if name in pca:
+            np.savez(os.path.join(path, name + '_pca.npz'), mean=pca[name][0], components=pca[name][1])
+    arrays.clear()
+
+    manifest = {'key': key, 'n_samples': n_samples, 'dtype': dtype,
+                'features': names, 'pca_components': pca_components, 'complete': True}
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    return FeatureCacheReader(path)
+
+
+class FeatureCacheReader(object):
+    """
+    Reads a feature cache written by build_feature_cache. Features are memory-mapped, so
+    contiguous slices are views of the files and are only read from disk when used.
+    """
+
+    def __init__(self, path):
+        if not self.is_complete(path):
+            raise ValueError('No complete feature cache in {}'.format(path))
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.n_samples = self.manifest['n_samples']
+        self._features = {}
+        self._pca = {}
+
+    @staticmethod
+    def is_complete(path):
+        manifest = os.path.join(path, MANIFEST)
+        if not os.path.exists(manifest):
+            return False
+        with open(manifest) as f:
+            return json.load(f).get('complete', False)
+
+    @property
+    def names(self):
+        return list(self.manifest['features'])
+
+    def features(self, node, t=None):
+        """
+        Memory-mapped array of the features of (node, t), or of the feature name node if t is None
+        """
+        name = node if t is None else feature_name(node, t)
+        if name not in self._features:
+            self._features[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._features[name]
+
+    def reconstruct(self, name, features):
+        """
+        Maps PCA-compressed features of name back to the flattened feature space
+        """
+        if self.manifest['pca_components'] is None:
+            return features
+        if name not in self._pca:
+            pca = np.load(os.path.join(self.path, name + '_pca.npz'))
+            self._pca[name] = (pca['mean'], pca['components'])
+        mean, components = self._pca[name]
+        return features.astype(np.float32).dot(components) + mean
+
+    def batches(self, batch_size, names=None, shuffle=False, seed=0, drop_remainder=False):
+        """
+        Yields dicts of feature batches keyed by feature name.
+
+        Without shuffling the batches are contiguous slices of the memory maps (no copies);
+        with shuffling the samples are gathered in sorted order within each batch.
+        """
+        names = self.names if names is None else names
+        arrays = [self.features(name) for name in names]
+        if shuffle:
+            order = np.random.RandomState(seed).permutation(self.n_samples)
+        for start in range(0, self.n_samples, batch_size):
+            stop = min(start + batch_size, self.n_samples)
+            if drop_remainder and stop - start < batch_size:
+                break
+            if shuffle:
+                idx = np.sort(order[start:stop])
+                yield dict((name, arr[idx]) for name, arr in zip(names, arrays))
+            else:
+                yield dict((name, arr[start:stop]) for name, arr in zip(names, arrays))
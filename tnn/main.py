@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import json
+import inspect
 import itertools
 import copy
 import math
@@ -91,6 +92,12 @@ def graph_from_json(json_file_name):
         attr['kwargs']['state_init'] = _get_func_from_kwargs(**json_node['state_init'])
         attr['kwargs']['dtype'] = json_node['dtype']
         attr['kwargs']['name'] = json_node['name']
+        if 'delta_tol' in json_node:
+            attr['kwargs']['delta_tol'] = json_node['delta_tol']
+        if 'closed_form' in json_node:
+            attr['kwargs']['closed_form'] = json_node['closed_form']
+        if 'hoist' in json_node:
+            attr['kwargs']['hoist'] = json_node['hoist']
 
     return G
 
@@ -160,6 +167,103 @@ def init_nodes(G, input_nodes, batch_size=256, channel_op='concat', to_exclude=N
                                                            attr['kwargs']['harbor_shape'], channel_op=channel_op)
 
         attr['cell'] = attr['cell'](**attr['kwargs'])
+        # names of the inputs in the order the unrollers pass them to the cell
+        attr['input_names'] = get_input_names(G, node, input_nodes)
+        attr['cell'].input_names = attr['input_names']
+
+def get_input_names(G, node, input_nodes):
+    """
+    Returns the names of the inputs of node in the order in which `unroll` and
+    `unroll_tf` pass them to its cell: the external input (named None) if node
+    is an input node, followed by its predecessors in sorted order
+    """
+    names = []
+    if node in input_nodes:
+        names.append(None)
+    names.extend(sorted(G.predecessors(node)))
+    return names
+
+def set_delta_tol(G, delta_tol, nodes=None):
+    """
+    Sets the delta_tol of GenFuncCell nodes (all by default) before `init_nodes`, so that
+    they skip their pre-memory ops while their harbor output changes by less than delta_tol
+    """
+    for node, attr in G.nodes(data=True):
+        if (nodes is None or node in nodes) and attr['cell'] is tnn.cell.GenFuncCell:
+            attr['kwargs']['delta_tol'] = delta_tol
+
+def set_closed_form(G, closed_form=True, nodes=None):
+    """
+    Makes GenFuncCell nodes (all by default) with the default `memory` compute their states
+    in closed form while the unrollers pass them the same inputs, instead of one step at a
+    time. Called before `init_nodes`
+    """
+    for node, attr in G.nodes(data=True):
+        if (nodes is None or node in nodes) and attr['cell'] is tnn.cell.GenFuncCell:
+            attr['kwargs']['closed_form'] = closed_form
+
+def _accepts_kwarg(cls, name):
+    try:
+        args = inspect.getfullargspec(cls.__init__).args
+    except AttributeError: # python 2
+        args = inspect.getargspec(cls.__init__).args
+    return name in args
+
+def set_hoist(G, hoist=True, nodes=None):
+    """
+    Makes nodes (all by default) whose cell supports it reuse computation that only depends
+    on inputs they already received at an earlier step, instead of recomputing it every step
+    (see `tnn.cell.hoisted`). Called before `init_nodes`.
+
+    For a GenFuncCell these are the harbor and pre-memory ops, and the whole step if the
+    memory does not carry anything over (no state or the default memory with a constant
+    zero decay), which makes feedforward prefixes on a static input compute once per node.
+    The recurrent cells of `tnn.convrnn` and `tnn.reciprocalgaternn` also reuse their
+    input projections. Random ops among them (e.g. dropout) are shared across steps.
+    """
+    for node, attr in G.nodes(data=True):
+        if (nodes is None or node in nodes) and _accepts_kwarg(attr['cell'], 'hoist'):
+            attr['kwargs']['hoist'] = hoist
+
+def forward_flops(tensors):
+    """
+    Floating point operations of the ops that tensors (a list or dict) depend on, from the
+    flops statistics that TensorFlow registers for its ops
+    """
+    if isinstance(tensors, dict):
+        tensors = list(tensors.values())
+    return tnn.cell._flops(tnn.cell._ops_since(tensors, 0))
+
+def hoisting_report(G):
+    """
+    Forward FLOPs of all outputs of the unrolled G ('flops'), the FLOPs that hoisting saved in
+    its graph ('saved_flops') and their fraction of what the outputs would cost without it ('saving')
+    """
+    outputs = [out for _, attr in G.nodes(data=True) for out in attr['outputs']]
+    flops = forward_flops(outputs)
+    saved = tnn.cell.hoisting_stats(outputs[0].graph)['saved_flops'] if len(outputs) > 0 else 0
+    return {'flops': flops,
+            'saved_flops': saved,
+            'saving': saved / max(1, flops + saved)}
+
+def reset_delta(cell):
+    """
+    Starts the delta comparisons of a cell anew, for cells that support delta_tol
+    """
+    if hasattr(cell, 'reset_delta'):
+        cell.reset_delta()
+
+def skip_rates(G):
+    """
+    Fraction of the time steps at which each node with a delta_tol skipped its
+    pre-memory ops, as scalar tensors keyed by node
+    """
+    rates = {}
+    for node, attr in G.nodes(data=True):
+        skips = getattr(attr['cell'], 'skips', [])
+        if getattr(attr['cell'], 'delta_tol', None) is not None and len(skips) > 0:
+            rates[node] = tf.reduce_mean(tf.cast(tf.stack(skips), tf.float32), name=node + '_skip_rate')
+    return rates
 
 def harbor_policy(in_shapes, shape, channel_op='concat'):
     nchnls = []
@@ -179,7 +283,74 @@ def harbor_policy(in_shapes, shape, channel_op='concat'):
     else:
         return shape[:-1] + [sum(nchnls)]
 
-def unroll(G, input_seq, ntimes=None):
+def frame_index(t, frame_policy=('hold', 1)):
+    """
+    Index of the frame presented at time step t: ('hold', k) presents every frame
+    for k steps, ('stride', s) presents every s-th frame, one per step
+    """
+    kind, k = frame_policy
+    if kind == 'hold':
+        return t // k
+    elif kind == 'stride':
+        return t * k
+    else:
+        raise ValueError('Unknown frame policy: {}'.format(kind))
+
+def _is_frame_sequence(G, node, input_val):
+    """
+    Whether an input tensor is a time-major sequence of frames rather than a single input,
+    i.e. has one more dimension than the harbor of node (e.g. [T, batch, dim] for fc inputs)
+    """
+    harbor_shape = getattr(G.node[node].get('cell'), 'harbor_shape', None)
+    if harbor_shape is not None:
+        return len(input_val.shape) == len(harbor_shape) + 1
+    return len(input_val.shape) == 5
+
+def _expand_input_seq(G, input_seq, ntimes, frame_policy=('hold', 1)):
+    """
+    Replaces every input in input_seq (in place) by a list of ntimes inputs, one per time step.
+
+    Lists are kept as they are and single tensors are repeated. Frame sequences are
+    mapped to time steps with frame_index; steps past the last frame see the last frame,
+    and steps that see the same frame share its tensor. A frame sequence can be
+    - a time-major tensor of shape [T, batch, ...]
+    - a tf.data Iterator, whose next element is either such a tensor or one frame batch,
+      in which case one element is read per frame that the steps need, in order
+    - a tf.data Dataset of frame batches, of which as many frames as ntimes steps need
+      are read at once (so that they are read in order)
+    """
+    n_frames = frame_index(ntimes - 1, frame_policy) + 1
+    for k in input_seq.keys():
+        input_val = input_seq[k]
+        if isinstance(input_val, (tuple, list)):
+            continue
+        if isinstance(input_val, tf.data.Dataset):
+            input_val = input_val.batch(n_frames, drop_remainder=True).make_one_shot_iterator()
+        if isinstance(input_val, tf.data.Iterator):
+            iterator = input_val
+            input_val = iterator.get_next()
+            if not _is_frame_sequence(G, k, input_val):
+                # one frame batch per element
+                input_val = [input_val]
+                while len(input_val) < n_frames:
+                    with tf.control_dependencies([input_val[-1]]):
+                        input_val.append(iterator.get_next())
+        elif not _is_frame_sequence(G, k, input_val):
+            input_seq[k] = [input_val] * ntimes
+            continue
+        length = len(input_val) if isinstance(input_val, list) else input_val.shape.as_list()[0]
+        frames = {}
+        seq = []
+        for t in range(ntimes):
+            idx = frame_index(t, frame_policy)
+            if length is not None:
+                idx = min(idx, length - 1)
+            if idx not in frames:
+                frames[idx] = tf.identity(input_val[idx], name='{}_frame{}'.format(k, idx))
+            seq.append(frames[idx])
+        input_seq[k] = seq
+
+def unroll(G, input_seq, ntimes=None, frame_policy=('hold', 1)):
     """
     Unrolls a TensorFlow graph in time
 
@@ -190,10 +361,15 @@ def unroll(G, input_seq, ntimes=None):
         - G
             NetworkX DiGraph that stores initialized GenFuncCell in 'cell' nodes
         - input_seq (dict)
-            A dict of inputs that specifies the input for each input node as its keys
+            A dict of inputs that specifies the input for each input node as its keys.
+            An input can be a tensor given at every time step, a list with one tensor
+            per time step, or a sequence of frames: a time-major [T, batch, ...] tensor,
+            a tf.data Iterator or a tf.data Dataset of frame batches (see _expand_input_seq)
     :Kwargs:
         - ntimes (int or None, default: None)
             The number of time steps
+        - frame_policy (tuple, default: ('hold', 1))
+            How frame sequences map to time steps, see _expand_input_seq
     """
     # find the longest path from the inputs to the outputs:
     input_nodes = input_seq.keys()
@@ -211,10 +387,7 @@ def unroll(G, input_seq, ntimes=None):
         ntimes = longest_path_len + 1
         print('Using a default ntimes of: ', ntimes) # useful for logging
 
-    for k in input_seq.keys():
-        input_val = input_seq[k]
-        if not isinstance(input_val, (tuple, list)):
-            input_seq[k] = [input_val] * ntimes
+    _expand_input_seq(G, input_seq, ntimes, frame_policy)
 
     for node, attr in G.nodes(data=True):
         attr['outputs'] = []
@@ -223,6 +396,7 @@ def unroll(G, input_seq, ntimes=None):
     for t in range(ntimes):  # Loop over time
         for node, attr in G.nodes(data=True):  # Loop over nodes
             if t == 0:
+                reset_delta(attr['cell'])
                 inputs = []
                 if node in input_nodes:
                     inputs.append(input_seq[node][t])
@@ -308,7 +482,7 @@ def topological_sort(G, ff_order, paths, node_attr):
     assert(set(s) == set(node_attr.keys()))
     return s
     
-def unroll_tf(G, input_seq, ntimes=None, ff_order=None):
+def unroll_tf(G, input_seq, ntimes=None, ff_order=None, frame_policy=('hold', 1)):
     """
     Unrolls a TensorFlow graph in time, but differs from the unroll() in that
     a full feedforward pass occurs at each timestep (as in the default 
@@ -321,7 +495,10 @@ def unroll_tf(G, input_seq, ntimes=None, ff_order=None):
         - G
             NetworkX DiGraph that stores initialized GenFuncCell in 'cell' nodes
         - input_seq (dict)
-            A dict of inputs that specifies the input for each input node as its keys
+            A dict of inputs that specifies the input for each input node as its keys.
+            An input can be a tensor given at every time step, a list with one tensor
+            per time step, or a sequence of frames: a time-major [T, batch, ...] tensor,
+            a tf.data Iterator or a tf.data Dataset of frame batches (see _expand_input_seq)
     :Kwargs:
         - ntimes (int or None, default: None)
             The number of time steps
@@ -331,6 +508,8 @@ def unroll_tf(G, input_seq, ntimes=None, ff_order=None):
             However, if there are feedbacks, this will fail, so it will pick the union of
             simple paths from input to output, and print it. Thus, you can only set ff_order
             if you have feedbacks and do not want the unroller to pick a path for you.
+        - frame_policy (tuple, default: ('hold', 1))
+            How frame sequences map to time steps, see _expand_input_seq
     """
     # find the longest path from the inputs to the outputs:
     input_nodes = input_seq.keys()
@@ -348,10 +527,7 @@ def unroll_tf(G, input_seq, ntimes=None, ff_order=None):
         ntimes = longest_path_len + 1
         print('Using a default ntimes of: ', ntimes) # useful for logging
 
-    for k in input_seq.keys():
-        input_val = input_seq[k]
-        if not isinstance(input_val, (tuple, list)):
-            input_seq[k] = [input_val] * ntimes
+    _expand_input_seq(G, input_seq, ntimes, frame_policy)
 
     node_attr = {}
     for node, attr in G.nodes(data=True):
@@ -365,6 +541,7 @@ def unroll_tf(G, input_seq, ntimes=None, ff_order=None):
         for node in s:  # Loop over nodes in topological order
             attr = node_attr[node]
             if t == 0:
+                reset_delta(attr['cell'])
                 inputs = []
                 if node in input_nodes:
                     inputs.append(input_seq[node][t])
@@ -0,0 +1,207 @@
+"""
+Feature extraction from an unrolled TNN sharded across worker processes
+
+Small models do not keep a many-core host busy from a single session, so the dataset is
+split into contiguous shards that worker processes extract in parallel. The graph is
+built once and exported as a MetaGraph that every worker imports, each worker restores
+the same checkpoint and runs with a fixed number of threads, and results are written by
+the workers straight into shared memory-mapped .npy files (one per (node, t)) instead of
+being sent back to the driver. The output is a feature cache that
+`tnn.feature_cache.FeatureCacheReader` reads.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from tnn import main
+from tnn.feature_cache import cache_key, feature_name, FeatureCacheReader, MANIFEST
+from tnn.recorder import get_selection
+
+GRAPH_INFO = 'graph.json'
+
+
+def build_graph(json_file, input_node, input_shape, batch_size, ntimes=None, selection=None):
+    """
+    Builds and unrolls the TNN of json_file in the default graph on an input placeholder.
+
+    Returns the placeholder and a dict of the selected outputs keyed by '<node>_t<t>'
+    """
+    inp = tf.placeholder(tf.float32, [batch_size] + list(input_shape), name='input')
+    G = main.graph_from_json(json_file)
+    main.init_nodes(G, input_nodes=[input_node], batch_size=batch_size)
+    main.unroll(G, input_seq={input_node: inp}, ntimes=ntimes)
+    tensors = dict((feature_name(node, t), G.node[node]['outputs'][t])
+                   for node, t in get_selection(G, selection))
+    return inp, tensors
+
+
+def cache_graph(graph_dir, json_file, input_node, input_shape, batch_size, ntimes=None, selection=None, seed=0):
+    """
+    Exports the unrolled graph as a MetaGraph under graph_dir, unless it is already there.
+
+    A checkpoint of the initial variables (seeded with seed) is saved alongside, so that
+    workers extracting from an untrained model agree on its weights.
+
+    Returns the directory of the cached graph
+    """
+    key = cache_key(json_file=json_file, ntimes=ntimes, input_node=input_node, input_shape=list(input_shape),
+                    batch_size=batch_size, selection=selection, seed=seed)
+    path = os.path.join(graph_dir, key)
+    if os.path.exists(os.path.join(path, GRAPH_INFO)):
+        return path
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    with tf.Graph().as_default():
+        tf.set_random_seed(seed)
+        inp, tensors = build_graph(json_file, input_node, input_shape, batch_size, ntimes, selection)
+        saver = tf.train.Saver()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.save(sess, os.path.join(path, 'init'), write_meta_graph=False)
+        tf.train.export_meta_graph(os.path.join(path, 'model.meta'), saver_def=saver.as_saver_def())
+
+    info = {'input': inp.name,
+            'batch_size': batch_size,
+            'tensors': dict((name, t.name) for name, t in tensors.items()),
+            'shapes': dict((name, t.shape.as_list()[1:]) for name, t in tensors.items())}
+    with open(os.path.join(path, GRAPH_INFO), 'w') as f:
+        json.dump(info, f)
+    return path
+
+
+def _extract_shard(args):
+    """
+    Worker: extracts the samples [start, stop) of the data into the output memory maps
+    """
+    graph_path, checkpoint, data_path, out_dir, start, stop, intra_op_threads, inter_op_threads = args
+    with open(os.path.join(graph_path, GRAPH_INFO)) as f:
+        info = json.load(f)
+    batch_size = info['batch_size']
+    data = np.load(data_path, mmap_mode='r')
+    outputs = dict((name, np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r+'))
+                   for name in info['tensors'])
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    with tf.Graph().as_default() as graph:
+        saver = tf.train.import_meta_graph(os.path.join(graph_path, 'model.meta'))
+        inp = graph.get_tensor_by_name(info['input'])
+        tensors = dict((name, graph.get_tensor_by_name(t)) for name, t in info['tensors'].items())
+        with tf.Session(config=config) as sess:
+            saver.restore(sess, checkpoint or os.path.join(graph_path, 'init'))
+            for i in range(start, stop, batch_size):
+                batch = data[i:min(i + batch_size, stop)]
+                n = batch.shape[0]
+                if n < batch_size:
+                    # the graph has a fixed batch size, so the last batch is padded
+                    batch = np.concatenate([batch, np.zeros((batch_size - n,) + batch.shape[1:], batch.dtype)])
+                results = sess.run(tensors, feed_dict={inp: batch})
+                for name, result in results.items():
+                    outputs[name][i:i + n] = result[:n]
+    for out in outputs.values():
+        out.flush()
+    return stop - start
+
+
+def extract(json_file, data, out_dir, input_node, selection=None, checkpoint=None, n_workers=None,
+            batch_size=256, ntimes=None, graph_dir=None, intra_op_threads=None, inter_op_threads=1,
+            dtype='float32'):
+    """
+    Extracts the selected outputs of a TNN over a dataset with a pool of worker processes.
+
+    :Args:
+        - json_file (str)
+            The model JSON, see `tnn.main.graph_from_json`
+        - data (str or np.ndarray)
+            Path of a .npy file or array of input images of shape [n_samples, ...]. Arrays
+            that are not memory maps are written to out_dir so that workers can map them.
+        - out_dir (str)
+            Directory of the output feature cache
+        - input_node (str)
+            Name of the input node
+    :Kwargs:
+        - selection (list or None, default: None)
+            Nodes and (node, t) pairs to extract, see `tnn.recorder.get_selection`. Defaults to all
+        - checkpoint (str or None, default: None)
+            Checkpoint to restore in every worker. If None, the seeded initial weights are used
+        - n_workers (int or None, default: None)
+            Number of worker processes, by default the number of cores. With one worker the
+            extraction runs in the calling process
+        - batch_size (int, default: 256)
+            Batch size of every worker
+        - ntimes (int or None, default: None)
+            Number of timesteps to unroll, see `tnn.main.unroll`
+        - graph_dir (str or None, default: None)
+            Where the exported graph is cached, by default in out_dir
+        - intra_op_threads (int or None, default: None) and inter_op_threads (int, default: 1)
+            Threads of each worker session. intra_op_threads defaults to the cores per worker
+        - dtype (str, default: 'float32')
+            Storage dtype
+    :Returns:
+        A FeatureCacheReader of out_dir
+    """
+    n_cores = multiprocessing.cpu_count()
+    n_workers = n_cores if n_workers is None else n_workers
+    intra_op_threads = intra_op_threads or max(1, n_cores // n_workers)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    if isinstance(data, str):
+        data_path = data
+    elif isinstance(data, np.memmap) and data.filename is not None and data.filename.endswith('.npy'):
+        data_path = data.filename
+    else:
+        data_path = os.path.join(out_dir, 'input.npy')
+        np.save(data_path, data)
+    data = np.load(data_path, mmap_mode='r')
+    n_samples = data.shape[0]
+
+    # TensorFlow does not survive a fork once it has run a session, so workers are spawned. Where
+    # they cannot be (Python 2), they are forked, so the graph is cached in a child process and the
+    # parent never runs a session
+    ctx = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    graph_args = (graph_dir or os.path.join(out_dir, 'graph'), json_file, input_node,
+                  tuple(data.shape[1:]), batch_size, ntimes, selection)
+    if n_workers > 1:
+        pool = ctx.Pool(1)
+        try:
+            graph_path = pool.apply(cache_graph, graph_args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        graph_path = cache_graph(*graph_args)
+    with open(os.path.join(graph_path, GRAPH_INFO)) as f:
+        info = json.load(f)
+    for name, shape in info['shapes'].items():
+        out = np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+',
+                                        dtype=dtype, shape=tuple([n_samples] + shape))
+        del out
+
+    # contiguous shards of whole batches
+    n_batches = int(np.ceil(n_samples / batch_size))
+    bounds = [min(n_samples, batch_size * int(round(i * n_batches / n_workers))) for i in range(n_workers + 1)]
+    shards = [(graph_path, checkpoint, data_path, out_dir, start, stop, intra_op_threads, inter_op_threads)
+              for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    if len(shards) == 1:
+        _extract_shard(shards[0])
+    else:
+        pool = ctx.Pool(len(shards))
+        try:
+            pool.map(_extract_shard, shards)
+        finally:
+            pool.close()
+            pool.join()
+
+    manifest = {'key': os.path.basename(graph_path), 'n_samples': n_samples, 'dtype': dtype,
+                'features': sorted(info['shapes'].keys()), 'pca_components': None, 'complete': True}
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    return FeatureCacheReader(out_dir)
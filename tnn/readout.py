@@ -0,0 +1,104 @@
+"""
+Readouts fit to the features of many (node, timestep) pairs of one unrolled TNN
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+
+import tensorflow as tf
+
+import tnn.cell
+
+
+def _parse_spec(spec):
+    """
+    Returns (node, t, n_targets, name) from a (node, t, n_targets[, name]) tuple or a dict with these keys
+    """
+    if isinstance(spec, dict):
+        node, t, n_targets = spec['node'], spec['t'], spec['n_targets']
+        name = spec.get('name')
+    else:
+        node, t, n_targets = spec[:3]
+        name = spec[3] if len(spec) > 3 else None
+    if name is None:
+        name = '{}_t{}'.format(node, t)
+    return node, t, n_targets, name
+
+
+def get_features(G, node, t):
+    """
+    Output of node at timestep t of an unrolled graph, as a rank 4 tensor
+    """
+    features = G.node[node]['outputs'][t]
+    if len(features.shape) == 2:
+        features = tf.reshape(features, [-1, 1, 1, features.shape.as_list()[1]])
+    return features
+
+
+def build_readouts(G, specs, targets=None, kind='spatial_fc', scope='readout', **head_kwargs):
+    """
+    Builds readout heads for many (node, timestep) pairs on top of a single unroll of G.
+
+    Heads that read the same features share them and are evaluated together as one op
+    (see tnn.cell.spatial_fc_heads and tnn.cell.factored_fc_heads), so the cost of fitting
+    many readouts is close to that of a single backbone pass.
+
+    :Args:
+        - G
+            NetworkX DiGraph that has been unrolled with `tnn.main.unroll` or `tnn.main.unroll_tf`
+        - specs (list)
+            (node, t, n_targets[, name]) tuples or dicts with these keys. name defaults to '<node>_t<t>'
+            and must be unique, as it is the variable scope of the head.
+    :Kwargs:
+        - targets (dict or None, default: None)
+            Target tensors of shape [batch, n_targets] keyed by head name. Per-head mean squared
+            errors are computed for the heads that have a target.
+        - kind ('spatial_fc' or 'factored_fc', default: 'spatial_fc')
+            The readout function
+        - scope (str, default: 'readout')
+            Variable scope of all heads
+        - head_kwargs
+            Passed to the readout function of every head
+    :Returns:
+        A dict with the head outputs of shape [batch, n_targets] keyed by head name under 'outputs'
+        and, if targets are given, the per-head losses under 'losses' and their sum under 'loss'
+    """
+    if kind == 'spatial_fc':
+        heads_func = tnn.cell.spatial_fc_heads
+        head_kwargs['flatten'] = True
+    elif kind == 'factored_fc':
+        heads_func = tnn.cell.factored_fc_heads
+        head_kwargs['flatten'] = True
+    else:
+        raise ValueError('Unknown readout kind: {}'.format(kind))
+
+    # group the heads by the features they read
+    groups = collections.OrderedDict()
+    names = set()
+    for spec in specs:
+        node, t, n_targets, name = _parse_spec(spec)
+        if name in names:
+            raise ValueError('Readout name {} is used more than once'.format(name))
+        names.add(name)
+        groups.setdefault((node, t), []).append((name, n_targets))
+
+    outputs = collections.OrderedDict()
+    with tf.variable_scope(scope):
+        for (node, t), heads in groups.items():
+            features = get_features(G, node, t)
+            group_outputs = heads_func(features, heads, **head_kwargs)
+            for (name, _), output in zip(heads, group_outputs):
+                outputs[name] = output
+
+    readouts = {'outputs': outputs}
+    if targets is not None:
+        losses = collections.OrderedDict()
+        for name, output in outputs.items():
+            if name in targets:
+                with tf.name_scope(scope + '_loss/' + name):
+                    losses[name] = tf.reduce_mean(tf.square(output - targets[name]), name='mse')
+        readouts['losses'] = losses
+        if len(losses) > 0:
+            readouts['loss'] = tf.add_n(list(losses.values()), name=scope + '_loss')
+    return readouts
@@ -4,6 +4,12 @@ import tfutils.model
 from tnn.cell import *
 from tnn.main import _get_func_from_kwargs
 import copy
+import contextlib
+
+try:
+    unicode
+except NameError: # python 3
+    unicode = str
 
 class ConvRNNCell(object):
     """Abstract object representing an Convolutional RNN cell.
@@ -93,6 +99,7 @@ class ReciprocalGateCell(ConvRNNCell):
                  layer_norm=False,
                  recurrent_keep_prob=1.0,
                  total_training_steps=250000,
+                 variational_dropout=False,
                  norm_gain=1.0,
                  norm_shift=0.0,
                  batch_norm=False,
@@ -101,7 +108,10 @@ class ReciprocalGateCell(ConvRNNCell):
                  batch_norm_epsilon=1e-5,
                  gate_tau_bn_gamma_init=0.1,
                  edges_init_zero=None,
-                 is_training=False):
+                 fuse_convs=True,
+                 state_is_tuple=False,
+                 is_training=False,
+                 hoist_input=False):
         """ 
         Initialize the memory function of the ReciprocalGateCell.
 
@@ -222,6 +232,9 @@ class ReciprocalGateCell(ConvRNNCell):
 
         self.recurrent_keep_prob = recurrent_keep_prob
         self.total_training_steps = total_training_steps
+        # sample each recurrent dropout mask once per sequence instead of at every timestep
+        self._variational_dropout = variational_dropout
+        self.reset_dropout_masks()
         
         try:
             self._batch_norm_func = tfutils.model.batchnorm_corr
@@ -243,6 +256,16 @@ class ReciprocalGateCell(ConvRNNCell):
         else:
             self._edges_init_zero = edges_init_zero
 
+        # compute convs that read the same input with the same filter size as one conv
+        self._fuse_convs = fuse_convs
+
+        # if True, states are dicts {'cell':cell_state, 'out':out_state} instead of their concatenation
+        self._state_is_tuple = state_is_tuple
+
+        # compute the ops on the input once per input tensor and reuse them at later steps (see tnn.cell.hoisted)
+        self._hoist_input = hoist_input
+        self._invariant_input = None
+
     def state_size(self):
         return {'cell':self._cell_size, 'out':self._size}
 
@@ -261,8 +284,12 @@ class ReciprocalGateCell(ConvRNNCell):
         if self.use_cell:
             cell_depth = self.cell_depth            
             cell_zeros = tf.zeros([batch_size, shape[0], shape[1], cell_depth], dtype=dtype)
+            if self._state_is_tuple:
+                return {'cell':cell_zeros, 'out':out_zeros}
             return tf.concat(values=[cell_zeros, out_zeros], axis=3, name="zero_state")
         else:
+            if self._state_is_tuple:
+                return {'out':out_zeros}
             return tf.identity(out_zeros, name="zero_state")
 
     def _norm(self, inp, scope, dtype=tf.float32):
@@ -486,20 +513,60 @@ class ReciprocalGateCell(ConvRNNCell):
             hidden = tf.div(hidden, keep_prob) * binary_tensor
         return hidden
 
-    def _apply_recurrent_dropout(self, inp, current_step=None):
+    def reset_dropout_masks(self):
+        """
+        Forget the cached variational dropout masks so that the next sequence samples new ones
+        """
+        self._dropout_graph = None
+        self._dropout_cache = {}
+
+    def _dropout_cached(self, key, fn):
+        """
+        Returns the tensor cached under key for the current graph and control flow context
+        (a tensor made inside a tf.while_loop or tf.cond cannot be used outside of it),
+        creating it with fn if needed
+        """
+        graph = tf.get_default_graph()
+        if self._dropout_graph is not graph:
+            self._dropout_graph = graph
+            self._dropout_cache = {}
+        cache = self._dropout_cache.setdefault(graph._get_control_flow_context(), {})
+        if key not in cache:
+            cache[key] = fn()
+        return cache[key]
+
+    def _recurrent_keep_prob(self, current_step=None):
 
         keep_prob = self.recurrent_keep_prob
-        if keep_prob < 1.0:
 
-            # linearly decrease keep prob over the course of training
+        # linearly decrease keep prob over the course of training
+        if current_step is None:
+            current_step = tf.cast(tf.train.get_or_create_global_step(), tf.float32)
+        burn_in_steps = self.total_training_steps
+        current_ratio = current_step / burn_in_steps
+        current_ratio = tf.minimum(1.0, current_ratio)
+
+        return (1 - current_ratio * (1 - keep_prob))
+
+    def _apply_recurrent_dropout(self, inp, current_step=None, key=None):
+        """
+        With variational_dropout, the mask of each temporal op (identified by key) is sampled once
+        per sequence and reused at every timestep
+        """
+        if self.recurrent_keep_prob < 1.0:
+
             if current_step is None:
-                current_step = tf.cast(tf.train.get_or_create_global_step(), tf.float32)
-            burn_in_steps = self.total_training_steps
-            current_ratio = current_step / burn_in_steps
-            current_ratio = tf.minimum(1.0, current_ratio)
+                # the schedule only depends on the global step, so build it once per graph
+                keep_prob = self._dropout_cached('keep_prob', self._recurrent_keep_prob)
+            else:
+                keep_prob = self._recurrent_keep_prob(current_step)
 
-            keep_prob = (1 - current_ratio * (1 - keep_prob))
-            inp = self._drop_recurrent_step(inp, keep_prob, is_training=self._is_training)
+            if self._variational_dropout and key is not None:
+                if self._is_training:
+                    mask = self._dropout_cached(key, lambda: self._drop_recurrent_step(tf.ones_like(inp[:, :1, :1, :1]), keep_prob))
+                    inp = inp * mask
+            else:
+                inp = self._drop_recurrent_step(inp, keep_prob, is_training=self._is_training)
         return inp
 
     def _apply_temporal_op(self, 
@@ -547,9 +614,191 @@ class ReciprocalGateCell(ConvRNNCell):
                         time_suffix=time_suffix)
 
         # apply recurrent dropout
-        inp = self._apply_recurrent_dropout(inp)
+        inp = self._apply_recurrent_dropout(inp, key=tf.get_variable_scope().name + '/' + scope)
         return inp
     
+    def _temporal_op_specs(self, inputs, prev_cell, prev_out, res_input):
+        """
+        Describes the non-separable convs of a step, keyed by the scope of their variables
+        """
+        specs = []
+        def add(name, inp, filter_size, out_depth, separable, **kwargs):
+            if inp is not None and not separable:
+                spec = {'name': name, 'inp': inp, 'filter_size': filter_size, 'out_depth': out_depth}
+                spec.update(kwargs)
+                specs.append(spec)
+
+        gamma_init = self._gate_tau_bn_gamma_init
+        if self.use_cell:
+            if res_input is not None and self.cell_residual:
+                add('cell/res_to_cell', res_input, self.ff_filter_size, self.cell_depth, self.ff_depth_separable)
+            if self.input_to_cell:
+                add('cell/input_to_cell', inputs, self.ff_filter_size, self.cell_depth, self.ff_depth_separable)
+            add('cell/tau', prev_cell, self.cell_tau_filter_size, self.cell_depth, self.tau_depth_separable,
+                batch_norm_constant_init=gamma_init)
+            add('cell/gate', prev_out, self.gate_filter_size, self.cell_depth, self.gate_depth_separable,
+                batch_norm_constant_init=gamma_init)
+            add('out/gate', prev_cell, self.gate_filter_size, self.out_depth, self.gate_depth_separable,
+                batch_norm_constant_init=None if self.cell_to_out else gamma_init)
+
+        if self.input_to_out:
+            # input_to_out keeps its own variable names, is never dropped out and does not clip its filter
+            add('out/input_to_out', inputs, self.in_out_filter_size, self.out_depth, self.in_out_depth_separable,
+                kernel_name='input_to_out_weights', bias_name='input_to_out_bias', clip=False,
+                dropout=False, data_format='channels_last')
+        add('out/tau', prev_out, self.tau_filter_size, self.out_depth, self.tau_depth_separable,
+            batch_norm_constant_init=gamma_init)
+        if res_input is not None and self.residual_to_out_gate:
+            add('out/residual_to_out_gate', res_input, self.gate_filter_size, self.out_depth, self.gate_depth_separable,
+                batch_norm_constant_init=gamma_init)
+
+        return specs
+
+    def _fused_temporal_ops(self, specs, time_sep=False, time_suffix=None):
+        """
+        Computes convs that share an input and a filter size as a single conv with concatenated
+        output channels followed by a split, like the four gates of ConvLSTMCell.
+
+        Every conv keeps its own kernel variable in its original scope, so checkpoints are the
+        same as without fusion. Returns a dict from spec name to the output of that conv,
+        for all convs that could be grouped with at least one other.
+        """
+        if time_sep:
+            assert time_suffix is not None
+
+        groups = []
+        for spec in specs:
+            shape = spec['inp'].shape.as_list()
+            ksize = list(spec['filter_size'])
+            if spec.get('clip', True): # as in _conv
+                ksize = [min(ksize[0], shape[1]), min(ksize[1], shape[2])]
+            spec['ksize'] = ksize
+            for group in groups:
+                if group[0]['inp'] is spec['inp'] and group[0]['ksize'] == ksize:
+                    group.append(spec)
+                    break
+            else:
+                groups.append([spec])
+
+        outputs = {}
+        for group in [g for g in groups if len(g) > 1]:
+            if group[0]['inp'] is self._invariant_input:
+                key = ('fused', group[0]['inp']) + tuple(spec['name'] for spec in group)
+                outs = hoisted(lambda: self._fused_group(group, time_suffix), key)
+            else:
+                outs = self._fused_group(group, time_suffix)
+            for spec, out in zip(group, outs):
+                outputs[spec['name']] = out
+
+        return outputs
+
+    def _fused_group(self, group, time_suffix=None):
+        """
+        The outputs of a group of convs of _fused_temporal_ops
+        """
+        inp = group[0]['inp']
+        in_depth = inp.shape.as_list()[-1]
+        kernels = []
+        for spec in group:
+            with self._spec_scope(spec):
+                kernels.append(tf.get_variable(spec.get('kernel_name', 'weights'),
+                                               spec['ksize'] + [in_depth, spec['out_depth']],
+                                               dtype=inp.dtype,
+                                               initializer=self._kernel_initializer,
+                                               regularizer=tf.contrib.layers.l2_regularizer(self._weight_decay)))
+                if spec.get('bias_name') is not None:
+                    # created but not added, exactly as in the unfused op
+                    tf.get_variable(spec['bias_name'], [spec['out_depth']], dtype=inp.dtype, initializer=self._bias_initializer)
+
+        kernel = tf.concat(kernels, axis=3)
+        out = tf.nn.conv2d(inp, kernel, strides=[1, 1, 1, 1], padding='SAME')
+        outs = tf.split(out, [spec['out_depth'] for spec in group], axis=3)
+
+        results = []
+        for spec, out in zip(group, outs):
+            if self._batch_norm:
+                with self._spec_scope(spec):
+                    out = self._batch_norm_func(inputs=out,
+                                                is_training=self._is_training,
+                                                data_format=spec.get('data_format', 'NHWC'),
+                                                decay=self._batch_norm_decay,
+                                                epsilon=self._batch_norm_epsilon,
+                                                constant_init=spec.get('batch_norm_constant_init'),
+                                                init_zero=False,
+                                                activation=None,
+                                                time_suffix=time_suffix)
+            if spec.get('dropout', True):
+                out = self._apply_recurrent_dropout(out, key=tf.get_variable_scope().name + '/' + spec['name'])
+            results.append(out)
+        return results
+
+    @contextlib.contextmanager
+    def _spec_scope(self, spec):
+        """
+        Re-enters the variable scope of a conv spec, relative to the cell scope
+        """
+        outer, inner = spec['name'].split('/')
+        with tf.variable_scope(outer):
+            if spec.get('kernel_name') is not None: # variables live directly in the outer scope
+                yield
+            else:
+                with tf.variable_scope(inner):
+                    yield
+
+    def _fused_or_apply(self, fused, name, *args, **kwargs):
+        """
+        Returns the output of a fused conv if there is one, otherwise applies the temporal op
+        """
+        if name in fused:
+            return fused[name]
+        if args[0] is self._invariant_input:
+            return hoisted(lambda: self._apply_temporal_op(*args, **kwargs), (name, args[0]))
+        return self._apply_temporal_op(*args, **kwargs)
+
+    def _input_to_out(self, inputs, dtype, time_sep=False, time_suffix=None):
+        """
+        The unfused input_to_out op
+        """
+        if self.in_out_depth_separable:
+            out_input = self._ds_conv(inputs, 
+                                 self.in_out_filter_size, 
+                                 out_depth=self.out_depth, 
+                                 use_bias=True, 
+                                 scope="input_to_out", 
+                                 kernel_initializer=self._kernel_initializer, 
+                                 bias_initializer=self._bias_initializer, 
+                                 weight_decay=self._weight_decay, 
+                                 repeat=self.ds_repeat,
+                                 is_training=self._is_training,
+                                 batch_norm=self._batch_norm,
+                                 batch_norm_decay=self._batch_norm_decay,
+                                 batch_norm_epsilon=self._batch_norm_epsilon,
+                                 time_sep=time_sep,
+                                 time_suffix=time_suffix)                        
+        else:
+            in_to_out_kernel = tf.get_variable("input_to_out_weights",
+                                               [self.in_out_filter_size[0], self.in_out_filter_size[1], self.out_depth, self.out_depth],
+                                               dtype=dtype,
+                                               initializer=self._kernel_initializer,
+                                               regularizer=tf.contrib.layers.l2_regularizer(self._weight_decay))
+
+
+            in_to_out_bias = tf.get_variable("input_to_out_bias", [self.out_depth], dtype=dtype, initializer=self._bias_initializer)
+
+            out_input = tf.nn.conv2d(inputs, in_to_out_kernel, strides=[1,1,1,1], padding='SAME', name="out_input")
+
+            if self._batch_norm:
+                out_input = self._batch_norm_func(inputs=out_input, 
+                                                   is_training=self._is_training, 
+                                                   data_format='channels_last', 
+                                                   decay = self._batch_norm_decay, 
+                                                   epsilon = self._batch_norm_epsilon, 
+                                                   init_zero=False, 
+                                                   constant_init=None, 
+                                                   activation=None,
+                                                   time_suffix=time_suffix)      
+        return out_input
+
     def __call__(self, inputs, state, fb_input, res_input, time_sep=False, time_suffix=None):
         """
         Produce outputs of RecipCell, given inputs and previous state {'cell':cell_state, 'out':out_state}
@@ -562,9 +811,13 @@ class ReciprocalGateCell(ConvRNNCell):
             
         dtype = inputs.dtype
 
-        if self.use_cell:
+        if self._state_is_tuple:
+            prev_cell = state.get('cell')
+            prev_out = state['out']
+        elif self.use_cell:
             prev_cell, prev_out = tf.split(value=state, num_or_size_splits=[self.cell_depth, self.out_depth], axis=3, name="state_split")
         else:
+            prev_cell = None
             prev_out = state
         
         with tf.variable_scope(type(self).__name__): # "ReciprocalGateCell"
@@ -584,34 +837,48 @@ class ReciprocalGateCell(ConvRNNCell):
                                                        time_suffix=time_suffix)
                     inputs += self._feedback_activation(fb_input)
 
+                self._invariant_input = None
+                if self._hoist_input and not time_sep and not (self.feedback_entry == 'input' and fb_input is not None):
+                    # the same pre-memory output as at an earlier step gives the same input projections
+                    raw_inputs = inputs
+                    inputs = hoisted(lambda: self._input_activation(raw_inputs, name="inputs"), ('inputs', raw_inputs))
+                    self._invariant_input = inputs
+                else:
+                    inputs = self._input_activation(inputs, name="inputs")
 
-                inputs = self._input_activation(inputs, name="inputs")
+            fused = {}
+            if self._fuse_convs:
+                fused = self._fused_temporal_ops(self._temporal_op_specs(inputs, prev_cell, prev_out, res_input),
+                                                 time_sep=time_sep,
+                                                 time_suffix=time_suffix)
 
             if self.use_cell:
                 with tf.variable_scope('cell'):
 
                     # if cell depth and out depth are different, need to change channel number of input
-                    cell_input = tf.zeros_like(prev_cell, dtype=tf.float32, name="cell_input")
+                    cell_inputs = []
                     assert (self.cell_residual or self.input_to_cell)
                     if self.cell_residual:
                         assert res_input is not None
                     if res_input is not None and self.cell_residual:
-                        cell_input += self._apply_temporal_op(res_input, 
-                                                              self.ff_filter_size, 
-                                                              self.cell_depth, 
-                                                              separable=self.ff_depth_separable, 
-                                                              scope="res_to_cell",
-                                                              time_sep=time_sep,
-                                                              time_suffix=time_suffix)
+                        cell_inputs.append(self._fused_or_apply(fused, 'cell/res_to_cell',
+                                                                res_input, 
+                                                                self.ff_filter_size, 
+                                                                self.cell_depth, 
+                                                                separable=self.ff_depth_separable, 
+                                                                scope="res_to_cell",
+                                                                time_sep=time_sep,
+                                                                time_suffix=time_suffix))
 
                     if self.input_to_cell:
-                        cell_input += self._apply_temporal_op(inputs, 
-                                                              self.ff_filter_size, 
-                                                              self.cell_depth, 
-                                                              separable=self.ff_depth_separable, 
-                                                              scope="input_to_cell",
-                                                              time_sep=time_sep,
-                                                              time_suffix=time_suffix)                        
+                        cell_inputs.append(self._fused_or_apply(fused, 'cell/input_to_cell',
+                                                                inputs, 
+                                                                self.ff_filter_size, 
+                                                                self.cell_depth, 
+                                                                separable=self.ff_depth_separable, 
+                                                                scope="input_to_cell",
+                                                                time_sep=time_sep,
+                                                                time_suffix=time_suffix))
 
                     if fb_input is not None and self.feedback_entry == 'cell':
                         fb_input += self._apply_temporal_op(fb_input, 
@@ -622,28 +889,35 @@ class ReciprocalGateCell(ConvRNNCell):
                                                             batch_norm_init_zero=self._edges_init_zero,
                                                             time_sep=time_sep,
                                                             time_suffix=time_suffix)
-                        cell_input += self._feedback_activation(fb_input)
+                        cell_inputs.append(self._feedback_activation(fb_input))
+
+                    if len(cell_inputs) > 0:
+                        cell_input = tf.add_n(cell_inputs, name="cell_input")
+                    else:
+                        cell_input = tf.zeros_like(prev_cell, dtype=tf.float32, name="cell_input")
 
                     # ops
                     # cell tau
-                    cell_tau = self._apply_temporal_op(prev_cell, 
-                                                       self.cell_tau_filter_size, 
-                                                       self.cell_depth, 
-                                                       separable=self.tau_depth_separable, 
-                                                       scope="tau",
-                                                       batch_norm_constant_init=self._gate_tau_bn_gamma_init,
-                                                       time_sep=time_sep,
-                                                       time_suffix=time_suffix)
+                    cell_tau = self._fused_or_apply(fused, 'cell/tau',
+                                                    prev_cell, 
+                                                    self.cell_tau_filter_size, 
+                                                    self.cell_depth, 
+                                                    separable=self.tau_depth_separable, 
+                                                    scope="tau",
+                                                    batch_norm_constant_init=self._gate_tau_bn_gamma_init,
+                                                    time_sep=time_sep,
+                                                    time_suffix=time_suffix)
 
                     # cell gate
-                    cell_gate = self._apply_temporal_op(prev_out, 
-                                                        self.gate_filter_size, 
-                                                        self.cell_depth, 
-                                                        separable=self.gate_depth_separable, 
-                                                        scope="gate",
-                                                        batch_norm_constant_init=self._gate_tau_bn_gamma_init,
-                                                        time_sep=time_sep,
-                                                        time_suffix=time_suffix)                   
+                    cell_gate = self._fused_or_apply(fused, 'cell/gate',
+                                                     prev_out, 
+                                                     self.gate_filter_size, 
+                                                     self.cell_depth, 
+                                                     separable=self.gate_depth_separable, 
+                                                     scope="gate",
+                                                     batch_norm_constant_init=self._gate_tau_bn_gamma_init,
+                                                     time_sep=time_sep,
+                                                     time_suffix=time_suffix)                   
                     cell_tau = self._tau_nonlinearity(cell_tau)
                     cell_gate = self._gate_nonlinearity(cell_gate)
 
@@ -668,55 +942,25 @@ class ReciprocalGateCell(ConvRNNCell):
 
                 if self.input_to_out:
                     # never apply dropout here
-                    if self.in_out_depth_separable:
-                        out_input = self._ds_conv(inputs, 
-                                             self.in_out_filter_size, 
-                                             out_depth=self.out_depth, 
-                                             use_bias=True, 
-                                             scope="input_to_out", 
-                                             kernel_initializer=self._kernel_initializer, 
-                                             bias_initializer=self._bias_initializer, 
-                                             weight_decay=self._weight_decay, 
-                                             repeat=self.ds_repeat,
-                                             is_training=self._is_training,
-                                             batch_norm=self._batch_norm,
-                                             batch_norm_decay=self._batch_norm_decay,
-                                             batch_norm_epsilon=self._batch_norm_epsilon,
-                                             time_sep=time_sep,
-                                             time_suffix=time_suffix)                        
+                    if 'out/input_to_out' in fused:
+                        out_input = tf.identity(fused['out/input_to_out'], name="out_input")
+                    elif inputs is self._invariant_input:
+                        out_input = hoisted(lambda: self._input_to_out(inputs, dtype, time_sep, time_suffix),
+                                            ('out/input_to_out', inputs))
                     else:
-                        in_to_out_kernel = tf.get_variable("input_to_out_weights",
-                                                           [self.in_out_filter_size[0], self.in_out_filter_size[1], self.out_depth, self.out_depth],
-                                                           dtype=dtype,
-                                                           initializer=self._kernel_initializer,
-                                                           regularizer=tf.contrib.layers.l2_regularizer(self._weight_decay))
-
-
-                        in_to_out_bias = tf.get_variable("input_to_out_bias", [self.out_depth], dtype=dtype, initializer=self._bias_initializer)
-
-                        out_input = tf.nn.conv2d(inputs, in_to_out_kernel, strides=[1,1,1,1], padding='SAME', name="out_input")
-
-                        if self._batch_norm:
-                            out_input = self._batch_norm_func(inputs=out_input, 
-                                                               is_training=self._is_training, 
-                                                               data_format='channels_last', 
-                                                               decay = self._batch_norm_decay, 
-                                                               epsilon = self._batch_norm_epsilon, 
-                                                               init_zero=False, 
-                                                               constant_init=None, 
-                                                               activation=None,
-                                                               time_suffix=time_suffix)      
+                        out_input = self._input_to_out(inputs, dtype, time_sep, time_suffix)
                 else:
                     out_input = tf.identity(inputs, name="out_input")
 
                 if self.cell_to_out and self.use_cell:
-                    out_input += self._apply_temporal_op(prev_cell, 
-                                                         self.gate_filter_size, 
-                                                         self.out_depth, 
-                                                         separable=self.gate_depth_separable, 
-                                                         scope="gate",
-                                                         time_sep=time_sep,
-                                                         time_suffix=time_suffix)
+                    out_input += self._fused_or_apply(fused, 'out/gate',
+                                                      prev_cell, 
+                                                      self.gate_filter_size, 
+                                                      self.out_depth, 
+                                                      separable=self.gate_depth_separable, 
+                                                      scope="gate",
+                                                      time_sep=time_sep,
+                                                      time_suffix=time_suffix)
 
                 if res_input is not None and self.out_residual:
                     with tf.variable_scope('res_add'):
@@ -755,37 +999,43 @@ class ReciprocalGateCell(ConvRNNCell):
 
                     
                 # ops
-                out_tau = self._apply_temporal_op(prev_out, 
-                                                  self.tau_filter_size, 
-                                                  self.out_depth, 
-                                                  separable=self.tau_depth_separable, 
-                                                  scope="tau",
-                                                  batch_norm_constant_init=self._gate_tau_bn_gamma_init,
-                                                  time_sep=time_sep,
-                                                  time_suffix=time_suffix)
-
+                out_tau = self._fused_or_apply(fused, 'out/tau',
+                                               prev_out, 
+                                               self.tau_filter_size, 
+                                               self.out_depth, 
+                                               separable=self.tau_depth_separable, 
+                                               scope="tau",
+                                               batch_norm_constant_init=self._gate_tau_bn_gamma_init,
+                                               time_sep=time_sep,
+                                               time_suffix=time_suffix)
+
+                out_gates = []
                 if self.use_cell and not self.cell_to_out:
-                    out_gate = self._apply_temporal_op(prev_cell, 
-                                                       self.gate_filter_size, 
-                                                       self.out_depth, 
-                                                       separable=self.gate_depth_separable, 
-                                                       scope="gate",
-                                                       batch_norm_constant_init=self._gate_tau_bn_gamma_init,
-                                                       time_sep=time_sep,
-                                                       time_suffix=time_suffix)
-                else:
-                    out_gate = tf.zeros(shape=out_input.shape.as_list(), dtype=tf.float32, name='out_gate')
-
+                    out_gates.append(self._fused_or_apply(fused, 'out/gate',
+                                                          prev_cell, 
+                                                          self.gate_filter_size, 
+                                                          self.out_depth, 
+                                                          separable=self.gate_depth_separable, 
+                                                          scope="gate",
+                                                          batch_norm_constant_init=self._gate_tau_bn_gamma_init,
+                                                          time_sep=time_sep,
+                                                          time_suffix=time_suffix))
 
                 if res_input is not None and self.residual_to_out_gate:
-                    out_gate += self._apply_temporal_op(res_input, 
-                                                        self.gate_filter_size, 
-                                                        self.out_depth, 
-                                                        separable=self.gate_depth_separable, 
-                                                        scope="residual_to_out_gate",
-                                                        batch_norm_constant_init=self._gate_tau_bn_gamma_init,
-                                                        time_sep=time_sep,
-                                                        time_suffix=time_suffix)
+                    out_gates.append(self._fused_or_apply(fused, 'out/residual_to_out_gate',
+                                                          res_input, 
+                                                          self.gate_filter_size, 
+                                                          self.out_depth, 
+                                                          separable=self.gate_depth_separable, 
+                                                          scope="residual_to_out_gate",
+                                                          batch_norm_constant_init=self._gate_tau_bn_gamma_init,
+                                                          time_sep=time_sep,
+                                                          time_suffix=time_suffix))
+
+                if len(out_gates) > 0:
+                    out_gate = tf.add_n(out_gates, name='out_gate')
+                else:
+                    out_gate = tf.zeros(shape=out_input.shape.as_list(), dtype=tf.float32, name='out_gate')
 
                 out_tau = self._tau_nonlinearity(out_tau)
                 out_gate = self._gate_nonlinearity(out_gate)
@@ -807,7 +1057,11 @@ class ReciprocalGateCell(ConvRNNCell):
 
                 next_out = self._out_activation(next_out)
 
-                if self.use_cell:
+                if self._state_is_tuple:
+                    next_state = {'out':next_out}
+                    if self.use_cell:
+                        next_state['cell'] = next_cell
+                elif self.use_cell:
                     next_state = tf.concat(axis=3, values=[next_cell, next_out])
                 else:
                     next_state = next_out
@@ -827,13 +1081,17 @@ class tnn_ReciprocalGateCell(ConvRNNCell):
                  input_init=(tf.zeros, None),
                  state_init=(tf.zeros, None),
                  dtype=tf.float32,
-                 name=None):
+                 name=None,
+                 hoist=False):
     
         self.harbor_shape = harbor_shape
         self.harbor = harbor if harbor[1] is not None else (harbor[0], {})
         self.pre_memory = pre_memory
         self.memory = memory if memory[1] is not None else (memory[0], {})
         self.post_memory = post_memory
+        # how each pre- and post-memory op is called, resolved once rather than at every step
+        self._pre_memory_ops = compile_ops(pre_memory)
+        self._post_memory_ops = compile_ops(post_memory)
 
         self.input_init = input_init if input_init[1] is not None else (input_init[0], {})
         self.state_init = state_init if state_init[1] is not None else (state_init[0], {})
@@ -845,6 +1103,9 @@ class tnn_ReciprocalGateCell(ConvRNNCell):
 
         self.internal_time = 0
 
+        # computation on the same inputs as at an earlier step is reused, see tnn.main.set_hoist
+        self.hoist = hoist
+
         # signature: ReciprocalGateCell(shape, ff_filter_size, cell_filter_size, cell_depth, out_depth, **kwargs)
         self._strides = self.pre_memory[0][1].get('strides', [1,1,1,1])[1:3]
         self.memory[1]['shape'] = self.memory[1].get('shape', [self.harbor_shape[1] // self._strides[0], self.harbor_shape[2] // self._strides[1]])
@@ -856,9 +1117,87 @@ class tnn_ReciprocalGateCell(ConvRNNCell):
 
         mem_kwargs = copy.deepcopy(self.memory[1])
         mem_kwargs.pop('time_sep', None)
+        # "state_is_tuple": true in the memory kwargs keeps {'cell', 'out'} as a dict across time
+        mem_kwargs.setdefault('hoist_input', hoist and not self.memory[1].get('time_sep', False))
         self.conv_cell = ReciprocalGateCell(**mem_kwargs)
 
 
+    def _ff_index(self, inputs):
+        """
+        Index of the feedforward input, i.e. the input_name of the pre-memory conv. Uses the
+        input names recorded by init_nodes, falling back to matching tensor names.
+        """
+        ff_name = self.pre_memory[self._pre_conv_idx][1]['input_name']
+        input_names = getattr(self, 'input_names', None)
+        if input_names is not None and len(input_names) == len(inputs) and ff_name in input_names:
+            return input_names.index(ff_name)
+
+        ff_idx = None
+        for j, inp in enumerate(inputs):
+            if ff_name in inp.name:
+                ff_idx = j
+        return ff_idx
+
+    def _harbor_pre_memory(self, inputs, time_suffix, ff_inpnm=None):
+        """
+        Returns the pre-memory output, the combined feedback input and the residual input.
+        ff_inpnm names the feedforward input of a single input split off from the others
+        """
+        # separate feedback from feedforward input
+        fb_input = None
+        if len(inputs) == 1:
+            ff_idx = 0
+            output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, ff_inpnm=ff_inpnm, reuse=self._reuse, **self.harbor[1])
+        elif len(inputs) > 1:
+            ff_idx = self._ff_index(inputs)
+            if self._split_harbor():
+                # aggregate feedforward and feedback inputs separately instead of concat and split
+                output, fb_input = harbor_split(inputs, ff_idx, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
+            else:
+                ff_inpnm = inputs[ff_idx].name
+                ff_depth = inputs[ff_idx].shape.as_list()[-1]
+                output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, ff_inpnm=ff_inpnm, reuse=self._reuse, **self.harbor[1])
+                fb_depth = output.shape.as_list()[-1] - ff_depth
+                if self.harbor[1]['channel_op'] == 'concat':
+                    output, fb_input = tf.split(output, num_or_size_splits=[ff_depth, fb_depth], axis=3)
+
+        # component_conv only sees the feedforward input
+        output, res_input = apply_ops(self._pre_memory_ops, output, [inputs[ff_idx]], 'pre_', self._reuse,
+                                      time_suffix=time_suffix)
+        return output, fb_input, res_input
+
+    def _split_harbor(self):
+        return self.harbor[0] is harbor and self.harbor[1]['channel_op'] == 'concat' and self.harbor[1].get('preproc') is None
+
+    def _hoistable_ff_index(self, inputs):
+        """
+        Index of the feedforward input if the harbor and pre-memory output only depend on it
+        and can be hoisted, otherwise None
+        """
+        if not self.hoist or any(op[3] for op in self._pre_memory_ops):
+            return None
+        if len(inputs) == 1:
+            return 0
+        if self._split_harbor():
+            return self._ff_index(inputs)
+        return None
+
+    def _hoisted_harbor_pre_memory(self, inputs, ff_idx, time_suffix):
+        """
+        _harbor_pre_memory with the feedforward input going through the harbor and the
+        pre-memory ops on its own, which is reused while the feedforward input stays the same,
+        and the other inputs combined at every step
+        """
+        ff_inp = inputs[ff_idx]
+        output, _, res_input = hoisted(lambda: self._harbor_pre_memory([ff_inp], time_suffix, ff_inpnm=ff_inp.name),
+                                       ('pre_memory', ff_inp))
+        other_inputs = [inp for j, inp in enumerate(inputs) if j != ff_idx]
+        fb_input = None
+        if len(other_inputs) > 0:
+            fb_input = self.harbor[0](other_inputs, self.harbor_shape, self.name_tmp, ff_inpnm=ff_inp.name,
+                                      reuse=self._reuse, **self.harbor[1])
+        return output, fb_input, res_input
+
     def __call__(self, inputs=None, state=None):
         """
         Produce outputs given inputs
@@ -876,63 +1215,29 @@ class tnn_ReciprocalGateCell(ConvRNNCell):
             if inputs is None:
                 inputs = [self.input_init[0](shape=self.harbor_shape, **self.input_init[1])]
 
-            # separate feedback from feedforward input
-            fb_input = None
-            if len(inputs) == 1:
-                ff_idx = 0
-                output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, reuse=self._reuse, **self.harbor[1])
-            elif len(inputs) > 1:
-                for j, inp in enumerate(inputs):
-                    if self.pre_memory[self._pre_conv_idx][1]['input_name'] in inp.name:
-                        ff_inpnm = inp.name
-                        ff_idx = j
-                        ff_depth = inputs[ff_idx].shape.as_list()[-1]
-                output = self.harbor[0](inputs, self.harbor_shape, self.name_tmp, ff_inpnm=ff_inpnm, reuse=self._reuse, **self.harbor[1])
-                fb_depth = output.shape.as_list()[-1] - ff_depth
-                if self.harbor[1]['channel_op'] == 'concat':
-                    output, fb_input = tf.split(output, num_or_size_splits=[ff_depth, fb_depth], axis=3)
-
-            res_input = None
             curr_time_suffix = 't' + str(self.internal_time)
-            pre_name_counter = 0
-            for function, kwargs in self.pre_memory:
-                with tf.variable_scope("pre_" + str(pre_name_counter), reuse=self._reuse):
-                    if kwargs.get('time_sep', False):
-                        kwargs['time_suffix'] = curr_time_suffix # used for scoping in the op
-
-                    if function.__name__ == "component_conv":
-                        if kwargs.get('return_input', False):
-                            output, res_input = function(output, [inputs[ff_idx]], **kwargs) # component_conv needs to know the inputs
-                        else:
-                            output = function(output, [inputs[ff_idx]], **kwargs) # component_conv needs to know the inputs
-                            
-                    else:
-                        output = function(output, **kwargs)
-                pre_name_counter += 1
+            ff_idx = self._hoistable_ff_index(inputs)
+            if ff_idx is not None:
+                output, fb_input, res_input = self._hoisted_harbor_pre_memory(inputs, ff_idx, curr_time_suffix)
+            else:
+                output, fb_input, res_input = self._harbor_pre_memory(inputs, curr_time_suffix)
 
             if state is None:
                 batch_size = output.get_shape().as_list()[0]
                 state = self.conv_cell.zero_state(batch_size, dtype=self.dtype_tmp)
+                # a new sequence starts, so sample new variational dropout masks
+                self.conv_cell.reset_dropout_masks()
 
             if self.memory[1].get('time_sep', False):
                 output, state = self.conv_cell(output, state, fb_input, res_input, time_sep=True, time_suffix=curr_time_suffix)
             else:
                 output, state = self.conv_cell(output, state, fb_input, res_input, time_sep=False, time_suffix=None)
 
-            self.state = tf.identity(state, name="state")
+            self.state = identity_state(state)
 
-            post_name_counter = 0
-            for function, kwargs in self.post_memory:
-                with tf.variable_scope("post_" + str(post_name_counter), reuse=self._reuse):
-                    if kwargs.get('time_sep', False):
-                        kwargs['time_suffix'] = curr_time_suffix # used for scoping in the op
+            output, _ = apply_ops(self._post_memory_ops, output, inputs, 'post_', self._reuse,
+                                  time_suffix=curr_time_suffix)
 
-                    if function.__name__ == "component_conv":
-                       output = function(output, inputs, **kwargs)
-                    else:
-                       output = function(output, **kwargs)
-                post_name_counter += 1
-                
             self.output_tmp = tf.identity(tf.cast(output, self.dtype_tmp), name='output')
 
             # Now reuse variables across time
@@ -0,0 +1,260 @@
+"""
+Records the outputs of an unrolled TNN for every selected (node, timestep) over a dataset
+
+Batches are run in the calling thread while a background thread writes the previous
+results into preallocated on-disk arrays (.npy memory maps or an HDF5 file), so compute
+and I/O overlap and the activations never have to fit in memory. Progress is stored
+next to the arrays so that an interrupted recording resumes where it stopped.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from tnn.feature_cache import feature_name
+
+PROGRESS = 'progress.json'
+HDF5_FILE = 'activations.h5'
+
+
+def get_selection(G, selection=None):
+    """
+    (node, t) pairs from a selection of nodes and timesteps.
+
+    selection can be None (all nodes at all timesteps), or a list of node names (all
+    timesteps of that node) and (node, t) pairs.
+    """
+    if selection is None:
+        selection = sorted(G.nodes())
+    pairs = []
+    for item in selection:
+        if isinstance(item, (tuple, list)):
+            pairs.append(tuple(item))
+        else:
+            pairs.extend((item, t) for t in range(len(G.node[item]['outputs'])))
+    return pairs
+
+
+def downsample(output, pool=None, pool_size=2):
+    """
+    Reduces the spatial size of a rank 4 output before it is recorded.
+
+    pool can be None, 'avg' or 'max' (pool_size x pool_size windows with the same stride)
+    or 'global' (mean over space). Outputs of other ranks are returned unchanged.
+    """
+    if pool is None or len(output.shape) != 4:
+        return output
+    if pool == 'global':
+        return tf.reduce_mean(output, axis=[1, 2])
+    elif pool == 'avg':
+        pool_func = tf.nn.avg_pool
+    elif pool == 'max':
+        pool_func = tf.nn.max_pool
+    else:
+        raise ValueError('Unknown pool: {}'.format(pool))
+    return pool_func(output, ksize=[1, pool_size, pool_size, 1],
+                     strides=[1, pool_size, pool_size, 1], padding='SAME')
+
+
+class _Writer(threading.Thread):
+    """
+    Writes (start, outputs) items from a queue into the on-disk arrays and records progress
+    """
+
+    def __init__(self, path, fmt, n_samples, dtype, chunk_size, n_done):
+        super(_Writer, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.fmt = fmt
+        self.n_samples = n_samples
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.n_done = n_done
+        self.queue = queue.Queue(maxsize=2)
+        self.error = None
+        self.arrays = {}
+        self.h5 = None
+        if fmt == 'hdf5':
+            self.h5 = h5py.File(os.path.join(path, HDF5_FILE), 'a')
+
+    def _array(self, name, out):
+        if name not in self.arrays:
+            shape = (self.n_samples,) + out.shape[1:]
+            if self.fmt == 'hdf5':
+                if name in self.h5:
+                    self.arrays[name] = self.h5[name]
+                else:
+                    chunks = (min(self.chunk_size, self.n_samples),) + out.shape[1:]
+                    self.arrays[name] = self.h5.create_dataset(name, shape=shape, dtype=self.dtype, chunks=chunks)
+            else:
+                fname = os.path.join(self.path, name + '.npy')
+                mode = 'r+' if self.n_done > 0 and os.path.exists(fname) else 'w+'
+                self.arrays[name] = np.lib.format.open_memmap(fname, mode=mode, dtype=self.dtype, shape=shape)
+        return self.arrays[name]
+
+    def _save_progress(self):
+        for arr in self.arrays.values():
+            arr.flush()
+        if self.h5 is not None:
+            self.h5.flush()
+        tmp = os.path.join(self.path, PROGRESS + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'n_samples': self.n_samples, 'n_done': self.n_done,
+                       'names': sorted(self.arrays.keys())}, f)
+        os.rename(tmp, os.path.join(self.path, PROGRESS))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue # drain the queue so that the producer is not blocked
+            start, outputs = item
+            try:
+                for name, out in outputs.items():
+                    self._array(name, out)[start:start + out.shape[0]] = out
+                self.n_done = start + out.shape[0]
+                self._save_progress()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.h5 is not None:
+            self.h5.close()
+        self.arrays = {}
+        if self.error is not None:
+            raise self.error
+
+
+def record(sess, G, batches, n_samples, batch_size, path, selection=None, fmt='npy',
+           pool=None, pool_size=2, dtype='float32', chunk_size=256, resume=True):
+    """
+    Runs batches through the unrolled graph G and streams the selected outputs to disk.
+
+    :Args:
+        - sess
+            Session in which the model variables are initialized or restored
+        - G
+            NetworkX DiGraph that has been unrolled with `tnn.main.unroll` or `tnn.main.unroll_tf`
+        - batches
+            Iterable of feed_dicts of batch_size samples each (the last one may be smaller)
+        - n_samples (int)
+            Number of samples in the dataset
+        - batch_size (int)
+            Number of samples per batch, used to skip the batches already recorded on resume
+        - path (str)
+            Directory in which the activations and the progress are stored
+    :Kwargs:
+        - selection (list or None, default: None)
+            Nodes and (node, t) pairs to record, see get_selection. Defaults to all nodes at all timesteps
+        - fmt ('npy' or 'hdf5', default: 'npy')
+            One memory-mapped .npy file per (node, t), or datasets named '<node>_t<t>' in one HDF5 file
+        - pool (None, 'avg', 'max' or 'global', default: None) and pool_size (int, default: 2)
+            Spatial downsampling of rank 4 outputs before they are recorded, see downsample
+        - dtype (str, default: 'float32')
+            Storage dtype
+        - chunk_size (int, default: 256)
+            Number of samples per HDF5 chunk
+        - resume (bool, default: True)
+            Continue an interrupted recording in path instead of starting over
+    :Returns:
+        A Recording of the recorded arrays keyed by '<node>_t<t>', see load
+    """
+    if fmt == 'hdf5' and h5py is None:
+        raise ImportError('Recording to HDF5 requires h5py')
+    elif fmt not in ('npy', 'hdf5'):
+        raise ValueError('Unknown format: {}'.format(fmt))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    n_done = 0
+    recorded_names = None
+    progress = os.path.join(path, PROGRESS)
+    if resume and os.path.exists(progress):
+        with open(progress) as f:
+            state = json.load(f)
+        n_done, recorded_names = state['n_done'], state['names']
+    elif os.path.exists(progress):
+        os.remove(progress)
+    if n_done == 0 and os.path.exists(os.path.join(path, HDF5_FILE)):
+        os.remove(os.path.join(path, HDF5_FILE))
+    if n_done % batch_size != 0 and n_done != n_samples:
+        raise ValueError('Recorded {} samples, which is not a whole number of batches of {}'.format(n_done, batch_size))
+
+    with tf.name_scope('recorder'):
+        tensors = dict((feature_name(node, t), downsample(G.node[node]['outputs'][t], pool, pool_size))
+                       for node, t in get_selection(G, selection))
+    if recorded_names is not None and sorted(tensors.keys()) != recorded_names:
+        raise ValueError('Cannot resume the recording in {} with a different selection'.format(path))
+
+    writer = _Writer(path, fmt, n_samples, dtype, chunk_size, n_done)
+    writer.start()
+    try:
+        start = 0
+        for feed_dict in batches:
+            if start >= n_done:
+                outputs = sess.run(tensors, feed_dict=feed_dict)
+                writer.queue.put((start, outputs))
+                start += list(outputs.values())[0].shape[0]
+                if writer.error is not None:
+                    break
+            else:
+                start += batch_size
+            if start >= n_samples:
+                break
+    finally:
+        writer.close()
+    return load(path)
+
+
+class Recording(dict):
+    """
+    Recorded arrays keyed by '<node>_t<t>' (see load). For the HDF5 format it holds the open
+    file, which close or the end of a with block closes
+    """
+
+    def __init__(self, arrays, h5_file=None):
+        super(Recording, self).__init__(arrays)
+        self.h5_file = h5_file
+
+    def close(self):
+        if self.h5_file is not None:
+            self.h5_file.close()
+            self.h5_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path):
+    """
+    A Recording of the arrays recorded in path keyed by '<node>_t<t>': read-only memory maps
+    for the .npy format, or h5py datasets of a read-only file for the HDF5 format
+    """
+    with open(os.path.join(path, PROGRESS)) as f:
+        names = json.load(f)['names']
+    if os.path.exists(os.path.join(path, HDF5_FILE)):
+        h5 = h5py.File(os.path.join(path, HDF5_FILE), 'r')
+        return Recording(dict((name, h5[name]) for name in names), h5_file=h5)
+    return Recording(dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r')) for name in names))
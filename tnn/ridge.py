@@ -0,0 +1,149 @@
+"""
+Closed-form ridge regression readouts from TNN features
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+
+
+class RidgeSolver(object):
+    """
+    Ridge regression from features of shape [batch, ...] to targets of shape [batch, n_targets].
+
+    The sufficient statistics (X^T X, X^T y and the means) are accumulated batch by batch, so
+    the features never have to fit in memory at once. The eigendecomposition of X^T X is
+    computed once and reused for every regularization strength, so that sweeping alpha costs
+    a few matrix products per value.
+
+    Features are flattened in C order, so for [batch, H, W, D] features the weights can be
+    loaded into a spatial_fc kernel of shape [H, W, D, n_targets] (see spatial_fc_variables).
+    """
+
+    def __init__(self, fit_intercept=True, dtype=np.float64):
+        self.fit_intercept = fit_intercept
+        self.dtype = dtype
+        self.feature_shape = None
+        self.n_samples = 0
+        self._xtx = None
+        self._xty = None
+        self._x_sum = None
+        self._y_sum = None
+        self._decomposition = None
+
+    def partial_fit(self, X, y):
+        """
+        Adds a batch of features X and targets y to the statistics
+        """
+        X = np.asarray(X)
+        y = np.asarray(y)
+        if self.feature_shape is None:
+            self.feature_shape = X.shape[1:]
+        elif X.shape[1:] != self.feature_shape:
+            raise ValueError('Feature shape {} does not match {}'.format(X.shape[1:], self.feature_shape))
+        X = X.reshape([X.shape[0], -1]).astype(self.dtype)
+        y = y.reshape([y.shape[0], -1]).astype(self.dtype)
+        if X.shape[0] != y.shape[0]:
+            raise ValueError('Got {} feature and {} target samples'.format(X.shape[0], y.shape[0]))
+
+        if self._xtx is None:
+            self._xtx = np.zeros([X.shape[1], X.shape[1]], dtype=self.dtype)
+            self._xty = np.zeros([X.shape[1], y.shape[1]], dtype=self.dtype)
+            self._x_sum = np.zeros(X.shape[1], dtype=self.dtype)
+            self._y_sum = np.zeros(y.shape[1], dtype=self.dtype)
+        self._xtx += X.T.dot(X)
+        self._xty += X.T.dot(y)
+        self._x_sum += X.sum(axis=0)
+        self._y_sum += y.sum(axis=0)
+        self.n_samples += X.shape[0]
+        self._decomposition = None
+        return self
+
+    def fit(self, batches):
+        """
+        Accumulates the statistics of an iterable of (X, y) batches
+        """
+        for X, y in batches:
+            self.partial_fit(X, y)
+        return self
+
+    def _means(self):
+        if self.fit_intercept:
+            return self._x_sum / self.n_samples, self._y_sum / self.n_samples
+        return np.zeros_like(self._x_sum), np.zeros_like(self._y_sum)
+
+    def _decompose(self):
+        """
+        Eigendecomposition of the (centered) X^T X and the projection of X^T y onto its
+        eigenvectors, cached until more data is added
+        """
+        if self.n_samples == 0:
+            raise ValueError('No data has been added to the solver')
+        if self._decomposition is None:
+            x_mean, y_mean = self._means()
+            xtx = self._xtx - self.n_samples * np.outer(x_mean, x_mean)
+            xty = self._xty - self.n_samples * np.outer(x_mean, y_mean)
+            eigvals, eigvecs = np.linalg.eigh(xtx)
+            eigvals = np.maximum(eigvals, 0) # clip rounding errors of a PSD matrix
+            self._decomposition = (eigvals, eigvecs, eigvecs.T.dot(xty))
+        return self._decomposition
+
+    def solve(self, alpha):
+        """
+        Returns the weights of shape [n_features, n_targets] and the bias of shape [n_targets]
+        for regularization strength alpha
+        """
+        eigvals, eigvecs, proj = self._decompose()
+        weights = eigvecs.dot(proj / (eigvals + alpha)[:, None])
+        x_mean, y_mean = self._means()
+        bias = y_mean - x_mean.dot(weights)
+        return weights, bias
+
+    def sweep(self, alphas, batches):
+        """
+        Mean squared error on the validation (X, y) batches of each regularization strength
+        in alphas. The validation features are projected onto the cached eigenvectors once.
+
+        Returns (errors, best_alpha) where errors has shape [len(alphas), n_targets]
+        """
+        eigvals, eigvecs, proj = self._decompose()
+        x_mean, y_mean = self._means()
+        alphas = np.asarray(alphas, dtype=self.dtype)
+        errors = np.zeros([len(alphas), proj.shape[1]], dtype=self.dtype)
+        n_samples = 0
+        for X, y in batches:
+            X = np.asarray(X).reshape([X.shape[0], -1]).astype(self.dtype)
+            y = np.asarray(y).reshape([y.shape[0], -1]).astype(self.dtype)
+            X_proj = (X - x_mean).dot(eigvecs)
+            for i, alpha in enumerate(alphas):
+                pred = X_proj.dot(proj / (eigvals + alpha)[:, None]) + y_mean
+                errors[i] += np.square(pred - y).sum(axis=0)
+            n_samples += X.shape[0]
+        errors /= n_samples
+        best_alpha = alphas[np.argmin(errors.mean(axis=1))]
+        return errors, best_alpha
+
+
+def spatial_fc_variables(weights, bias, feature_shape):
+    """
+    Reshapes ridge weights of shape [H*W*D, n_targets] to a spatial_fc kernel of shape
+    [H, W, D, n_targets] (rank 2 features of shape [D] give a [1, 1, D, n_targets] kernel)
+    """
+    feature_shape = list(feature_shape)
+    if len(feature_shape) == 1:
+        feature_shape = [1, 1] + feature_shape
+    kernel = weights.reshape(feature_shape + [weights.shape[-1]])
+    return kernel.astype(np.float32), bias.astype(np.float32)
+
+
+def assign_spatial_fc(weights, bias, feature_shape, scope=None):
+    """
+    Returns an op that loads ridge weights into the 'weights' and 'bias' variables of the
+    spatial_fc readout in variable scope scope
+    """
+    kernel, bias = spatial_fc_variables(weights, bias, feature_shape)
+    with tf.variable_scope(scope or tf.get_variable_scope(), reuse=True):
+        kernel_var = tf.get_variable('weights')
+        bias_var = tf.get_variable('bias')
+    return tf.group(tf.assign(kernel_var, kernel), tf.assign(bias_var, bias))
@@ -0,0 +1,265 @@
+"""
+Local inference server for TNN readouts with dynamic micro-batching
+
+Concurrent requests are coalesced into batches of up to max_batch_size, waiting at most
+max_latency seconds for a batch to fill, and run through a `tnn.step.Step`. Streaming
+clients name a stream: its outputs and states are kept between requests and swapped
+into the batch, so that every request advances its stream by steps_per_request steps.
+
+The server speaks minimal HTTP over TCP or a Unix socket:
+    POST /predict  {"input": [...], "stream": "id" (optional), "reset": false}
+                   -> {"outputs": {node: [...]}, "latency": seconds}
+    GET /metrics   -> {"queue_depth", "p50_latency", "p99_latency", "n_requests", "mean_batch_size"}
+
+Requires Python 3 (asyncio and async/await syntax), unlike the rest of tnn, so this module
+cannot be imported on Python 2.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import time
+import asyncio
+import collections
+
+import numpy as np
+
+from tnn.step import Step
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class InferenceServer(object):
+    """
+    Micro-batching server of a Step in a session.
+
+    :Args:
+        - sess
+            Session in which the model variables are initialized or restored
+        - step
+            A `tnn.step.Step` with a single input node of fixed batch size
+        - outputs (list)
+            Nodes whose outputs are returned
+    :Kwargs:
+        - steps_per_request (int, default: 1)
+            Steps run per request, all with the request's input (e.g. ntimes for
+            static images, 1 for streaming one frame per request)
+        - max_batch_size (int or None, default: None)
+            Largest batch, at most (and by default) the batch size of the step
+        - max_latency (float, default: .005)
+            Seconds the first request of a batch waits for more requests
+        - max_streams (int, default: 10000)
+            Number of stream states kept; the least recently used streams are dropped
+    """
+
+    def __init__(self, sess, step, outputs, steps_per_request=1, max_batch_size=None,
+                 max_latency=.005, max_streams=10000, n_latencies=10000):
+        if len(step.inputs) != 1:
+            raise ValueError('The server supports steps with a single input node')
+        self.sess = sess
+        self.step = step
+        self.input_node, self.input = list(step.inputs.items())[0]
+        self.batch_size = self.input.shape.as_list()[0]
+        self.max_batch_size = min(max_batch_size or self.batch_size, self.batch_size)
+        self.outputs = outputs
+        self.steps_per_request = steps_per_request
+        self.max_latency = max_latency
+        self.max_streams = max_streams
+        self.streams = collections.OrderedDict()
+        self.queue = None
+        self._deferred = []
+        self.latencies = collections.deque(maxlen=n_latencies)
+        self.batch_sizes = collections.deque(maxlen=n_latencies)
+        self.n_requests = 0
+
+    def run_batch(self, inputs, carries):
+        """
+        Runs a batch of inputs from the carries of its samples (blocking). Returns the
+        outputs of every sample and their next carries
+        """
+        n = len(inputs)
+        inputs = np.stack(inputs)
+        if n < self.batch_size:
+            inputs = np.concatenate([inputs, np.zeros((self.batch_size - n,) + inputs.shape[1:], inputs.dtype)])
+        carry = Step.stack(carries, self.batch_size)
+        for _ in range(self.steps_per_request):
+            outputs, carry = self.step.run(self.sess, {self.input_node: inputs}, carry, fetches=self.outputs)
+        sample_outputs = [dict((node, out[i]) for node, out in outputs.items()) for i in range(n)]
+        return sample_outputs, Step.unstack(carry, n)
+
+    def _carry(self, stream, reset):
+        if stream is None or reset or stream not in self.streams:
+            return self.step.zero_carry()
+        self.streams.move_to_end(stream)
+        return self.streams[stream]
+
+    def _save_carry(self, stream, carry):
+        if stream is None:
+            return
+        self.streams[stream] = carry
+        self.streams.move_to_end(stream)
+        while len(self.streams) > self.max_streams:
+            self.streams.popitem(last=False)
+
+    async def predict(self, inp, stream=None, reset=False):
+        """
+        Queues one sample and returns its outputs once its batch has run. Raises a ValueError
+        if its shape is not that of one sample of the input, which would fail its whole batch
+        """
+        inp = np.asarray(inp, dtype=self.input.dtype.as_numpy_dtype)
+        expected = self.input.shape.as_list()[1:]
+        if inp.ndim != len(expected) or any(e is not None and d != e for d, e in zip(inp.shape, expected)):
+            raise ValueError('Input of shape {} given, expected {}'.format(list(inp.shape), expected))
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((inp, stream, reset, time.time(), future))
+        return await future
+
+    async def batcher(self):
+        """
+        Collects queued requests into batches and runs them in a worker thread
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            if len(self._deferred) > 0:
+                requests, self._deferred = self._deferred, []
+            else:
+                requests = [await self.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # a stream can only be in a batch once; its later requests go first into the next batch
+            batch, streams = [], set()
+            for request in requests:
+                stream = request[1]
+                if stream is not None and stream in streams:
+                    self._deferred.append(request)
+                else:
+                    streams.add(stream)
+                    batch.append(request)
+
+            inputs = [inp for inp, _, _, _, _ in batch]
+            carries = [self._carry(stream, reset) for _, stream, reset, _, _ in batch]
+            try:
+                outputs, carries = await loop.run_in_executor(None, self.run_batch, inputs, carries)
+            except asyncio.CancelledError:
+                # stopped while the batch ran
+                for request in batch:
+                    request[-1].cancel()
+                raise
+            except Exception as e:
+                for request in batch:
+                    request[-1].set_exception(e)
+                continue
+            now = time.time()
+            self.batch_sizes.append(len(batch))
+            for (_, stream, _, start, future), output, carry in zip(batch, outputs, carries):
+                self._save_carry(stream, carry)
+                self.latencies.append(now - start)
+                self.n_requests += 1
+                future.set_result(output)
+
+    def metrics(self):
+        latencies = np.array(self.latencies) if len(self.latencies) > 0 else np.zeros(1)
+        queue_depth = len(self._deferred) + (self.queue.qsize() if self.queue is not None else 0)
+        return {'queue_depth': queue_depth,
+                'p50_latency': float(np.percentile(latencies, 50)),
+                'p99_latency': float(np.percentile(latencies, 99)),
+                'n_requests': self.n_requests,
+                'n_streams': len(self.streams),
+                'mean_batch_size': float(np.mean(self.batch_sizes)) if len(self.batch_sizes) > 0 else 0.}
+
+    async def _respond(self, writer, status, body):
+        body = json.dumps(body).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+            status, HTTP_STATUS[status], len(body)).encode('utf-8') + body)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """
+        Serves the HTTP requests of one connection
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path = request_line.decode('utf-8').split()[:2]
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('utf-8').strip()
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'GET' and path == '/metrics':
+                    await self._respond(writer, 200, self.metrics())
+                elif method == 'POST' and path == '/predict':
+                    start = time.time()
+                    try:
+                        request = json.loads(body.decode('utf-8'))
+                        outputs = await self.predict(request['input'], request.get('stream'),
+                                                     request.get('reset', False))
+                    except (ValueError, KeyError) as e:
+                        await self._respond(writer, 400, {'error': str(e)})
+                        continue
+                    except Exception as e:
+                        # e.g. errors of the session, which would otherwise leave the client waiting
+                        await self._respond(writer, 500, {'error': '{}: {}'.format(type(e).__name__, e)})
+                        continue
+                    await self._respond(writer, 200, {'outputs': dict((k, v.tolist()) for k, v in outputs.items()),
+                                                      'latency': time.time() - start})
+                else:
+                    await self._respond(writer, 404, {'error': 'Unknown endpoint {} {}'.format(method, path)})
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8080, unix_socket=None):
+        """
+        Starts the batcher and listens on host:port, or on unix_socket if given.
+        Returns the asyncio server
+        """
+        self.queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self.batcher())
+        if unix_socket is not None:
+            self._server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+        else:
+            self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server
+
+    async def stop(self):
+        """
+        Stops listening and batching. Requests that have not run yet are cancelled
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        pending, self._deferred = self._deferred, []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for request in pending:
+            if not request[-1].done():
+                request[-1].cancel()
+
+    def serve_forever(self, **kwargs):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.start(**kwargs))
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self.stop())
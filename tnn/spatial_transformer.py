@@ -15,7 +15,7 @@
 import tensorflow as tf
 
 
-def transformer(U, theta, out_size, name='SpatialTransformer', **kwargs):
+def transformer(U, theta, out_size, name='SpatialTransformer', num_transforms=1, **kwargs):
     """Spatial Transformer Layer
 
     Implements a spatial transformer layer as described in [1]_.
@@ -31,6 +31,11 @@ def transformer(U, theta, out_size, name='SpatialTransformer', **kwargs):
         localisation network should be [num_batch, 6].
     out_size: tuple of two ints
         The size of the output of the network (height, width)
+    num_transforms: int
+        Number of transformations applied to each input. theta is then
+        [num_batch*num_transforms, 6], ordered by input first, and the
+        output holds num_batch*num_transforms images sampled directly
+        from U without replicating it.
 
     References
     ----------
@@ -92,7 +97,8 @@ def transformer(U, theta, out_size, name='SpatialTransformer', **kwargs):
             y1 = tf.clip_by_value(y1, zero, max_y)
             dim2 = width
             dim1 = width*height
-            base = _repeat(tf.range(num_batch)*dim1, out_height*out_width)
+            # all transforms of an input index into the same image of im
+            base = _repeat(tf.range(num_batch)*dim1, num_transforms*out_height*out_width)
             base_y0 = base + y0*dim2
             base_y1 = base + y1*dim2
             idx_a = base_y0 + x0
@@ -155,13 +161,12 @@ def transformer(U, theta, out_size, name='SpatialTransformer', **kwargs):
             out_height = out_size[0]
             out_width = out_size[1]
             grid = _meshgrid(out_height, out_width)
-            grid = tf.expand_dims(grid, 0)
-            grid = tf.reshape(grid, [-1])
-            grid = tf.tile(grid, tf.stack([num_batch]))
-            grid = tf.reshape(grid, tf.stack([num_batch, 3, -1]))
 
             # Transform A x (x_t, y_t, 1)^T -> (x_s, y_s)
-            T_g = tf.matmul(theta, grid)
+            # the grid is shared by all transforms, so apply them as one
+            # matmul instead of tiling the grid per transform
+            T_g = tf.matmul(tf.reshape(theta, (-1, 3)), grid)
+            T_g = tf.reshape(T_g, tf.stack([-1, 2, out_height*out_width]))
             x_s = tf.slice(T_g, [0, 0, 0], [-1, 1, -1])
             y_s = tf.slice(T_g, [0, 1, 0], [-1, 1, -1])
             x_s_flat = tf.reshape(x_s, [-1])
@@ -172,7 +177,7 @@ def transformer(U, theta, out_size, name='SpatialTransformer', **kwargs):
                 out_size)
 
             output = tf.reshape(
-                input_transformed, tf.stack([num_batch, out_height, out_width, num_channels]))
+                input_transformed, tf.stack([num_batch*num_transforms, out_height, out_width, num_channels]))
             return output
 
     with tf.variable_scope(name):
@@ -195,9 +200,11 @@ def batch_transformer(U, thetas, out_size, name='BatchSpatialTransformer'):
 
     Returns: float
         Tensor of size [num_batch*num_transforms,out_height,out_width,num_channels]
+
+    Each transform samples from its own input in U, so U is never
+    replicated and memory scales with the size of the output only.
     """
     with tf.variable_scope(name):
-        num_batch, num_transforms = map(int, thetas.get_shape().as_list()[:2])
-        indices = [[i]*num_transforms for i in xrange(num_batch)]
-        input_repeated = tf.gather(U, tf.reshape(indices, [-1]))
-        return transformer(input_repeated, thetas, out_size)
+        num_transforms = int(thetas.get_shape().as_list()[1])
+        thetas = tf.reshape(thetas, [-1, 6])
+        return transformer(U, thetas, out_size, num_transforms=num_transforms)
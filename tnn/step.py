@@ -0,0 +1,237 @@
+"""
+A TNN as a single time step whose previous outputs and states are fed in
+
+`tnn.main.unroll` builds the whole sequence of time steps in one graph. For streaming,
+serving and early exit it is useful to run one step at a time instead and carry the
+outputs and states between session runs, possibly for a batch assembled from
+different streams. The carry is a flat list of arrays, so that the carries of single
+samples can be stacked into a batch and a batch split back into samples.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.util import nest
+
+from tnn import main
+
+
+class Step(object):
+    """
+    Graph of one time step of an initialized TNN, built by build_step.
+
+    :Attributes:
+        - inputs (dict)
+            External input tensor of each input node
+        - carry (list)
+            Placeholders of the previous outputs and states of all nodes
+        - next_carry (list)
+            The outputs and states after the step, in the same order as carry
+        - outputs (dict)
+            Output of each node after the step
+        - first_carry and first_outputs
+            The same for the first time step, where no previous outputs or states exist
+            (as at t=0 of unroll)
+    """
+
+    def __init__(self, inputs, carry, next_carry, outputs, first_carry, first_outputs):
+        self.inputs = inputs
+        self.carry = carry
+        self.next_carry = next_carry
+        self.outputs = outputs
+        self.first_carry = first_carry
+        self.first_outputs = first_outputs
+
+    def zero_carry(self):
+        """
+        Carry of one sample (without the batch dimension) before the first step.
+
+        With the default zeros input_init and state_init, a step from the zero carry is
+        the same as the first step.
+        """
+        return [np.zeros(c.shape.as_list()[1:], dtype=c.dtype.as_numpy_dtype) for c in self.carry]
+
+    @staticmethod
+    def stack(carries, batch_size=None):
+        """
+        Stacks the carries of samples into a batch carry, padded with zeros to batch_size
+        """
+        batch = [np.stack(arrays) for arrays in zip(*carries)]
+        if batch_size is not None and len(carries) < batch_size:
+            batch = [np.concatenate([b, np.zeros((batch_size - len(carries),) + b.shape[1:], b.dtype)])
+                     for b in batch]
+        return batch
+
+    @staticmethod
+    def unstack(carry, n):
+        """
+        Splits the first n samples of a batch carry into carries of single samples
+        """
+        return [[c[i] for c in carry] for i in range(n)]
+
+    def feed_dict(self, inputs, carry=None):
+        """
+        feed_dict of a step from external inputs keyed by input node and a batch carry
+        (None for the first step)
+        """
+        feed_dict = dict((self.inputs[node], value) for node, value in inputs.items())
+        if carry is not None:
+            feed_dict.update(zip(self.carry, carry))
+        return feed_dict
+
+    def run(self, sess, inputs, carry=None, fetches=None):
+        """
+        Runs one step. Returns the outputs of fetches (node names, by default all nodes)
+        as a dict and the next carry
+        """
+        fetches = list(self.outputs.keys()) if fetches is None else fetches
+        if carry is None:
+            outputs, next_carry = self.first_outputs, self.first_carry
+        else:
+            outputs, next_carry = self.outputs, self.next_carry
+        return sess.run((dict((node, outputs[node]) for node in fetches), next_carry),
+                        feed_dict=self.feed_dict(inputs, carry))
+
+
+def _placeholder_like(tensor, name):
+    return tf.placeholder(tensor.dtype, tensor.shape, name=name)
+
+
+def time_sep_nodes(G):
+    """
+    Nodes with pre-memory, memory or post-memory ops that have separate variables per time step
+    """
+    nodes = []
+    for node, attr in G.nodes(data=True):
+        cell = attr['cell']
+        ops = getattr(cell, '_pre_memory_ops', []) + getattr(cell, '_post_memory_ops', [])
+        memory_kwargs = getattr(cell, 'memory', (None, None))[1] or {}
+        if any(op[3] for op in ops) or memory_kwargs.get('time_sep', False):
+            nodes.append(node)
+    return sorted(nodes)
+
+
+def _check_no_time_sep(G):
+    """
+    A step is built once and reused at every time step, which ops with separate variables
+    per time step cannot be
+    """
+    nodes = time_sep_nodes(G)
+    if len(nodes) > 0:
+        raise ValueError('A step requires ops that share their variables across time (no time_sep), '
+                         'but nodes {} have time_sep ops'.format(nodes))
+
+
+def first_update(G, inputs):
+    """
+    Outputs and states of all nodes after the first time step (as at t=0 of `tnn.main.unroll`),
+    from the external inputs, input_init stand-ins and initial states
+    """
+    _check_no_time_sep(G)
+    outputs = {}
+    states = {}
+    for node in sorted(G.nodes()):
+        attr = G.node[node]
+        main.reset_delta(attr['cell'])
+        node_inputs = [inputs[node]] if node in inputs else []
+        for pred in sorted(G.predecessors(node)):
+            cell = G.node[pred]['cell']
+            node_inputs.append(cell.input_init[0](shape=G.node[pred]['output_shape'],
+                                                  name=pred + '/standin',
+                                                  **cell.input_init[1]))
+        outputs[node], states[node] = attr['cell'](inputs=node_inputs, state=None)
+    return outputs, states
+
+
+def update(G, inputs, prev_outputs, prev_states):
+    """
+    Outputs and states of all nodes after a time step from the previous outputs and states
+    (dicts keyed by node), as at t>0 of `tnn.main.unroll`
+    """
+    _check_no_time_sep(G)
+    outputs = {}
+    states = {}
+    for node in sorted(G.nodes()):
+        attr = G.node[node]
+        main.reset_delta(attr['cell']) # the previous step is an argument, not in the graph
+        node_inputs = [inputs[node]] if node in inputs else []
+        node_inputs.extend(prev_outputs[pred] for pred in sorted(G.predecessors(node)))
+        outputs[node], states[node] = attr['cell'](inputs=node_inputs, state=prev_states[node])
+    return outputs, states
+
+
+def flatten_carry(outputs, states):
+    """
+    Flat list of the outputs and (nested) states of all nodes, in sorted node order
+    """
+    carry = []
+    for node in sorted(outputs.keys()):
+        carry.append(outputs[node])
+        if states[node] is not None:
+            carry.extend(nest.flatten(states[node]))
+    return carry
+
+
+def unflatten_carry(carry, outputs, states):
+    """
+    Inverse of flatten_carry, with the outputs and states dicts giving the structure
+    """
+    carry = list(carry)
+    new_outputs = {}
+    new_states = {}
+    for node in sorted(outputs.keys()):
+        new_outputs[node] = carry.pop(0)
+        if states[node] is None:
+            new_states[node] = None
+        else:
+            n = len(nest.flatten(states[node]))
+            new_states[node] = nest.pack_sequence_as(states[node], carry[:n])
+            carry = carry[n:]
+    return new_outputs, new_states
+
+
+def build_step(G, inputs):
+    """
+    Builds one time step of G as a graph whose previous outputs and states are placeholders.
+
+    Nodes are updated as in `tnn.main.unroll`: from the external input (for input nodes)
+    and the outputs of their predecessors at the previous step. The cells are called once
+    for the first step (with input_init stand-ins and initial states, which defines the
+    structure of the states) and once more on the placeholders.
+
+    :Args:
+        - G
+            NetworkX DiGraph initialized with `tnn.main.init_nodes`
+        - inputs (dict)
+            External input tensor (e.g. a placeholder) of each input node
+    :Returns:
+        A Step
+    """
+    with tf.name_scope('first_step'):
+        first_outputs, first_states = first_update(G, inputs)
+
+    with tf.name_scope('carry'):
+        prev_outputs = dict((node, _placeholder_like(output, node + '_output'))
+                            for node, output in first_outputs.items())
+        prev_states = {}
+        for node, state in first_states.items():
+            prev_states[node] = None if state is None else nest.map_structure(
+                lambda s: _placeholder_like(s, node + '_state'), state)
+
+    with tf.name_scope('step'):
+        outputs, states = update(G, inputs, prev_outputs, prev_states)
+
+    return Step(inputs, flatten_carry(prev_outputs, prev_states), flatten_carry(outputs, states), outputs,
+                flatten_carry(first_outputs, first_states), first_outputs)
+
+
+def build_step_from_json(json_file, input_node, input_shape, batch_size):
+    """
+    Step of the TNN of json_file with a placeholder of shape [batch_size] + input_shape
+    as the external input of input_node
+    """
+    inp = tf.placeholder(tf.float32, [batch_size] + list(input_shape), name='input')
+    G = main.graph_from_json(json_file)
+    main.init_nodes(G, input_nodes=[input_node], batch_size=batch_size)
+    return build_step(G, {input_node: inp})